@@ -3,7 +3,22 @@ import csv
 from datetime import datetime
 import random
 import os
-import pandas as pd
+import json
+import hashlib
+import sys
+from collections import deque
+from functools import lru_cache
+
+from cache import RESULT_CACHE_VERSION
+from checkpoint import Checkpoint
+from engine import ArrayEngine
+from houses import ALLOCATION_POLICIES, House, HouseBank
+from ledger import TransactionLedger
+from logs import ColumnarLog, HouseLogSink, RingBuffer, save_columns
+from market import MarketClearing
+from parallel import ParallelEngine, default_partitions
+from stats import SimulationStats
+from topology import Topology
 
 
 
@@ -15,17 +30,107 @@ sunlight_intensity = avg_sunlight_intensity + 0.5 * np.sin((hours - 6) * np.pi /
 
 
 
+@lru_cache(maxsize=None)
+def pv_trace(latitude=None, cloudiness=0.0, persistence=0.7, seed=0):
+    """
+    Hourly PV output per kW of capacity over a 365-day year, as a read-only
+    array of 8760 values. Memoized on the site parameters, so every grid of a
+    region with the same parameters shares one precomputed trace.
+
+    The clear-sky output follows the sun's elevation for the latitude and day
+    of year; with latitude None the sunlight_intensity curve is used every day.
+    Clouds follow a day-to-day AR(1) process around the mean cloud cover
+    `cloudiness` (0 to 1) and reduce the output with the Kasten-Czeplak
+    relation 1 - 0.75 * cover ** 3.4.
+
+    :param persistence: Correlation of the cloud cover from one day to the next.
+    :param seed: Seed of the cloud process.
+    """
+    if not 0 <= cloudiness <= 1:
+        raise ValueError("cloudiness should be between 0 and 1.")
+    if not 0 <= persistence < 1:
+        raise ValueError("persistence should be between 0 and 1 (exclusive).")
+
+    hour_of_year = np.arange(365 * 24)
+    if latitude is None:
+        clear_sky = np.tile(sunlight_intensity, 365)
+    else:
+        if not -90 <= latitude <= 90:
+            raise ValueError("latitude should be between -90 and 90.")
+        day = hour_of_year // 24 + 1
+        declination = np.radians(23.44) * np.sin(2 * np.pi * (284 + day) / 365)
+        hour_angle = np.radians(15 * (hour_of_year % 24 + 0.5 - 12))  # Middle of the hour
+        phi = np.radians(latitude)
+        sin_elevation = np.sin(phi) * np.sin(declination) + np.cos(phi) * np.cos(declination) * np.cos(hour_angle)
+        clear_sky = np.maximum(sin_elevation, 0)
+
+    trace = clear_sky
+    if cloudiness > 0:
+        rng = np.random.default_rng(seed)
+        shocks = rng.standard_normal(365) * np.sqrt(1 - persistence ** 2)
+        anomaly = np.empty(365)
+        previous = 0.0
+        for day, shock in enumerate(shocks.tolist()):
+            previous = persistence * previous + shock
+            anomaly[day] = previous
+        spread = min(cloudiness, 1 - cloudiness)
+        cover = np.clip(cloudiness + spread * anomaly, 0, 1)
+        trace = clear_sky * (1 - 0.75 * np.repeat(cover, 24) ** 3.4)
+
+    trace.setflags(write=False)
+    return trace
+
+
+class SolarSite:
+    """
+    Location and weather of a PV installation, for SolarPV output that follows
+    the time of day and year instead of the flat random 9-to-17 model.
+
+    :param latitude: Degrees north, None for the sunlight_intensity curve.
+    :param cloudiness: Mean cloud cover, 0 (clear) to 1 (overcast).
+    :param persistence: Day-to-day correlation of the cloud cover.
+    :param seed: Seed of the cloud process.
+    :param start_day: Day of the year (0-364) of simulation hour 0.
+    """
+
+    def __init__(self, latitude=None, cloudiness=0.0, persistence=0.7, seed=0, start_day=0):
+        self.latitude = latitude
+        self.cloudiness = cloudiness
+        self.persistence = persistence
+        self.seed = seed
+        self.start_day = start_day
+        self.trace = pv_trace(latitude, cloudiness, persistence, seed)
+
+    def index(self, hours):
+        """
+        Position in the trace of the hour containing simulation time `hours`.
+        """
+        return (24 * self.start_day + np.floor(hours).astype(int)) % len(self.trace)
+
+    def output(self, hours):
+        """
+        PV output per kW of capacity at simulation time `hours`.
+        """
+        return self.trace[self.index(hours)].item()
+
+
 class SolarPV:
-    def __init__(self, capacity):
+    def __init__(self, capacity, site=None):
         self.capacity = capacity  # Capacity in kW
+        self.site = site  # Optional SolarSite, output is looked up in its trace
         self.total_energy_generated = 0
         
-    def generate_energy(self, hours):
+    def generate_energy(self, hours, duration=1):
+        if self.site is not None:
+            energy = self.capacity * self.site.output(hours) * duration
+            self.total_energy_generated += energy
+            return energy
+
         # Assuming significant energy is generated only between 9 am and 5 pm
         if 9 <= hours % 24 < 17:
-            # Energy in kWh generated in one hour
+            # Energy in kWh generated in one step of `duration` hours
             # Generate a random amount of energy between 50% and 100% of the capacity
-            energy = self.capacity * random.uniform(0.7, 0.95)
+            energy = self.capacity * random.uniform(0.7, 0.95) * duration
             self.total_energy_generated += energy
             return energy
         else:
@@ -85,116 +190,187 @@ class Battery:
         
         
         
-class House:
-    def __init__(self, id, base_demand, demand_profile):
-        # Check that demand_profile is a list with 24 elements
-        if len(demand_profile) != 24:
-            raise ValueError("demand_profile should have 24 values representing hourly consumption.")
-        
-        self.id = id
-        self.base_demand = base_demand
-        self.current_demand = self.base_demand
-        self.demand_profile = demand_profile
-        self.unmet_demand = 0
-        self.grid = None
-        self.cost = 0
-        self.simulation_time = 0
-        self.supplied_energy = 0
-        self.log = []  # A log to keep track of various details
-        self.energy_source = None # This should be updated when energy is supplied
-
-    def assign_to_grid(self, grid):
-        self.grid = grid
-
-    def consume_energy(self, hours):
-        self.current_demand = self.base_demand * self.demand_profile[hours % 24]
-        self.energy_source = "generation" # setting the source to generation as it is during generation
-
-        if self.grid is not None:
-            # energy from ongoing generation
-            supplied_energy = self.grid.supply_energy_to_house(self.current_demand) 
-            # Ensure that supplied energy is not negative.
-            supplied_energy = max(0, supplied_energy)
-            # Unmet demand is current demand minus the energy supplied.
-            self.unmet_demand = max(self.current_demand - supplied_energy, 0)
-            # Update the cost.
-            self.cost += supplied_energy * self.grid.selling_price
-            
-        return self.current_demand
-
-    
-    
-    def supply_energy(self, amount_supplied, simulation_hour, source = 'mixed'):
+class DemandSeries:
+    """
+    Metered demand of many houses, e.g. a year of 15-minute smart meter readings.
+
+    The readings stay in a memory-mapped file. Only the time window a step
+    needs is read, a block of block_hours at a time for the meters of a grid,
+    so a long fleet-wide series is never loaded or copied as a whole.
+
+    :param data: Array of shape (readings, meters) with the kWh of every reading,
+                 e.g. np.load(file_name, mmap_mode='r'), or a pyarrow Table with
+                 one column per meter.
+    :param step_minutes: Minutes covered by one reading, a divisor of 60.
+    :param start_hour: Simulation hour of the first reading.
+    :param repeat: Start over from the first reading after the last one
+                   instead of raising an error.
+    :param block_hours: Hours of readings read from the file at once.
+    """
+
+    def __init__(self, data, step_minutes=60, start_hour=0, repeat=False, block_hours=24):
+        if step_minutes <= 0 or 60 % step_minutes:
+            raise ValueError("step_minutes should divide an hour, e.g. 15 or 60.")
+
+        self.table = None
+        self.names = None
+        self.source = None  # File the readings were opened from, see open
+        if hasattr(data, 'column_names'):
+            self.table = data
+            self.names = list(data.column_names)
+            self.num_readings, self.num_meters = data.num_rows, data.num_columns
+        else:
+            if np.ndim(data) == 1:
+                data = data.reshape(-1, 1)
+            if np.ndim(data) != 2:
+                raise ValueError("data should have shape (readings, meters).")
+            self.data = data
+            self.num_readings, self.num_meters = data.shape
+
+        if self.num_readings == 0:
+            raise ValueError("data should have at least one reading.")
+
+        self.step_minutes = step_minutes
+        self.start_hour = start_hour
+        self.repeat = repeat
+        self.block_readings = max(1, block_hours * 60 // step_minutes)
+        self.blocks = {}  # columns -> (first reading, stop, readings)
+        self._average_day = None
+
+    @classmethod
+    def open(cls, file_name, step_minutes=60, start_hour=0, repeat=False, block_hours=24):
         """
-        Receive supplied energy.
-        
-        :param amount_supplied: Amount of energy supplied in kWh.
+        Memory-map a .npy file of shape (readings, meters) or an Arrow IPC
+        (.arrow/.feather) file with one column per meter.
         """
-        # Update unmet demand
-        self.unmet_demand = max(self.unmet_demand - amount_supplied, 0)
-        
-        # Update current demand (reduce it by the supplied amount)
-        self.current_demand = max(self.current_demand - amount_supplied, 0)
-        
-        # Update cost
-        self.cost += amount_supplied * self.grid.selling_price
-        
-        # Keep track of the total energy supplied to the house
-        self.supplied_energy += amount_supplied
-        
-        # Store the source of energy being supplied
-        self.energy_source = source
-        
-        
-        # Log the information
-        log_entry = {
-            'action': 'energy_supplied',
-            'amount_supplied': amount_supplied,
-            'remaining_unmet_demand': self.unmet_demand,
-            'current_demand': self.current_demand,
-            'total_cost': self.cost,
-            'total_energy_supplied': self.supplied_energy,
-            'energy_source': source
-        }
-        self.log.append(log_entry)
-
-    
-    def log_to_csv(self, simulation_hour):
-        # Assuming you want to create a unique log file for each grid and house
-        if self.grid is not None:
-            grid_id = self.grid.id
-            house_id = self.id
-            file_name = f'house_log_grid_{grid_id}_house_{house_id}.csv'
-            file_is_empty = not os.path.isfile(file_name) or os.path.getsize(file_name) == 0
-
-            with open(file_name, 'a', newline='') as f:
-                writer = csv.writer(f)
-
-                # Write headers if the file is empty
-                if file_is_empty:
-                    headers = ['simulation_hour', 'current_demand', 'unmet_demand', 'cost', 'energy_source']
-                    writer.writerow(headers)
+        if file_name.endswith('.npy'):
+            series = cls(np.load(file_name, mmap_mode='r'), step_minutes, start_hour, repeat, block_hours)
+        else:
+            try:
+                import pyarrow as pa
+            except ImportError:
+                raise ImportError("Reading Arrow demand series requires pyarrow (pip install pyarrow).")
+            table = pa.ipc.open_file(pa.memory_map(file_name)).read_all()
+            series = cls(table, step_minutes, start_hour, repeat, block_hours)
+        series.source = file_name
+        return series
+
+    def fingerprint(self):
+        """
+        Hash identifying the readings: path, size and modification time of the
+        file they were opened from, otherwise their contents.
+        """
+        digest = hashlib.sha256(repr((self.num_readings, self.num_meters, self.names, self.step_minutes,
+                                      self.start_hour, self.repeat)).encode())
+        if self.source is not None:
+            stat = os.stat(self.source)
+            digest.update(repr((os.path.abspath(self.source), stat.st_size, stat.st_mtime_ns)).encode())
+        else:
+            digest.update(np.ascontiguousarray(self._slice(0, self.num_readings, np.arange(self.num_meters))).tobytes())
+        return digest.hexdigest()
 
-                # Write the data
-                current_demand = round(self.current_demand, 3)
-                unmet_demand = round(self.unmet_demand, 3)
-                cost = round(self.cost, 3)
-                energy_source = self.energy_source
-                writer.writerow([simulation_hour, current_demand, unmet_demand, cost, energy_source])
+    @property
+    def end_hour(self):
+        return self.start_hour + self.num_readings * self.step_minutes / 60
 
+    def column(self, meter):
+        """
+        Column of a meter given by index or, for Arrow data, by name.
+        """
+        if isinstance(meter, str):
+            if self.names is None or meter not in self.names:
+                raise ValueError(f"Unknown meter {meter!r}.")
+            return self.names.index(meter)
+        if not 0 <= meter < self.num_meters:
+            raise ValueError(f"meter should be between 0 and {self.num_meters - 1}.")
+        return int(meter)
+
+    def _slice(self, start, stop, columns):
+        # Readings start:stop of some columns, within the data
+        if self.table is not None:
+            if not len(columns):
+                return np.zeros((stop - start, 0))
+            return np.column_stack([self.table.column(c).slice(start, stop - start).to_numpy() for c in columns.tolist()]).astype(float)
+        return np.asarray(self.data[start:stop])[:, columns].astype(float)
+
+    def _load(self, start, stop, columns):
+        if start < 0 or (stop > self.num_readings and not self.repeat):
+            raise ValueError(f"The demand series covers hours {self.start_hour} to {self.end_hour}.")
+
+        parts = []
+        position = start
+        while position < stop:
+            offset = position % self.num_readings
+            n = min(stop - position, self.num_readings - offset)
+            parts.append(self._slice(offset, offset + n, columns))
+            position += n
+        return np.concatenate(parts) if len(parts) > 1 else parts[0]
+
+    def _rows(self, start, stop, columns):
+        key = columns.tobytes()
+        block = self.blocks.get(key)
+        if block is None or not (block[0] <= start and stop <= block[1]):
+            block_stop = start + self.block_readings
+            if not self.repeat:
+                block_stop = min(block_stop, self.num_readings)
+            block_stop = max(stop, block_stop)
+            block = (start, block_stop, self._load(start, block_stop, columns))
+            self.blocks[key] = block
+        return block[2][start - block[0]:stop - block[0]]
+
+    def read(self, hours, duration, columns):
+        """
+        Energy in kWh of the given meter columns from hours to hours + duration.
+        Readings are summed when a step covers several of them and split
+        evenly when a step is shorter than a reading.
+        """
+        columns = np.asarray(columns, dtype=np.int64)
+        minutes = round(duration * 60)
+        if minutes % self.step_minutes and self.step_minutes % minutes:
+            raise ValueError(f"A {minutes}-minute step does not line up with {self.step_minutes}-minute readings.")
+
+        first = int(np.floor((hours - self.start_hour) * 60 / self.step_minutes + 1e-9))
+        if minutes >= self.step_minutes:
+            rows = self._rows(first, first + minutes // self.step_minutes, columns)
+            return rows.sum(axis=0) if len(rows) > 1 else rows[0]
+        return self._rows(first, first + 1, columns)[0] * (minutes / self.step_minutes)
+
+    def average_day(self):
+        """
+        Mean kWh of every meter for each hour of the day, shape (24, meters).
+        Computed once, reading the file block by block.
+        """
+        if self._average_day is None:
+            columns = np.arange(self.num_meters)
+            hours_per_reading = self.step_minutes / 60
+            sums = np.zeros((24, self.num_meters))
+            hours_covered = np.zeros(24)
+            for start in range(0, self.num_readings, self.block_readings):
+                stop = min(start + self.block_readings, self.num_readings)
+                rows = self._slice(start, stop, columns)
+                hour_of_day = ((self.start_hour + np.arange(start, stop) * hours_per_reading) % 24).astype(int)
+                for hour in np.unique(hour_of_day).tolist():
+                    selected = hour_of_day == hour
+                    sums[hour] += rows[selected].sum(axis=0)
+                    hours_covered[hour] += selected.sum() * hours_per_reading
+            self._average_day = sums / np.where(hours_covered > 0, hours_covered, 1)[:, None]
+        return self._average_day
 
-    def step(self, hours):
-        self.consume_energy(hours)
-        self.log_to_csv(simulation_hour=hours)
-        self.simulation_time += 1
 
+class ConventionalGrid:
+    # Running totals saved in a Checkpoint
+    state_fields = ('energy_purchased', 'energy_sold', 'cgrevenue')
 
-        
+    def __init__(self, buying_price, selling_price, max_supply=None):
+        if max_supply is not None and max_supply < 0:
+            raise ValueError("max_supply should be a non-negative number.")
 
-class ConventionalGrid:
-    def __init__(self, buying_price, selling_price):
         self.buying_price = buying_price  # Price at which the grid buys excess energy from mini-grids
         self.selling_price = selling_price  # Price at which the grid sells energy to mini-grids
+        # Most energy in kWh the grid sells to one mini-grid per hour, None for no limit and
+        # 0 for an islanded network. Deficits beyond it are left unmet and shared out by
+        # the mini-grid's allocation policy.
+        self.max_supply = max_supply
         self.energy_purchased = 0  # Total energy purchased from mini-grids
         self.energy_sold = 0  # Total energy sold to mini-grids
         self.cgrevenue = 0  # Net revenue earned by the grid
@@ -220,6 +396,12 @@ class ConventionalGrid:
         self.cgrevenue += cost
        # print(f"Conventional Grid selling {amount} energy for {cost} cost.") # Debugging print statement
         return cost  # Returning the cost for the mini-grid to update its expenses
+
+    def supply_limit(self, step_hours=1):
+        """
+        Most energy in kWh the grid sells to one mini-grid in a step of step_hours.
+        """
+        return float('inf') if self.max_supply is None else self.max_supply * step_hours
     
     def report(self):
         """
@@ -233,7 +415,15 @@ class ConventionalGrid:
         
 
 class MiniGrid:
-    def __init__(self, id, houses, avg_sunlight_hours , selling_price, num_days_backup, neighboring_grids, conventional_grid, safety_factor):
+    # Columns of the full-precision log
+    log_columns = ['simulation_hour', 'generation_kWh', 'total_demand_kWh', 'unmet_demand_kWh', 'revenue_USD', 'battery_level_kWh', 'battery_%']
+    # Running totals saved in a Checkpoint, next to the battery and PV state
+    state_fields = ('total_generation', 'generation', 'total_demand', 'unmet_demand', 'grid_transactions', 'revenue', 'simulation_time')
+    # total_generation too: the pool keeps the generation the houses leave unused
+    accumulating_fields = ('total_generation', 'grid_transactions', 'revenue', 'simulation_time')
+
+    def __init__(self, id, houses, avg_sunlight_hours , selling_price, num_days_backup, neighboring_grids, conventional_grid, safety_factor, site=None,
+                 total_daily_energy_requirement=None, allocation='order'):
         
          # Check that avg_sunlight_hours is in a reasonable range
         if not (0 <= avg_sunlight_hours <= 24):
@@ -250,15 +440,24 @@ class MiniGrid:
         # Check that safety_factor is positive
         if safety_factor <= 0:
             raise ValueError("safety_factor should be a positive number.")
+
+        if allocation not in ALLOCATION_POLICIES:
+            raise ValueError(f"allocation should be one of {', '.join(ALLOCATION_POLICIES)}.")
         
         
         
         self.id = id
         self.houses = houses
+        # Columnar state of the houses; House objects passed in become views on it
+        self.bank = houses if isinstance(houses, HouseBank) else HouseBank.from_houses(houses)
+        self.bank.grid = self
         self.selling_price = selling_price
         self.neighboring_grids = neighboring_grids
+        self.topology = None  # Set by Topology.attach
+        self.step_hours = 1  # Length of a simulation step in hours, set by Simulation
         self.conventional_grid = conventional_grid
         self.safety_factor = safety_factor
+        self.allocation = allocation  # How acquired energy is shared among the houses, see allocate
         self.revenue = 0.0      
         self.total_demand = 0
         self.unmet_demand = 0
@@ -268,17 +467,21 @@ class MiniGrid:
         self.internal_transactions_log = []
         self.external_transactions_log = []
         self.log = []
+        self.columnar_log = ColumnarLog(self.log_columns, transactions=True, enabled=False)
         
         
-          # Calculate average daily energy requirement
+          # Calculate average daily energy requirement, summed house by house and hour by hour,
+          # unless the caller worked it out for many grids at once (see build_simulation)
         self.total_daily_energy_requirement = 0
-        for house in houses:
-            for hour in range(24):
-                self.total_daily_energy_requirement += house.base_demand * house.demand_profile[hour]
+        if total_daily_energy_requirement is not None:
+            self.total_daily_energy_requirement = total_daily_energy_requirement
+        elif len(self.bank):
+            daily = np.add.accumulate(self.bank.demand_table().T.ravel())
+            self.total_daily_energy_requirement = daily[-1].item()
         
         # Calculate solar panel capacity (capacity in kW)
         # Using a safety factor to account for days with less sunlight
-        self.solar_pv = SolarPV(self.total_daily_energy_requirement * safety_factor / avg_sunlight_hours)        
+        self.solar_pv = SolarPV(self.total_daily_energy_requirement * safety_factor / avg_sunlight_hours, site)        
         
         # Calculate battery capacity
         # It should store enough energy to provide for daily usage, plus some extra for backup
@@ -291,8 +494,9 @@ class MiniGrid:
         
 
         # Associate the MiniGrid with the houses
-        for house in self.houses:
-            house.grid = self
+        if not isinstance(houses, HouseBank):
+            for house in self.houses:
+                house.grid = self
 
             
 
@@ -340,31 +544,61 @@ class MiniGrid:
     
     
     
+    def consume(self, hours):
+        """
+        Let every house take its demand for the step from the generation pool and
+        add the revenue for the energy supplied from ongoing generation.
+
+        :return: Total demand of the houses.
+        """
+        demand, self.total_generation = self.bank.consume(hours, self.total_generation, self.selling_price, self.step_hours)
+        if not len(demand):
+            return 0
+
+        # Summed house by house, like a loop over House.consume_energy
+        from_generation = np.minimum(self.generation, demand) * self.selling_price
+        self.revenue = np.add.accumulate(np.concatenate([[self.revenue], from_generation]))[-1].item()
+        return np.add.accumulate(demand)[-1].item()
+
+
+    def supply_houses(self, energy):
+        """
+        Distribute energy among the houses according to their unmet demand
+        and add the revenue for it.
+        """
+        supplied = self.bank.distribute(energy, self.selling_price, policy=self.allocation)
+        self.revenue = np.add.accumulate(np.concatenate([[self.revenue], supplied * self.selling_price]))[-1].item()
+
+
+    def exchange_partners(self, direction):
+        """
+        Neighbouring grids to trade with, in the order they are tried.
+
+        :param direction: 'supply' when offering surplus, 'demand' when covering a deficit.
+        :return: List of (grid, line) pairs, line is None without a Topology.
+        """
+        if self.topology is None:
+            return [(ng, None) for ng in self.neighboring_grids]
+        return self.topology.partners(self, direction)
+
+
     def step(self, grid_id, hours):
         grid_id = self.id
+        if self.topology is not None:
+            self.topology.start_hour(hours)
 
         # Step 1: Generate Energy
-        self.generation = self.solar_pv.generate_energy(hours)
+        self.generation = self.solar_pv.generate_energy(hours, self.step_hours)
         self.total_generation += self.generation 
 
         # Distribute the energy amongst houses and calculate total demand
-        total_demand = 0
-        energy_supplied_to_houses = 0
-        for house in self.houses:
-            energy_consumed = house.consume_energy(hours)
-            total_demand += energy_consumed
-            energy_supplied_to_houses += energy_consumed
-            
-
-            # Add revenue for energy supplied from ongoing generation
-            energy_from_generation = min(self.generation, energy_consumed)
-            self.revenue += energy_from_generation * self.selling_price
+        total_demand = self.consume(hours)
 
         # Update total_demand
         self.total_demand = total_demand
 
         # Calculate surplus or deficit
-        energy_balance = self.generation - energy_supplied_to_houses
+        energy_balance = self.generation - total_demand
 
         # Initialize excess and shortage
         excess = 0
@@ -377,11 +611,14 @@ class MiniGrid:
             excess = excess_energy
 
             # Offer excess energy to neighboring grids
-            for ng in self.neighboring_grids:
+            for ng, line in self.exchange_partners('supply'):
                 if excess <= 0:
                     break
                 initial_excess = excess
-                excess = ng.accept_energy(excess, from_grid_id=self.id)
+                if line is None:
+                    excess = ng.accept_energy(excess, from_grid_id=self.id)
+                else:
+                    excess = self.topology.offer(line, excess, ng, from_grid_id=self.id)
                 energy_transferred = initial_excess - excess
                 if energy_transferred > 0:
                     self.internal_transactions_log.append((ng.id, energy_transferred, 'supply'))
@@ -414,10 +651,13 @@ class MiniGrid:
 
             # Request energy from neighboring grids if in deficit
             if energy_balance < 0:
-                for ng in self.neighboring_grids:
+                for ng, line in self.exchange_partners('demand'):
                     if energy_balance >= 0:
                         break
-                    energy_provided = ng.provide_energy(abs(energy_balance), to_grid_id=self.id)
+                    if line is None:
+                        energy_provided = ng.provide_energy(abs(energy_balance), to_grid_id=self.id)
+                    else:
+                        energy_provided = self.topology.request(line, abs(energy_balance), ng, to_grid_id=self.id)
                     total_energy_acquired += energy_provided
                     energy_balance += energy_provided
                     if energy_provided > 0:
@@ -425,27 +665,25 @@ class MiniGrid:
 #                        self.internal_transactions_log.append((hours, ng.id, energy_provided, 'demand'))
 
 
-            # Buy energy from the conventional grid if still in deficit
+            # Buy energy from the conventional grid if still in deficit, as much as it supplies
             if energy_balance < 0:
-                amount_needed = abs(energy_balance)
-                cost_of_energy = self.conventional_grid.sell_energy(amount_needed)
-                total_energy_acquired += amount_needed
-                # Storing external transaction ('buy', amount, cost)
-                self.external_transactions_log.append(('buy', amount_needed, cost_of_energy))
-#                self.external_transactions_log.append((hours, 'buy', amount_needed, cost_of_energy))
-                self.revenue -= cost_of_energy  # Subtracting the cost from revenue
+                amount_needed = min(abs(energy_balance), self.conventional_grid.supply_limit(self.step_hours))
+                if amount_needed > 0:
+                    cost_of_energy = self.conventional_grid.sell_energy(amount_needed)
+                    total_energy_acquired += amount_needed
+                    energy_balance += amount_needed
+                    # Storing external transaction ('buy', amount, cost)
+                    self.external_transactions_log.append(('buy', amount_needed, cost_of_energy))
+#                    self.external_transactions_log.append((hours, 'buy', amount_needed, cost_of_energy))
+                    self.revenue -= cost_of_energy  # Subtracting the cost from revenue
+
+            # What nobody could supply stays unmet
+            shortage = max(0, -energy_balance)
 
                 
             # Distribute the total_energy_acquired among houses according to their unmet demand
             if total_energy_acquired > 0:
-                for house in self.houses:
-                    if house.unmet_demand > 0:
-                        energy_for_this_house = min(total_energy_acquired, house.unmet_demand)
-                        house.supply_energy(energy_for_this_house, simulation_hour = hours)
-                        total_energy_acquired -= energy_for_this_house
-                        
-                        # Add revenue for supplying electricity to the house
-                        self.revenue += energy_for_this_house * self.selling_price
+                self.supply_houses(total_energy_acquired)
 
 
 
@@ -457,6 +695,73 @@ class MiniGrid:
         # Return excess and shortage as a tuple
         return excess, shortage
 
+
+    def balance_locally(self, hours):
+        """
+        First half of an hour under market clearing: generate, supply the houses
+        and charge or draw the own battery, without trading.
+
+        :return: (supply, need) - energy this grid can give to other grids
+                 (excess generation plus battery above the 2-day reserve) and
+                 the deficit it still has to cover.
+        """
+        self.generation = self.solar_pv.generate_energy(hours, self.step_hours)
+        self.total_generation += self.generation
+
+        total_demand = self.consume(hours)
+        self.total_demand = total_demand
+
+        energy_balance = self.generation - total_demand
+        self.excess = 0
+        self.energy_acquired = 0
+        need = 0
+        if energy_balance > 0:
+            self.excess = self.battery.store(energy_balance)
+        elif energy_balance < 0:
+            self.energy_acquired = self.battery.draw(abs(energy_balance))
+            need = abs(energy_balance) - self.energy_acquired
+
+        spare_battery = max(0, self.battery.get_level() - 2 * self.total_daily_energy_requirement)
+        return self.excess + spare_battery, need
+
+
+    def settle(self, hours, energy_sent, energy_received, need):
+        """
+        Second half of an hour under market clearing: apply the cleared
+        transfers, trade the rest with the conventional grid, serve the houses
+        and log the hour.
+
+        :return: (excess, shortage) like step.
+        """
+        # Energy sent comes out of the excess first, then the battery
+        from_excess = min(energy_sent, self.excess)
+        self.battery.draw(energy_sent - from_excess)
+        excess = self.excess - from_excess
+
+        if excess > 0:
+            revenue_from_sale = self.conventional_grid.buy_energy(excess)
+            self.external_transactions_log.append(('sell', excess, revenue_from_sale))
+            self.revenue += revenue_from_sale
+
+        total_energy_acquired = self.energy_acquired + energy_received
+        # The conventional grid covers the rest, as much as it supplies
+        supply_limit = self.conventional_grid.supply_limit(self.step_hours)
+        shortage = max(0, need - energy_received - supply_limit)
+        amount_needed = min(need - energy_received, supply_limit)
+        if amount_needed > 0:
+            cost_of_energy = self.conventional_grid.sell_energy(amount_needed)
+            total_energy_acquired += amount_needed
+            self.external_transactions_log.append(('buy', amount_needed, cost_of_energy))
+            self.revenue -= cost_of_energy
+
+        # Distribute the total_energy_acquired among houses according to their unmet demand
+        if total_energy_acquired > 0:
+            self.supply_houses(total_energy_acquired)
+
+        self.unmet_demand = shortage
+        self.log_to_csv(self.id, hours)
+        return excess, shortage
+
         
     
     
@@ -476,6 +781,15 @@ class MiniGrid:
 
         
         
+    def available_energy(self):
+        """
+        Energy this grid could provide to a neighbour right now: the generation
+        surplus plus the battery above its 2-day reserve.
+        """
+        current_surplus = self.total_generation - self.total_demand
+        return max(0, current_surplus) + max(0, self.battery.get_level() - 2 * self.total_daily_energy_requirement)
+
+
     def provide_energy(self, amount_needed, to_grid_id):
         """
         Provide energy to a neighboring mini-grid.
@@ -530,13 +844,22 @@ class MiniGrid:
             'battery_level_kWh': round(self.battery.get_level(), 3),
             'battery_%': round(self.battery.get_state_of_charge(), 2),
         })
+        if self.columnar_log.enabled:
+            self.columnar_log.append(simulation_hour, self.generation, self.total_demand, self.unmet_demand, self.revenue,
+                                     self.battery.get_level(), self.battery.get_state_of_charge())
+            self.columnar_log.append_transactions(simulation_hour, self.internal_transactions_log, self.external_transactions_log)
         
         # Clear the transaction logs after logging
         self.internal_transactions_log.clear()
         self.external_transactions_log.clear()
 
 
-    def save_logs(self):
+    def save_logs(self, file_format='csv'):
+        if file_format != 'csv':
+            # Full precision, transactions as structured columns
+            save_columns(f'mini_grid_log_{self.id}', self.columnar_log, file_format, transactions=True)
+            return
+
         file_name = f'mini_grid_log_{self.id}.csv'
         
         with open(file_name, 'w', newline='') as f:
@@ -553,21 +876,49 @@ class MiniGrid:
             
             
 class Simulation:
-    def __init__(self, conventional_grid, grids):
+    # Columns of the full-precision log
+    log_columns = ['simulation_hour', 'total_generation', 'total_demand', 'unmet_demand', 'total_grid_transactions', 'total_client_expenditure', 'revenue']
+    # Running totals saved in a Checkpoint
+    state_fields = ('total_generation', 'total_demand', 'unmet_demand', 'total_grid_transactions', 'revenue', 'total_client_revenue')
+    accumulating_fields = ('total_generation', 'unmet_demand', 'total_grid_transactions', 'revenue', 'total_client_revenue')
+
+    def __init__(self, conventional_grid, grids, house_log=None, market=None, step_minutes=60):
         self.conventional_grid = conventional_grid
         self.grids = grids
+        self.house_log = house_log if house_log is not None else HouseLogSink()
+        self.market = market  # Optional MarketClearing used instead of greedy neighbour trading
         self.total_generation = 0
         self.total_demand = 0
         self.unmet_demand = 0
         self.total_grid_transactions = 0
         self.revenue = 0
         self.total_client_revenue = 0
+        self.clock = 0  # Steps simulated so far
+        self.stats = None  # SimulationStats, see enable_stats
+        self.live = None  # LiveState, see share_state
+        self.ledger = None  # TransactionLedger, see enable_ledger
+        self.parallel = None  # ParallelEngine kept for the next run, see simulate_days
         self.log = []
+        self.columnar_log = ColumnarLog(self.log_columns, enabled=False)  # See configure_logs
         
         
         # Check that grids is a non-empty list
         if not grids:
             raise ValueError("grids should be a non-empty list.")
+
+        # Simulation clock: steps of step_minutes, times in (fractional) hours
+        if step_minutes <= 0 or 60 % step_minutes:
+            raise ValueError("step_minutes should divide an hour, e.g. 15 or 60.")
+        self.step_minutes = step_minutes
+        self.steps_per_hour = 60 // step_minutes
+        self.step_hours = 1 if self.steps_per_hour == 1 else step_minutes / 60
+        self.time_dtype = np.int64 if self.steps_per_hour == 1 else float
+        for grid in grids:
+            grid.step_hours = self.step_hours
+        if self.steps_per_hour != 1:
+            self.columnar_log = ColumnarLog(self.log_columns, time_dtype=self.time_dtype, enabled=False)
+            for grid in grids:
+                grid.columnar_log = ColumnarLog(grid.log_columns, transactions=True, time_dtype=self.time_dtype, enabled=False)
         
         
 
@@ -576,39 +927,36 @@ class Simulation:
         total_shortage = 0
         
         # Each grid steps
-        for grid_id, grid in enumerate(self.grids):
+        if self.market is not None:
+            results = self.market.step(hours)
+        else:
             # assuming grid.step returns a tuple (excess, shortage)
-            excess, shortage = grid.step(grid_id, hours)
-            
+            results = (grid.step(grid_id, hours) for grid_id, grid in enumerate(self.grids))
+
+        for excess, shortage in results:
             total_excess += excess
             total_shortage += shortage
-                
-        # Load balancing among mini-grids
-        if total_excess > 0 and total_shortage > 0:
-            energy_transfer = min(total_excess, total_shortage)
-            total_excess -= energy_transfer
-            total_shortage -= energy_transfer
             
-        # Transactions with Conventional Grid
+        # Transactions with Conventional Grid. A shortage is demand the grids
+        # could not buy either (see ConventionalGrid.max_supply), it stays unmet.
         if total_excess > 0:
             self.conventional_grid.buy_energy(total_excess)
             self.total_grid_transactions += total_excess
-        elif total_shortage > 0:
-            self.conventional_grid.sell_energy(total_shortage)
-            self.total_grid_transactions -= total_shortage
         
         # Log the state of each house
-        for grid_id, grid in enumerate(self.grids):
-            for house_id, house in enumerate(grid.houses):
-                # assuming log_to_csv accepts necessary information for logging
-                house.log_to_csv(hours)
+        if self.house_log.should_log(hours):
+            for grid in self.grids:
+                bank = grid.bank
+                energy_source = [bank.sources[code] for code in bank.source.tolist()]
+                self.house_log.record_grid(grid, hours, bank.current_demand.tolist(), bank.unmet_demand.tolist(),
+                                           bank.cost.tolist(), energy_source)
         
         
         # Compute total metrics
         self.total_generation = sum(grid.total_generation for grid in self.grids)
         self.total_demand = sum(grid.total_demand for grid in self.grids)
         self.unmet_demand += total_shortage
-        self.total_client_revenue = sum(house.cost for grid in self.grids for house in grid.houses)
+        self.total_client_revenue = sum(np.concatenate([grid.bank.cost for grid in self.grids]).tolist())
         self.revenue = sum(grid.revenue for grid in self.grids)
 
         
@@ -616,6 +964,8 @@ class Simulation:
 
         # Log the total metrics
         self.log_to_csv(hours)
+        if self.live is not None:
+            self.live.publish(self, hours)
 
     
     def log_to_csv(self, simulation_hour):
@@ -629,27 +979,667 @@ class Simulation:
             'total_client_expenditure': round(self.total_client_revenue, 3),
             'revenue': round(self.revenue, 3),
         })
+        if self.columnar_log.enabled:
+            self.columnar_log.append(simulation_hour, self.total_generation, self.total_demand, self.unmet_demand,
+                                     self.total_grid_transactions, self.total_client_revenue, self.revenue)
 
     
-    def save_logs(self):
-        file_name = 'simulation_log.csv'
-        
-        with open(file_name, 'w', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=self.log[0].keys())
-            writer.writeheader()
-            writer.writerows(self.log)    
+    def save_logs(self, file_format='csv'):
+        if file_format != 'csv':
+            save_columns('simulation_log', self.columnar_log, file_format)
+        else:
+            file_name = 'simulation_log.csv'
+
+            with open(file_name, 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=self.log[0].keys())
+                writer.writeheader()
+                writer.writerows(self.log)
+
+        # Write out the buffered house logs
+        self.house_log.flush()
         
         
     
 
-    def simulate_days(self, num_days):
+    def time(self, step):
+        """
+        Simulation time in hours at the start of a step. Whole hours stay ints
+        on an hourly clock.
+        """
+        return step if self.steps_per_hour == 1 else step / self.steps_per_hour
+
+
+    def simulate_days(self, num_days, vectorized=False, cache=None, fast_forward=None, processes=None):
+        """
+        :param cache: Optional ResultCache. A run already in the cache is
+                      replayed instead of simulated: the simulation jumps to
+                      the cached end state and gets the cached log rows.
+                      Only used while house logging is off.
+        :param fast_forward: Tolerance in kWh/USD for detecting a converged
+                             daily cycle, see _fast_forward. None simulates every day.
+                             Only for scenarios whose days have the same inputs
+                             (periodic_days); it raises ValueError otherwise,
+                             e.g. for example_scenario, whose PV output is
+                             drawn at random every hour.
+        :param processes: Run the array engine on this many worker processes,
+                          each advancing a partition of the grids, see
+                          ParallelEngine. The workers are kept for later runs
+                          with the same number of processes. Grids trade across
+                          partitions after the others, so the results are the
+                          ones of ArrayEngine(simulation, partitions) with
+                          default_partitions. 1 runs the array engine in this
+                          process.
+        """
+        if cache is not None and self.house_log.mode == 'off':
+            self._enable_columnar()  # Records hold the columnar rows of the run
+            key = self.cache_key(num_days, fast_forward, processes)
+            record = cache.get(key)
+            if record is not None:
+                self.replay(record)
+                return
+            marks = self.log_marks()
+            self.simulate_days(num_days, vectorized, fast_forward=fast_forward, processes=processes)
+            record = self.run_record(marks)
+            if record is not None:
+                cache.put(key, record)
+            return
+
+        if fast_forward is not None:
+            self._fast_forward(num_days, vectorized, fast_forward, processes)
+            return
+
+        # Runs continue from the clock, e.g. after restoring a Checkpoint
+        first_step = self.clock
+        if vectorized or processes:
+            # Advance every grid and house with the array-backed engine
+            engine = self._parallel_engine(processes) if processes and processes > 1 else ArrayEngine(self)
+            engine.run(first_step // self.steps_per_hour, 24 * num_days)
+            self.clock = first_step + 24 * self.steps_per_hour * num_days
+        else:
+            for day in range(num_days):
+                # Loop through the steps of the day, 24 on an hourly clock
+                for step in range(24 * self.steps_per_hour):
+                    # Get the sunlight intensity for the current hour
+#                    weather_factor = sunlight_intensity[hour]
+                    # Call the step method
+                    self.step(self.time(first_step + 24 * self.steps_per_hour * day + step))
+                    self.clock += 1
+
+        # Buffered house rows would be lost if the process ended without save_logs
+        self.house_log.flush()
+
+
+    def _parallel_engine(self, processes):
+        # Workers of an earlier run if they can run this one
+        if self.parallel is None or not self.parallel.reusable(self, processes):
+            if self.parallel is not None:
+                self.parallel.close()
+            self.parallel = ParallelEngine(self, processes)
+        return self.parallel
+
+
+    def periodic_days(self):
+        """
+        True when every day has the same inputs: every grid takes its PV output
+        from a SolarSite trace that repeats daily (no latitude, no clouds) and
+        every house follows a demand profile.
+        """
+        for grid in self.grids:
+            site = grid.solar_pv.site
+            if site is None or len(grid.bank.metered):
+                return False
+            days = site.trace.reshape(-1, 24)
+            if not (days == days[0]).all():
+                return False
+        return True
+
+
+    def _fast_forward(self, num_days, vectorized, tolerance, processes=None):
+        """
+        Simulate day by day until the days repeat, then extrapolate the
+        remaining days in closed form.
+
+        With day-periodic inputs (see periodic_days) the days repeat once two
+        consecutive days change the state in the same way, within tolerance:
+        battery levels, demands and house states are back where the day
+        started, and every accumulator (revenue, house costs and supplied
+        energy, ConventionalGrid totals, unmet demand and the generation pools,
+        which may only grow) went up by the same amount as the day before.
+        From then on every day adds that increment. The remaining days' log
+        rows are the last day's rows with shifted hours and advanced
+        accumulators. Increments are multiplied rather than added day by day,
+        so the accumulators can differ from a full run in the last bits, and
+        the rounded dict logs by one in the last decimal.
+        """
+        if not self.periodic_days():
+            raise ValueError("fast_forward needs days with the same inputs: SolarSite PV without latitude or clouds and demand profiles.")
+        if self.house_log.mode != 'off':
+            raise ValueError("fast_forward needs house logging off.")
+
+        self._enable_columnar()  # The skipped days are extrapolated from them
+        checkpoints = [self.checkpoint()]
         for day in range(num_days):
-            # Loop through 24 hours
-            for hour in range(24):
-                # Get the sunlight intensity for the current hour
-#                weather_factor = sunlight_intensity[hour]
-                # Call the step method
-                self.step(24 * day + hour)
+            marks = self.log_marks()
+            self.simulate_days(1, vectorized, processes=processes)
+            checkpoints = checkpoints[-2:] + [self.checkpoint()]
+            remaining = num_days - day - 1
+            if remaining and len(checkpoints) == 3 and self._same_cycle(*checkpoints, tolerance):
+                record = self.run_record(marks)
+                if record is not None:
+                    self._extrapolate(checkpoints[1], checkpoints[2], record, remaining)
+                    return
+
+
+    @staticmethod
+    def _same_cycle(first, before, after, tolerance):
+        # The day from before to after changed the state like the day from first to before
+        def repeats(x, y, z, accumulating):
+            if not accumulating:
+                return np.allclose(y, z, rtol=0, atol=tolerance)
+            return np.allclose(np.subtract(z, y), np.subtract(y, x), rtol=0, atol=tolerance)
+
+        states = [first.state, before.state, after.state]
+        for name in Simulation.state_fields:
+            if not repeats(*(state['simulation'][name] for state in states), name in Simulation.accumulating_fields):
+                return False
+        for g in range(len(states[0]['grids'])):
+            x, y, z = (state['grids'][g] for state in states)
+            if y['sources'] != z['sources'] or not repeats(x['battery_level'], y['battery_level'], z['battery_level'], False):
+                return False
+            if z['total_generation'] < y['total_generation'] - tolerance:
+                return False  # A shrinking pool runs out eventually
+            for name in MiniGrid.state_fields:
+                if not repeats(x[name], y[name], z[name], name in MiniGrid.accumulating_fields):
+                    return False
+            for name in HouseBank.state_fields:
+                values = [checkpoint.arrays[f'grid{g}_{name}'] for checkpoint in (first, before, after)]
+                if not repeats(*values, name in HouseBank.accumulating_fields):
+                    return False
+        return True
+
+
+    def _extrapolate(self, before, after, record, days):
+        # Jump `days` repetitions of the day from before to after ahead
+        a, b = before.state, after.state
+        end = Checkpoint(json.loads(json.dumps(b)), dict(after.arrays))
+        deltas = {}
+
+        def advance(section, name, index=None):
+            x = a[section] if index is None else a[section][index]
+            y = b[section] if index is None else b[section][index]
+            delta = y[name] - x[name]
+            target = end.state[section] if index is None else end.state[section][index]
+            target[name] = y[name] + days * delta
+            return delta
+
+        for name in Simulation.accumulating_fields:
+            deltas[name] = advance('simulation', name)
+        for name in ConventionalGrid.state_fields:
+            advance('conventional_grid', name)
+        grid_deltas = []
+        for g in range(len(self.grids)):
+            grid_delta = {name: advance('grids', name, g) for name in MiniGrid.accumulating_fields}
+            advance('grids', 'total_energy_generated', g)
+            for name in HouseBank.accumulating_fields:
+                x, y = before.arrays[f'grid{g}_{name}'], after.arrays[f'grid{g}_{name}']
+                grid_delta[name] = y - x
+                end.arrays[f'grid{g}_{name}'] = y + days * (y - x)
+            grid_deltas.append(grid_delta)
+        day_steps = b['clock'] - a['clock']
+        end.state['clock'] = b['clock'] + days * day_steps
+        self._restore_state(end)
+
+        # Log rows: the day's rows repeated, hours shifted and accumulating columns advanced
+        repeat = np.arange(1, days + 1)
+        simulation_columns = {'total_generation': deltas['total_generation'], 'unmet_demand': deltas['unmet_demand'],
+                              'total_grid_transactions': deltas['total_grid_transactions'],
+                              'total_client_expenditure': deltas['total_client_revenue'], 'revenue': deltas['revenue']}
+        columns = [simulation_columns]
+        for grid_delta in grid_deltas:
+            columns += [{'revenue_USD': grid_delta['revenue']}, {}, {'total_cost': grid_delta['cost'], 'total_energy_supplied': grid_delta['supplied_energy']}]
+
+        extended = []
+        for i, accumulating in enumerate(columns):
+            rows = record.arrays[f'log_{i}']
+            k = np.repeat(repeat, len(rows))
+            rows = np.tile(rows, days)
+            if 'simulation_hour' in rows.dtype.names:
+                rows['simulation_hour'] += k * (day_steps // self.steps_per_hour)
+            for column, delta in accumulating.items():
+                rows[column] += k * (delta[rows['house']] if np.ndim(delta) else delta)
+            extended.append(rows)
+        self._extend_logs(extended)
+
+        # Dict logs are rounded copies of the columnar rows; unchanged columns keep their values and types
+        dict_columns = [(self.log, extended[0], {name: name for name in simulation_columns})]
+        for g, grid in enumerate(self.grids):
+            dict_columns.append((grid.log, extended[1 + 3 * g], {'revenue_USD': 'revenue_USD'}))
+        for (log, rows, names), day_rows, accumulating in zip(dict_columns, record.state['dict_logs'], [columns[0]] + columns[1::3]):
+            names = [name for name in names if accumulating[name]]
+            values = {name: rows[name].tolist() for name in names}
+            hours = day_steps // self.steps_per_hour
+            j = 0
+            for k in range(1, days + 1):
+                for row in day_rows:
+                    row = dict(row, simulation_hour=row['simulation_hour'] + k * hours)
+                    for name in names:
+                        row[name] = round(values[name][j], 3)
+                    log.append(row)
+                    j += 1
+
+
+    def stream(self, num_hours, start_hour=None, block_hours=24, vectorized=False, keep_logs=True):
+        """
+        Run the simulation and yield one delta per simulation step.
+
+        Hours are simulated in blocks of block_hours (with the array engine if
+        vectorized) and the deltas of a block are yielded before the next block
+        runs. With keep_logs=False the in-memory logs are cleared after every
+        block, so memory stays bounded however long the run.
+
+        Each delta is a dict with the simulation totals for the step and, per grid,
+        generation, demand, battery level and state of charge, revenue and the
+        energy transfers of that step. start_hour defaults to the clock. The
+        deltas come from the columnar logs, which are turned on.
+        """
+        self._enable_columnar()
+        engine = ArrayEngine(self) if vectorized else None
+        if start_hour is None:
+            start_hour = self.clock // self.steps_per_hour
+        end_hour = start_hour + num_hours
+
+        for block_start in range(start_hour, end_hour, block_hours):
+            block = min(block_hours, end_hour - block_start)
+            offsets = [grid.columnar_log.transactions.count for grid in self.grids]
+
+            if engine is not None:
+                engine.run(block_start, block)
+            else:
+                for step in range(block_start * self.steps_per_hour, (block_start + block) * self.steps_per_hour):
+                    self.step(self.time(step))
+            self.clock = (block_start + block) * self.steps_per_hour
+            self.house_log.flush()
+
+            yield from self._deltas(block * self.steps_per_hour, offsets)
+
+            if not keep_logs:
+                self.clear_logs()
+
+
+    def _deltas(self, num_steps, offsets):
+        # Per-step deltas for the last num_steps logged steps
+        totals = {name: values.tolist() for name, values in self.columnar_log.tail(num_steps).items()}
+        grids = []
+        for grid, offset in zip(self.grids, offsets):
+            columns = {name: values.tolist() for name, values in grid.columnar_log.tail(num_steps).items()}
+            transactions = grid.columnar_log.transactions
+            rows = transactions.tail(transactions.count - offset)
+            transfers = {}
+            for hour, counterparty, action, kwh in zip(rows['simulation_hour'].tolist(), rows['counterparty'].tolist(),
+                                                       rows['action'].tolist(), rows['kWh'].tolist()):
+                transfers.setdefault(hour, []).append({'counterparty': counterparty, 'action': action, 'kWh': kwh})
+            grids.append((grid.id, columns, transfers))
+
+        for i in range(len(totals['simulation_hour'])):
+            hours = totals['simulation_hour'][i]
+            yield {
+                'simulation_hour': hours,
+                'total_generation': totals['total_generation'][i],
+                'total_demand': totals['total_demand'][i],
+                'revenue': totals['revenue'][i],
+                'grids': [{
+                    'id': grid_id,
+                    'generation_kWh': columns['generation_kWh'][i],
+                    'total_demand_kWh': columns['total_demand_kWh'][i],
+                    'battery_level_kWh': columns['battery_level_kWh'][i],
+                    'battery_%': columns['battery_%'][i],
+                    'revenue_USD': columns['revenue_USD'][i],
+                    'transfers': transfers.get(hours, []),
+                } for grid_id, columns, transfers in grids],
+            }
+
+
+    def configure_logs(self, capacity=None, spill_to=None, columnar=True):
+        """
+        Choose the log backend of the simulation, its grids and their houses.
+        Call it before the run, existing rows are dropped.
+
+        :param capacity: Keep only the last `capacity` rows of every log (the
+                         dict logs become bounded deques, the columnar and house
+                         supply logs ring buffers). None keeps everything.
+        :param spill_to: Prefix for spilling full columnar buffers to .npz files
+                         instead of overwriting them, e.g. 'logs/run1_'.
+        :param columnar: Also keep the full-precision columnar logs (see
+                         ColumnarLog), off until this is called. Streaming,
+                         the ledger, the result cache and fast_forward turn
+                         them on by themselves.
+        """
+        def prefix(name):
+            return None if spill_to is None else f'{spill_to}{name}'
+
+        self.log = deque(maxlen=capacity)
+        self.columnar_log = ColumnarLog(self.log_columns, capacity=capacity, spill_to=prefix('simulation_log'),
+                                        time_dtype=self.time_dtype, enabled=columnar)
+        for grid in self.grids:
+            grid.log = deque(maxlen=capacity)
+            grid.columnar_log = ColumnarLog(grid.log_columns, transactions=True, capacity=capacity,
+                                            spill_to=prefix(f'mini_grid_log_{grid.id}'), time_dtype=self.time_dtype,
+                                            enabled=columnar)
+            grid.bank.log = RingBuffer(HouseBank.log_dtype, capacity, prefix(f'house_supply_log_{grid.id}'))
+        self._attach_ledger()
+
+
+    def summary(self):
+        """
+        Running aggregates (count, sum, min, max, mean) of the simulation and grid
+        logs, over every logged hour even when rows have been evicted. Only
+        the hours logged while the columnar logs were on count, see configure_logs.
+        """
+        return {
+            'simulation': self.columnar_log.rows.summary(),
+            'grids': {grid.id: grid.columnar_log.rows.summary() for grid in self.grids},
+        }
+
+
+    def clear_logs(self):
+        """
+        Drop the in-memory logs of the simulation, its grids and their houses.
+        The ledger keeps their trades.
+        """
+        self.log.clear()
+        self.columnar_log.clear()
+        for grid in self.grids:
+            grid.log.clear()
+            grid.columnar_log.clear()
+            grid.bank.log.clear()
+
+
+    def _stats_targets(self):
+        objects = [self, self.conventional_grid, self.house_log]
+        if self.market is not None:
+            objects.append(self.market)
+        topologies = {id(grid.topology): grid.topology for grid in self.grids if grid.topology is not None}
+        objects += topologies.values()
+        for grid in self.grids:
+            objects += [grid, grid.solar_pv, grid.bank]
+        return objects
+
+
+    def enable_stats(self, stats=None):
+        """
+        Start profiling the phases of every step, see SimulationStats.
+
+        :param stats: SimulationStats to add to, e.g. one shared by several
+                      simulations. A new one by default.
+        :return: The SimulationStats, also kept as self.stats.
+        """
+        self.stats = stats if stats is not None else SimulationStats()
+        for obj in self._stats_targets():
+            self.stats.instrument(obj)
+        return self.stats
+
+
+    def disable_stats(self):
+        for obj in self._stats_targets():
+            SimulationStats.uninstrument(obj)
+        self.stats = None
+
+
+    def share_state(self, name=None):
+        """
+        Publish the state of the simulation in shared memory after every step,
+        for other processes to read through LiveState.attach(name). Runs on
+        several processes (see ParallelEngine) publish at the end of the run.
+
+        :param name: Name of the shared memory block, a random one by default.
+        :return: The LiveState, also kept as self.live.
+        """
+        from live import LiveState
+        if self.live is None:
+            self.live = LiveState.create([grid.id for grid in self.grids], [len(grid.bank) for grid in self.grids], name)
+        self._publish()
+        return self.live
+
+
+    def stop_sharing(self):
+        if self.live is not None:
+            self.live.close()
+            self.live = None
+
+
+    def _publish(self):
+        # Share the current state, e.g. after a restore, as of the last step
+        if self.live is not None:
+            self.live.publish(self, self.time(self.clock - 1) if self.clock else float('nan'))
+
+
+    def enable_ledger(self):
+        """
+        Keep every trade from now on in a TransactionLedger. The grids'
+        columnar logs, which are turned on, add their transactions to it as
+        they log them.
+
+        :return: The TransactionLedger, also kept as self.ledger.
+        """
+        if self.ledger is None:
+            self.ledger = TransactionLedger(self.time_dtype)
+            self._attach_ledger()
+        self._enable_columnar()
+        return self.ledger
+
+
+    def _enable_columnar(self):
+        # Turn on the columnar logs for the features built on them, keeping their rows
+        self.columnar_log.enabled = True
+        for grid in self.grids:
+            grid.columnar_log.enabled = True
+
+
+    def _attach_ledger(self):
+        for grid in self.grids:
+            grid.columnar_log.ledger = self.ledger
+            grid.columnar_log.grid_id = grid.id
+
+
+    def _extend_logs(self, parts):
+        # Append rows to every columnar RingBuffer, in _log_buffers order
+        for buffer, rows in zip(self._log_buffers(), parts):
+            buffer.extend(rows)
+        if self.ledger is not None:
+            self.ledger.add([(grid.id, rows) for grid, rows in zip(self.grids, parts[2::3])])
+
+
+    def _log_buffers(self):
+        # Every columnar RingBuffer, in a fixed order
+        buffers = [self.columnar_log.rows]
+        for grid in self.grids:
+            buffers += [grid.columnar_log.rows, grid.columnar_log.transactions, grid.bank.log]
+        return buffers
+
+
+    def checkpoint(self):
+        """
+        Snapshot of the state of the simulation, see Checkpoint.
+        """
+        version, internal, gauss_next = random.getstate()
+        state = {
+            'clock': self.clock,
+            'steps_per_hour': self.steps_per_hour,
+            'simulation': {name: getattr(self, name) for name in self.state_fields},
+            'conventional_grid': {name: getattr(self.conventional_grid, name) for name in ConventionalGrid.state_fields},
+            'grids': [],
+            'random': {'version': version, 'gauss_next': gauss_next},
+            'log_offsets': [buffer.count for buffer in self._log_buffers()],
+        }
+        arrays = {'random_internal': np.array(internal, dtype=np.uint32)}
+        for g, grid in enumerate(self.grids):
+            state['grids'].append(dict(
+                {name: getattr(grid, name) for name in MiniGrid.state_fields},
+                id=grid.id, num_houses=len(grid.bank), battery_level=grid.battery.level,
+                battery_capacity=grid.battery.capacity, total_energy_generated=grid.solar_pv.total_energy_generated,
+                sources=grid.bank.sources,
+            ))
+            for name in HouseBank.state_fields:
+                arrays[f'grid{g}_{name}'] = getattr(grid.bank, name).copy()
+        return Checkpoint(state, arrays)
+
+
+    def restore(self, checkpoint, capacities=True):
+        """
+        Put the simulation back in the state of a Checkpoint, so the next run
+        continues from there exactly like the run it was taken from.
+
+        The in-memory logs are dropped and their row counts continue from the
+        checkpoint. Rows the HouseLogSink has already buffered or written are
+        left alone.
+
+        :param capacities: Restore the battery capacities too. With False the
+                           grids keep their own, e.g. a branch with other
+                           sizes, and levels above them are cut to them.
+        """
+        self._restore_state(checkpoint, capacities)
+
+        self.log.clear()
+        for grid in self.grids:
+            grid.log.clear()
+        for buffer, count in zip(self._log_buffers(), checkpoint.state['log_offsets']):
+            buffer.reset(count)
+        if self.ledger is not None:
+            self.ledger.truncate(checkpoint.hours)
+
+
+    def _restore_state(self, checkpoint, capacities=True):
+        # Everything restore does except the logs
+        state = checkpoint.state
+        if state['steps_per_hour'] != self.steps_per_hour:
+            raise ValueError("The checkpoint was taken on a simulation with another step length.")
+        if [(grid['id'], grid['num_houses']) for grid in state['grids']] != [(grid.id, len(grid.bank)) for grid in self.grids]:
+            raise ValueError("The checkpoint was taken on a simulation with other grids or houses.")
+
+        self.clock = state['clock']
+        for name, value in state['simulation'].items():
+            setattr(self, name, value)
+        for name, value in state['conventional_grid'].items():
+            setattr(self.conventional_grid, name, value)
+        for g, (grid, saved) in enumerate(zip(self.grids, state['grids'])):
+            for name in MiniGrid.state_fields:
+                setattr(grid, name, saved[name])
+            grid.battery.level = saved['battery_level']
+            if capacities:
+                grid.battery.capacity = saved['battery_capacity']
+            else:
+                grid.battery.level = min(grid.battery.level, grid.battery.capacity)
+            grid.solar_pv.total_energy_generated = saved['total_energy_generated']
+            grid.bank.sources = list(saved['sources'])
+            for name in HouseBank.state_fields:
+                getattr(grid.bank, name)[:] = checkpoint.arrays[f'grid{g}_{name}']
+            grid.internal_transactions_log.clear()
+            grid.external_transactions_log.clear()
+            if grid.topology is not None:
+                grid.topology.hour = None
+        if self.market is not None:
+            self.market.hour = None
+
+        random.setstate((state['random']['version'], tuple(checkpoint.arrays['random_internal'].tolist()),
+                         state['random']['gauss_next']))
+        self._publish()
+
+
+    def cache_key(self, num_days, fast_forward=None, processes=None):
+        """
+        Content address of running num_days from the current state: a hash of
+        the conventional grid, grid, line and house parameters, the state
+        (including the clock and the random state, i.e. the seed) and the
+        horizon. The serial engines give the same results; runs on several
+        processes add their partitions, see simulate_days.
+        """
+        digest = hashlib.sha256()
+
+        def add(value):
+            if isinstance(value, np.ndarray):
+                value = np.ascontiguousarray(value)
+                digest.update(repr((value.dtype.str, value.shape)).encode())
+                digest.update(value.tobytes())
+            else:
+                digest.update(json.dumps(value, sort_keys=True, default=repr).encode())
+
+        conventional_grid = self.conventional_grid
+        add({
+            'version': RESULT_CACHE_VERSION,
+            'num_days': num_days,
+            'fast_forward': fast_forward,
+            'step_minutes': self.step_minutes,
+            'prices': [conventional_grid.buying_price, conventional_grid.selling_price, conventional_grid.max_supply],
+            'market': None if self.market is None else [self.market.method, self.market.max_rounds, self.market.tolerance],
+        })
+        if processes and processes > 1:
+            add({'partitions': default_partitions([len(grid.bank) for grid in self.grids], processes)})
+        topologies = []
+        for grid in self.grids:
+            site = grid.solar_pv.site
+            bank = grid.bank
+            add({
+                'id': grid.id, 'selling_price': grid.selling_price, 'safety_factor': grid.safety_factor,
+                'avg_sunlight_hours': grid.avg_sunlight_hours, 'requirement': grid.total_daily_energy_requirement,
+                'allocation': grid.allocation,
+                'pv_capacity': grid.solar_pv.capacity, 'neighbors': [ng.id for ng in grid.neighboring_grids],
+                'site': None if site is None else [site.latitude, site.cloudiness, site.persistence, site.seed, site.start_day],
+                'series': None if bank.series is None else bank.series.fingerprint(),
+            })
+            for values in (bank.ids, bank.base_demand, bank.profiles, bank.profile_index, bank.meter, bank.priority):
+                add(values)
+            if grid.topology is not None and all(grid.topology is not t for t in topologies):
+                topologies.append(grid.topology)
+        for topology in topologies:
+            add(topology.priority)
+            for values in (topology.indptr, topology.indices, topology.capacity, topology.loss):
+                add(values)
+
+        checkpoint = self.checkpoint()
+        add(dict(checkpoint.state, log_offsets=None))
+        for name in sorted(checkpoint.arrays):
+            add(checkpoint.arrays[name])
+        return digest.hexdigest()
+
+
+    def log_marks(self):
+        """
+        Row counts of the columnar logs, to pass to run_record after a run.
+        """
+        return [buffer.count for buffer in self._log_buffers()]
+
+
+    def run_record(self, marks):
+        """
+        Checkpoint of the current state plus every log row added since marks
+        (see log_marks), from which replay repeats the run. None if some of
+        those rows are no longer held in memory.
+        """
+        buffers = self._log_buffers()
+        added = [buffer.count - mark for buffer, mark in zip(buffers, marks)]
+        if any(len(buffer) < n for buffer, n in zip(buffers, added)):
+            return None
+        dict_logs = [self.log] + [grid.log for grid in self.grids]
+        counts = [added[0]] + added[1::3]  # Dict rows are appended with the columnar rows
+        if any(len(log) < n for log, n in zip(dict_logs, counts)):
+            return None
+
+        record = self.checkpoint()
+        record.state['dict_logs'] = [list(log)[len(log) - n:] for log, n in zip(dict_logs, counts)]
+        for i, (buffer, n) in enumerate(zip(buffers, added)):
+            record.arrays[f'log_{i}'] = np.array(buffer.tail(n))
+        return record
+
+
+    def replay(self, record):
+        """
+        Apply a run_record: jump to its end state and append its log rows.
+        """
+        self._restore_state(record)
+        dict_logs = [self.log] + [grid.log for grid in self.grids]
+        for log, rows in zip(dict_logs, record.state['dict_logs']):
+            log.extend(rows)
+        self._extend_logs([record.arrays[f'log_{i}'] for i in range(len(self._log_buffers()))])
     
     
     def get_initial_state(self):
@@ -658,7 +1648,7 @@ class Simulation:
 
         for i, grid in enumerate(self.grids):
             # Calculate average consumption for each house in the minigrid
-            total_consumption = sum(house.current_demand for house in grid.houses)
+            total_consumption = sum(grid.bank.current_demand.tolist())
             average_consumption = total_consumption / len(grid.houses) if grid.houses else 0
 
             # Create a dictionary with the data for this grid
@@ -675,10 +1665,10 @@ class Simulation:
         print(state)
 
         return state
-        
-        
 
-                
+
+
+
 def create_mini_grid(id, conventional_grid, demand_profile):
     # Ask the user for specifics about the mini-grid
     num_houses = int(input(f"How many houses do you want in MiniGrid {id}? "))
@@ -702,29 +1692,280 @@ def create_mini_grid(id, conventional_grid, demand_profile):
 
 
 
+def build_simulation(scenario, house_log=None):
+    """
+    Build a Simulation from a scenario dict.
 
-if __name__ == "__main__":
-    
-    # Example demand profile (24 values representing hourly consumption)
+    A scenario looks like
+        {
+            'conventional_grid': {'buying_price': 0.03, 'selling_price': 0.06},
+            'grids': [
+                {'id': 1, 'num_houses': 5, 'base_demand': 0.5, 'demand_profile': [...24 values],
+                 'avg_sunlight_hours': 8, 'selling_price': 0.05, 'num_days_backup': 5,
+                 'safety_factor': 1.5, 'neighbors': [2, 3]},
+                ...
+            ],
+        }
+    Houses within a grid share base_demand and demand_profile, as in create_mini_grid.
+    'neighbors' lists grid ids in the order they are tried. An optional
+    'topology': {'edges': [(from_id, to_id, capacity, loss), ...], 'priority': ...,
+    'symmetric': ...} wires the grids through a Topology instead, and an optional
+    'market': {'method': 'proportional' or 'lp'} clears trades with MarketClearing.
+
+    Metered grids give 'demand_series': {'file': 'meters.npy', 'step_minutes': 15,
+    'meters': [...], 'start_hour': 0, 'repeat': False} instead of num_houses and
+    demand_profile, with one house per meter and base_demand (default 1) scaling
+    the readings. An optional 'site': {'latitude': ..., 'cloudiness': ..., 'seed': ...}
+    takes PV output from a SolarSite trace. An optional 'step_minutes' sets the
+    simulation clock. An optional 'allocation' (see allocate) chooses how a grid
+    shares acquired energy among its houses, and 'priority' gives the priority
+    class of each of its houses. The policies only differ when energy is scarce,
+    i.e. when 'conventional_grid' gives a 'max_supply' (kWh a grid may buy per
+    hour, 0 for an islanded network, see ConventionalGrid).
+
+    Large networks give their houses as arrays instead, see _house_table: a
+    top-level 'houses': {'grid': [...], 'base_demand': [...], 'profile': [...],
+    'profiles': [[...24 values], ...], 'priority': [...]} or {'file': 'houses.npz'}
+    with one entry per house, for the grids without num_houses or demand_series. Their daily
+    energy requirement is worked out for all grids at once and can differ in the
+    last bits from MiniGrid's house-by-house sum. A top-level 'edges':
+    [(from_id, to_id), ...] or {'file': 'edges.npy'} gives the neighbours of
+    every grid in edge order, instead of per-grid 'neighbors'. See load_scenario
+    for reading a scenario from a JSON or TOML file.
+    """
+    prices = scenario['conventional_grid']
+    conventional_grid = ConventionalGrid(prices['buying_price'], prices['selling_price'], prices.get('max_supply'))
+
+    specs = scenario['grids']
+    _check_grids(specs)
+    table = _house_table(scenario['houses'], specs) if 'houses' in scenario else {}
+
+    series = {}  # file name -> DemandSeries, so grids share one memory map
+    minigrids = []
+    for g, spec in enumerate(specs):
+        requirement = None
+        if 'demand_series' in spec:
+            metered = spec['demand_series']
+            if metered['file'] not in series:
+                series[metered['file']] = DemandSeries.open(metered['file'], metered.get('step_minutes', 60),
+                                                            metered.get('start_hour', 0), metered.get('repeat', False))
+            meters = metered['meters']
+            houses = HouseBank(range(len(meters)), spec.get('base_demand', 1), demand_series=series[metered['file']], meters=meters)
+        elif 'num_houses' in spec or g not in table:
+            houses = HouseBank(range(spec['num_houses']), spec['base_demand'], spec['demand_profile'])
+        else:
+            base_demand, profiles, profile_index, priority, requirement = table[g]
+            houses = HouseBank(np.arange(len(base_demand)), base_demand, profiles, profile_index=profile_index)
+            houses.priority[:] = priority
+        if 'priority' in spec:
+            houses.priority[:] = spec['priority']
+        minigrids.append(MiniGrid(
+            id=spec['id'], houses=houses, avg_sunlight_hours=spec['avg_sunlight_hours'],
+            selling_price=spec['selling_price'], num_days_backup=spec['num_days_backup'], neighboring_grids=[],
+            conventional_grid=conventional_grid, safety_factor=spec['safety_factor'],
+            site=SolarSite(**spec['site']) if 'site' in spec else None, total_daily_energy_requirement=requirement,
+            allocation=spec.get('allocation', 'order')
+        ))
+
+    # Wire the neighbours once every grid exists
+    if 'edges' in scenario:
+        if any('neighbors' in spec for spec in specs):
+            raise ValueError("Give the neighbours either as top-level 'edges' or as per-grid 'neighbors', not both.")
+        for minigrid, targets in zip(minigrids, _edge_lists(scenario['edges'], specs)):
+            minigrid.neighboring_grids = [minigrids[n] for n in targets]
+    else:
+        by_id = {minigrid.id: minigrid for minigrid in minigrids}
+        for spec, minigrid in zip(specs, minigrids):
+            minigrid.neighboring_grids = [by_id[grid_id] for grid_id in spec.get('neighbors', [])]
+
+    if 'topology' in scenario:
+        topology = scenario['topology']
+        Topology(minigrids, topology['edges'], priority=topology.get('priority', 'order'),
+                 symmetric=topology.get('symmetric', True)).attach()
+
+    market = None
+    if 'market' in scenario:
+        market = MarketClearing(minigrids, topology=minigrids[0].topology, method=scenario['market'].get('method', 'proportional'))
+
+    return Simulation(conventional_grid, minigrids, house_log=house_log, market=market,
+                      step_minutes=scenario.get('step_minutes', 60))
+
+
+def _check_grids(specs):
+    # The MiniGrid constraints for all grids at once, naming every grid that breaks one
+    if not specs:
+        raise ValueError("grids should be a non-empty list.")
+    ids = np.array([spec['id'] for spec in specs])
+    if len(np.unique(ids)) != len(ids):
+        raise ValueError("Grid ids should be unique.")
+    values = {name: np.array([spec[name] for spec in specs], dtype=float)
+              for name in ('avg_sunlight_hours', 'selling_price', 'num_days_backup', 'safety_factor')}
+    checks = [
+        (~((values['avg_sunlight_hours'] >= 0) & (values['avg_sunlight_hours'] <= 24)), "avg_sunlight_hours should be between 0 and 24."),
+        (~(values['selling_price'] > 0), "selling_price should be a positive number."),
+        (~(values['num_days_backup'] > 0), "num_days_backup should be a positive number."),
+        (~(values['safety_factor'] > 0), "safety_factor should be a positive number."),
+    ]
+    for bad, message in checks:
+        if bad.any():
+            raise ValueError(f"MiniGrid {', '.join(str(grid_id) for grid_id in ids[bad].tolist())}: {message}")
+
+
+def _grid_index(specs, grid_ids, what):
+    # Index into specs of every grid id in the array grid_ids
+    ids = np.array([spec['id'] for spec in specs])
+    order = np.argsort(ids, kind='stable')
+    position = np.minimum(np.searchsorted(ids[order], grid_ids), len(ids) - 1)
+    index = order[position]
+    unknown = ids[index] != grid_ids
+    if unknown.any():
+        raise ValueError(f"{what} refers to grids that are not in the network: {np.unique(grid_ids[unknown]).tolist()}")
+    return index
+
+
+def _scenario_array(value):
+    # Inline list or {'file': '....npy'}
+    if isinstance(value, dict):
+        return np.load(value['file'], allow_pickle=False)
+    return np.asarray(value)
+
+
+def _house_table(houses, specs):
+    """
+    Houses of the grids without num_houses or demand_series, from arrays with
+    one entry per house: the 'grid' id, the 'base_demand' and optionally the
+    'profile' row of a (profiles, 24) 'profiles' table and a 'priority' class.
+    Without a table every house follows the demand_profile of its grid. Houses keep their order
+    within a grid and are numbered from 0. A {'file': 'houses.npz'} holds the
+    same arrays.
+
+    :return: dict grid index -> (base demand, profile table, profile row of
+             every house, priority classes, daily energy requirement).
+    """
+    if 'file' in houses:
+        with np.load(houses['file'], allow_pickle=False) as npz:
+            houses = {name: npz[name] for name in npz.files}
+    taking = [g for g, spec in enumerate(specs) if 'num_houses' not in spec and 'demand_series' not in spec]
+    grid = _grid_index(specs, np.asarray(houses['grid']), "The house table")
+    base_demand = np.asarray(houses['base_demand'], dtype=float)
+    if base_demand.shape != grid.shape:
+        raise ValueError("The house table should have one base_demand per house.")
+    if not np.isin(grid, taking).all():
+        raise ValueError("Grids with num_houses or a demand_series cannot take houses from the house table.")
+
+    if 'profiles' in houses:
+        profiles = np.asarray(houses['profiles'], dtype=float)
+        profile = np.asarray(houses['profile'])
+    else:
+        missing = [specs[g]['id'] for g in np.unique(grid).tolist() if 'demand_profile' not in specs[g]]
+        if missing:
+            raise ValueError(f"MiniGrid {', '.join(map(str, missing))}: houses without a profile row need the grid's demand_profile.")
+        profiles = np.array([specs[g].get('demand_profile', [0] * 24) for g in range(len(specs))], dtype=float)
+        profile = grid
+    if profiles.ndim != 2 or profiles.shape[1] != 24:
+        raise ValueError("profiles should be a table of profiles with 24 values representing hourly consumption.")
+    if profile.shape != grid.shape or (len(profile) and not (profile.min() >= 0 and profile.max() < len(profiles))):
+        raise ValueError("profile should give every house a row of the profiles table.")
+    priority = np.asarray(houses['priority']) if 'priority' in houses else np.zeros(len(grid), dtype=np.int64)
+    if priority.shape != grid.shape:
+        raise ValueError("The house table should have one priority per house.")
+
+    # Daily energy of every house from the profile table's daily totals, summed per grid.
+    # A (grids, profiles) weight matrix would not fit with a profile per house.
+    daily = profiles @ np.ones(24)
+    requirement = np.bincount(grid, weights=base_demand * daily[profile], minlength=len(specs)).tolist()
+
+    order = np.argsort(grid, kind='stable')
+    rows = np.split(order, np.cumsum(np.bincount(grid, minlength=len(specs)))[:-1])
+    table = {}
+    for g in taking:
+        used, profile_index = np.unique(profile[rows[g]], return_inverse=True)
+        table[g] = (base_demand[rows[g]], profiles[used], profile_index, priority[rows[g]], requirement[g] if len(rows[g]) else 0)
+    return table
+
+
+def _edge_lists(edges, specs):
+    # Neighbour indices of every grid from (from_id, to_id) rows, in edge order
+    edges = _scenario_array(edges)
+    if len(edges) == 0:
+        return [[] for _ in specs]
+    if edges.ndim != 2 or edges.shape[1] < 2:
+        raise ValueError("edges should be (from_id, to_id) pairs.")
+    source = _grid_index(specs, edges[:, 0], "An edge")
+    target = _grid_index(specs, edges[:, 1], "An edge")
+    if (source == target).any():
+        raise ValueError("An edge should connect two different grids.")
+    order = np.argsort(source, kind='stable')
+    targets = np.split(target[order], np.cumsum(np.bincount(source, minlength=len(specs)))[:-1])
+    return [values.tolist() for values in targets]
+
+
+def load_scenario(file_name):
+    """
+    Read a scenario for build_simulation from a .json or .toml file. Relative
+    'file' entries (houses, edges, demand series) are taken relative to the
+    scenario file.
+    """
+    if file_name.endswith('.toml'):
+        import tomllib
+
+        with open(file_name, 'rb') as f:
+            scenario = tomllib.load(f)
+    else:
+        with open(file_name) as f:
+            scenario = json.load(f)
+
+    directory = os.path.dirname(os.path.abspath(file_name))
+    for entry in _file_entries(scenario):
+        entry['file'] = os.path.join(directory, entry['file'])
+    return scenario
+
+
+def _file_entries(scenario):
+    # The {'file': ...} entries of a scenario: houses, edges and demand series
+    entries = [scenario.get('houses'), scenario.get('edges')]
+    entries += [spec.get('demand_series') for spec in scenario['grids']]
+    return [entry for entry in entries if isinstance(entry, dict) and 'file' in entry]
+
+
+def scenario_files(scenario):
+    """
+    File names a scenario reads its houses, edges and demand series from.
+    Scenarios from untrusted clients should not name any.
+    """
+    return [entry['file'] for entry in _file_entries(scenario)]
+
+
+def example_scenario():
+    """
+    The three-grid setup used by app.py, as a scenario dict. Its grids draw
+    their PV output at random, so its days differ and
+    Simulation.simulate_days(fast_forward=...) does not apply to it.
+    """
     demand_profile = [1.2, 1.1, 1.0, 0.9, 0.8, 0.7, 0.6, 0.7, 0.8, 0.9, 1.0, 1.2,
-                  1.4, 1.5, 1.6, 1.7, 1.8, 1.9, 1.8, 1.7, 1.6, 1.5, 1.3, 1.2]
+                      1.4, 1.5, 1.6, 1.7, 1.8, 1.9, 1.8, 1.7, 1.6, 1.5, 1.3, 1.2]
+    grid = {'demand_profile': demand_profile, 'selling_price': 0.05, 'num_days_backup': 5, 'safety_factor': 1.5}
 
-    # Create a ConventionalGrid with certain prices
-    # (buying_price, selling_price)
-    conventional_grid = ConventionalGrid(0.03, 0.06)
-    
-    # User determines the number of mini-grids
-    num_mini_grids = int(input("How many mini grids do you want to simulate? "))
-    
-    # Create and setup the mini-grids
-    minigrids = [create_mini_grid(i+1, conventional_grid, demand_profile) for i in range(num_mini_grids)]
+    return {
+        'conventional_grid': {'buying_price': 0.03, 'selling_price': 0.06},
+        'grids': [
+            dict(grid, id=1, num_houses=5, base_demand=12/24, avg_sunlight_hours=8, neighbors=[2, 3]),
+            dict(grid, id=2, num_houses=9, base_demand=10/24, avg_sunlight_hours=5, neighbors=[3, 1]),
+            dict(grid, id=3, num_houses=2, base_demand=11/24, avg_sunlight_hours=6, neighbors=[1, 2]),
+        ],
+    }
+
+
+
+
+if __name__ == "__main__":
     
-    # Setting up neighbors for each mini-grid
-    for i, minigrid in enumerate(minigrids):
-        minigrid.neighboring_grids = [mg for j, mg in enumerate(minigrids) if j != i]
+    # Scenario file given on the command line (.json or .toml, see load_scenario),
+    # or the example network
+    scenario = load_scenario(sys.argv[1]) if len(sys.argv) > 1 else example_scenario()
 
     # Create a Simulation instance
-    simulation = Simulation(conventional_grid, minigrids)
+    simulation = build_simulation(scenario)
 
     # Simulate for a certain number of days
     simulation.simulate_days(7)
@@ -740,10 +1981,10 @@ if __name__ == "__main__":
     
     # Output system information
     for i, grid in enumerate(simulation.grids):
-        total_consumption = sum(house.current_demand for house in grid.houses)
-        average_consumption = total_consumption / len(grid.houses) if grid.houses else 0
+        total_consumption = sum(grid.bank.current_demand.tolist())
+        average_consumption = total_consumption / len(grid.bank) if len(grid.bank) else 0
         print(f"\nMiniGrid {i + 1}:")
-        print(f"\tNumber of houses: {len(grid.houses)}")
+        print(f"\tNumber of houses: {len(grid.bank)}")
         print(f"\tAverage consumption/hour: {round(average_consumption, 3)} kWh")
         print(f"\tSolar capacity: {round(grid.solar_pv.capacity, 3)} kWp")
         print(f"\tBattery capacity: {round(grid.battery.capacity, 3)} kWh")
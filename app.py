@@ -1,86 +1,302 @@
-from flask import Flask, render_template, jsonify
+import time
+
+_import_started = time.perf_counter()  # Before any other import, see STARTUP_BUDGET
+
+import os
+import tempfile
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+
+from flask import Flask, Response, abort, render_template, jsonify, request
 from flask_socketio import SocketIO
-from MasterNetwork import *
+from werkzeug.exceptions import Unauthorized
+from MasterNetwork import build_simulation, example_scenario, load_scenario as read_scenario, scenario_files
+from cache import ResultCache
+from logs import HouseLogSink
+from stats import SimulationStats
+from jobs import JobService
 
 
 app = Flask(__name__)
 socketio = SocketIO(app)
 
+# Scenario served by the app: a JSON or TOML scenario file (see
+# MasterNetwork.load_scenario), or the example scenario when SOLE_SCENARIO is unset
+SCENARIO_FILE = os.environ.get('SOLE_SCENARIO')
+
+# Seconds the module import may take before a warning is printed
+STARTUP_BUDGET = float(os.environ.get('SOLE_STARTUP_BUDGET', 1.0))
+
 simulation = None
 
+# Phase timings of the app's simulation, streamed runs and simulated jobs,
+# served by /metrics. Runs replayed from the cache take no steps.
+stats = SimulationStats()
+
 @app.route('/')
 def home():
     return "Hello, this is Sol-E!"
 
 
+@lru_cache(maxsize=None)
+def load_scenario():
+    # Parsed once per process; build_simulation does not modify it
+    if SCENARIO_FILE is None:
+        return example_scenario()
+    return read_scenario(SCENARIO_FILE)
 
 
-@app.before_first_request
-def initialize_simulation():
+def get_simulation():
+    """
+    The app's Simulation, built on first use. Nothing is built at import, so
+    workers start quickly and each pre-forked worker builds its own.
+    """
     global simulation
-
-
- # Example demand profile (24 values representing hourly consumption)
-demand_profile = [1.2, 1.1, 1.0, 0.9, 0.8, 0.7, 0.6, 0.7, 0.8, 0.9, 1.0, 1.2,
-                  1.4, 1.5, 1.6, 1.7, 1.8, 1.9, 1.8, 1.7, 1.6, 1.5, 1.3, 1.2]
-
-
-# Create a few houses with random average daily consumption
-# (id, base_demand, demand_profile)   random.uniform(5, 6)
-houses1 = [House(i, 12/24, demand_profile) for i in range(5)]
-houses2 = [House(i,  10/24, demand_profile) for i in range(9)]
-houses3 = [House(i, 11/24, demand_profile) for i in range(2)]
-
-
-
-# Create a ConventionalGrid with certain prices
-# (buying_price, selling_price)
-conventional_grid = ConventionalGrid(0.03, 0.06)
-
-# Create MiniGrid instances without setting neighboring_grids yet
-minigrid1 = MiniGrid(id=1, houses = houses1, avg_sunlight_hours = 8, selling_price = 0.05, num_days_backup = 5, neighboring_grids = [], conventional_grid=conventional_grid, safety_factor = 1.5)
-
-minigrid2 = MiniGrid(id=2, houses = houses2, avg_sunlight_hours = 5, selling_price = 0.05, num_days_backup = 5, neighboring_grids = [], conventional_grid=conventional_grid, safety_factor = 1.5)
-
-minigrid3 = MiniGrid(id=3, houses = houses3, avg_sunlight_hours = 6, selling_price = 0.05, num_days_backup = 5, neighboring_grids = [], conventional_grid=conventional_grid, safety_factor = 1.5)
-
-
-# Now that all MiniGrid instances are created, set the neighboring grids
-minigrid1.neighboring_grids = [minigrid2, minigrid3]
-minigrid2.neighboring_grids = [minigrid3, minigrid1]
-minigrid3.neighboring_grids = [minigrid1, minigrid2]
-
-# Assign houses to the respective grids and initialize CSVs
-for house in houses1:
-    house.assign_to_grid(minigrid1)
-   # house.initialize_csv()
-
-for house in houses2:
-    house.assign_to_grid(minigrid2)
-    #house.initialize_csv()
-
-for house in houses3:
-    house.assign_to_grid(minigrid3)
-    #house.initialize_csv()
-
-# Add the MiniGrids to a list
-minigrids = [minigrid1, minigrid2, minigrid3]
-
-# Create a Simulation instance
-# (conventional_grid, grids)
-simulation = Simulation(conventional_grid, minigrids)
-print("Simulation initialized!")
+    if simulation is None:
+        simulation = build_simulation(load_scenario())
+        simulation.enable_stats(stats)
+        print("Simulation initialized!")
+    return simulation
 
 
 @app.route('/api/initial-state')
 def initial_state():
-    if simulation is None:
-        return "Simulation not initialized", 500
-    state = simulation.get_initial_state()
+    state = get_simulation().get_initial_state()
     return jsonify(state)
         
 
 
+# Streaming: hours per socketio frame, and frames a client may have
+# un-acknowledged before the server waits (backpressure)
+FRAME_HOURS = 24
+MAX_FRAMES_IN_FLIGHT = 4
+
+# Longest run a client may stream, in days
+MAX_STREAM_DAYS = int(os.environ.get('SOLE_MAX_STREAM_DAYS', 365))
+
+streams = {}  # socketio sid -> stream state
+
+
+@socketio.on('start_stream')
+def start_stream(data=None):
+    """
+    Stream a fresh run of the example scenario to the calling client, of
+    1 to MAX_STREAM_DAYS days. The client acknowledges every 'simulation_frame' event.
+    """
+    data = data or {}
+    try:
+        num_days = min(max(int(data.get('days', 7)), 1), MAX_STREAM_DAYS)
+    except (TypeError, ValueError):
+        socketio.emit('simulation_error', {'error': "days should be a whole number."}, to=request.sid)
+        return
+    sid = request.sid
+    if sid in streams:
+        streams[sid]['cancelled'] = True  # A client runs one stream at a time
+    streams[sid] = {'in_flight': 0, 'cancelled': False}
+    socketio.start_background_task(stream_simulation, sid, num_days)
+
+
+@socketio.on('stop_stream')
+def stop_stream():
+    if request.sid in streams:
+        streams[request.sid]['cancelled'] = True
+
+
+@socketio.on('disconnect')
+def on_disconnect():
+    stop_stream()
+
+
+def stream_simulation(sid, num_days):
+    state = streams[sid]
+
+    def acknowledged(*args):
+        state['in_flight'] -= 1
+
+    def send(frame):
+        # Wait for the client to catch up before sending more
+        while state['in_flight'] >= MAX_FRAMES_IN_FLIGHT and not state['cancelled']:
+            socketio.sleep(0.05)
+        if state['cancelled']:
+            return False
+        state['in_flight'] += 1
+        socketio.emit('simulation_frame', frame, to=sid, callback=acknowledged)
+        return True
+
+    stream_sim = build_simulation(load_scenario(), house_log=HouseLogSink(mode='off'))
+    stream_sim.enable_stats(stats)
+    frame = []
+    for delta in stream_sim.stream(24 * num_days, block_hours=FRAME_HOURS, vectorized=True, keep_logs=False):
+        frame.append(delta)
+        if len(frame) == FRAME_HOURS:
+            if not send(frame):
+                break
+            frame = []
+    else:
+        if frame:
+            send(frame)
+
+    if not state['cancelled']:
+        socketio.emit('simulation_done', to=sid)
+    if streams.get(sid) is state:  # Not replaced by a newer stream of the client
+        del streams[sid]
+
+
+# Finished runs by content address, shared on disk by the job workers and app
+# workers, and the simulation jobs submitted by users. Both are created on first
+# use, see get_jobs.
+cache = None
+jobs = None
+
+
+def get_jobs():
+    """
+    The app's JobService, created with its ResultCache on first use. Jobs run
+    on a process pool started on the first job.
+    """
+    global cache, jobs
+    if jobs is None:
+        cache = ResultCache(os.environ.get('SOLE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'sole_cache')),
+                            max_disk_bytes=int(os.environ.get('SOLE_CACHE_BYTES', 4 * 2 ** 30)))
+        jobs = JobService(max_workers=int(os.environ.get('SOLE_JOB_WORKERS', 0)) or None, cache=cache, stats=stats)
+    return jobs
+
+# Seconds between 'job_status' events sent to a watching client
+JOB_STATUS_INTERVAL = 0.5
+
+# Largest job a client may submit: days simulated, and grids and houses of a submitted scenario
+MAX_JOB_DAYS = int(os.environ.get('SOLE_MAX_JOB_DAYS', 365))
+MAX_JOB_GRIDS = int(os.environ.get('SOLE_MAX_JOB_GRIDS', 1000))
+MAX_JOB_HOUSES = int(os.environ.get('SOLE_MAX_JOB_HOUSES', 100000))
+
+# Job tenants by API key, from 'key:tenant,key:tenant'. Clients send their key
+# as 'Authorization: Bearer <key>'. Without keys every client address is a tenant.
+API_KEYS = dict(entry.split(':', 1) for entry in os.environ.get('SOLE_API_KEYS', '').split(',') if entry)
+
+
+def scenario_size(scenario):
+    # Grids and houses of a scenario that reads no files
+    grids = scenario['grids']
+    houses = sum(int(grid.get('num_houses', 0)) for grid in grids)
+    if 'houses' in scenario:
+        houses += len(scenario['houses']['grid'])
+    return len(grids), houses
+
+
+def tenant():
+    # Jobs are private to the tenant that submitted them
+    if not API_KEYS:
+        return request.remote_addr
+    scheme, _, key = request.headers.get('Authorization', '').partition(' ')
+    name = API_KEYS.get(key) if scheme == 'Bearer' else None
+    if name is None:
+        abort(401)
+    return name
+
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """
+    Queue a simulation job. JSON body: optional 'scenario' (default: the app's
+    scenario), 'days' (7), 'seed' (0) and 'vectorized' (true). Submitted
+    scenarios give their houses, edges and demand series inline, not as files,
+    and jobs stay within MAX_JOB_DAYS, MAX_JOB_GRIDS and MAX_JOB_HOUSES.
+    """
+    data = request.get_json(silent=True) or {}
+    days = data.get('days', 7)
+    if isinstance(days, int) and days > MAX_JOB_DAYS:
+        return jsonify(error=f"Jobs can simulate at most {MAX_JOB_DAYS} days."), 400
+    scenario = data.get('scenario')
+    if scenario:
+        try:
+            if scenario_files(scenario):
+                return jsonify(error="Submitted scenarios cannot reference files."), 400
+            num_grids, num_houses = scenario_size(scenario)
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return jsonify(error="Malformed scenario"), 400
+        if num_grids > MAX_JOB_GRIDS or num_houses > MAX_JOB_HOUSES:
+            return jsonify(error=f"Submitted scenarios can have at most {MAX_JOB_GRIDS} grids and {MAX_JOB_HOUSES} houses."), 400
+    else:
+        scenario = load_scenario()
+    try:
+        job_id = get_jobs().submit(tenant(), scenario, num_days=days,
+                             seed=data.get('seed', 0), vectorized=bool(data.get('vectorized', True)))
+    except ValueError as error:
+        return jsonify(error=str(error)), 400
+    except BrokenProcessPool as error:
+        # Not a full queue: the job workers keep dying, see JobService.submit
+        return jsonify(error=f"The job workers failed: {error}"), 500
+    except RuntimeError as error:
+        return jsonify(error=str(error)), 429
+    return jsonify(get_jobs().status(tenant(), job_id)), 202
+
+
+@app.route('/jobs')
+def list_jobs():
+    return jsonify(get_jobs().list(tenant()))
+
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    try:
+        return jsonify(get_jobs().status(tenant(), job_id))
+    except KeyError:
+        return jsonify(error="Unknown job"), 404
+
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    try:
+        status = get_jobs().status(tenant(), job_id)
+        result = get_jobs().result(tenant(), job_id)
+    except KeyError:
+        return jsonify(error="Unknown job"), 404
+    if result is None:
+        return jsonify(status), 409
+    return jsonify(dict(status, **result))
+
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    try:
+        cancelled = get_jobs().cancel(tenant(), job_id)
+    except KeyError:
+        return jsonify(error="Unknown job"), 404
+    return jsonify(get_jobs().status(tenant(), job_id)), 202 if cancelled else 409
+
+
+@socketio.on('watch_job')
+def watch_job(data):
+    """
+    Send 'job_status' events for a job until it has finished.
+    """
+    try:
+        job_tenant = tenant()
+    except Unauthorized:
+        socketio.emit('job_status', {'id': data['id'], 'error': "Unauthorized"}, to=request.sid)
+        return
+    socketio.start_background_task(send_job_status, request.sid, job_tenant, data['id'])
+
+
+def send_job_status(sid, job_tenant, job_id):
+    while True:
+        try:
+            status = get_jobs().status(job_tenant, job_id)
+        except KeyError:
+            socketio.emit('job_status', {'id': job_id, 'error': "Unknown job"}, to=sid)
+            return
+        socketio.emit('job_status', status, to=sid)
+        if status['finished'] is not None:
+            return
+        socketio.sleep(JOB_STATUS_INTERVAL)
+
+
+@app.route('/metrics')
+def metrics():
+    # Prometheus text exposition format
+    return Response(stats.to_prometheus(), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -92,6 +308,10 @@ def internal_error(error):
     print("Server Error: ", error)
     return "Internal server error", 500
 
+startup_seconds = time.perf_counter() - _import_started
+if startup_seconds > STARTUP_BUDGET:
+    print(f"Startup took {startup_seconds:.2f}s, over the {STARTUP_BUDGET:.2f}s budget")
+
 if __name__ == '__main__':
     socketio.run(app, debug=True)
     
\ No newline at end of file
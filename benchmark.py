@@ -0,0 +1,275 @@
+import argparse
+import json
+import os
+import platform
+import random
+import tempfile
+import time
+import timeit
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+
+from MasterNetwork import MiniGrid, Simulation, build_simulation, example_scenario
+from engine import ArrayEngine
+from houses import HouseBank
+from logs import HouseLogSink
+from parallel import default_partitions
+
+
+# Functions that only write logs; everything else inside simulate_days counts as physics
+LOGGING = [
+    (MiniGrid, 'log_to_csv'),
+    (Simulation, 'log_to_csv'),
+    (HouseLogSink, 'record'),
+    (HouseLogSink, 'record_grid'),
+    (HouseLogSink, 'flush'),
+    (ArrayEngine, 'log_grids'),
+    (ArrayEngine, 'log_houses'),
+    (HouseBank, 'log_supply'),
+]
+
+# Hot paths timed per call
+HOT_PATHS = [
+    (MiniGrid, 'step'),
+]
+
+
+
+def grid_scenario(num_grids, num_houses, neighbors=2, seed=0):
+    """
+    num_grids grids of num_houses houses. Every grid trades with its next
+    `neighbors` grids on a ring, so connectivity stays sparse.
+    """
+    rnd = random.Random(seed)
+    base = example_scenario()['grids'][0]
+    grids = []
+    for i in range(num_grids):
+        grids.append(dict(
+            base, id=i + 1, num_houses=num_houses, base_demand=rnd.uniform(8, 14) / 24,
+            avg_sunlight_hours=rnd.uniform(4, 9),
+            neighbors=[(i + k) % num_grids + 1 for k in range(1, neighbors + 1) if (i + k) % num_grids != i],
+        ))
+    return {'conventional_grid': {'buying_price': 0.03, 'selling_price': 0.06}, 'grids': grids}
+
+
+# name -> (scenario builder, days simulated, days in --quick mode)
+SCENARIOS = {
+    'app': (example_scenario, 7, 2),
+    'grids100x100': (lambda: grid_scenario(100, 100), 2, 1),
+    'sparse1000': (lambda: grid_scenario(1000, 10, neighbors=3), 2, 1),
+}
+
+
+
+@contextmanager
+def timed(targets, totals, category=None, depth=None):
+    """
+    Wrap methods so that every call adds to totals[label] = [calls, seconds].
+    With a category, time spent in any of the targets (not counting nested
+    calls twice) is also added to totals[category].
+    """
+    depth = depth if depth is not None else [0]
+    originals = []
+    for cls, name in targets:
+        original = getattr(cls, name)
+        label = f'{cls.__name__}.{name}'
+
+        def wrapper(*args, _original=original, _label=label, **kwargs):
+            depth[0] += 1
+            start = time.perf_counter()
+            try:
+                return _original(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                depth[0] -= 1
+                totals[_label][0] += 1
+                totals[_label][1] += elapsed
+                if category is not None and depth[0] == 0:
+                    totals[category][0] += 1
+                    totals[category][1] += elapsed
+
+        setattr(cls, name, wrapper)
+        originals.append((cls, name, original))
+    try:
+        yield totals
+    finally:
+        for cls, name, original in originals:
+            setattr(cls, name, original)
+
+
+def run_once(scenario, num_days, vectorized, seed, processes=None):
+    # Parallel runs need house logging off
+    simulation = build_simulation(scenario, house_log=HouseLogSink(mode='off') if processes else None)
+    random.seed(seed)
+    simulation.simulate_days(num_days, vectorized=vectorized, processes=processes)
+    if simulation.parallel is not None:
+        simulation.parallel.close()
+    return simulation
+
+
+def best_of(repeat, run):
+    # Shortest wall time of `repeat` calls of run and the result of the last one
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = run()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def serial_seconds(scenario, num_days, seed, processes, repeat=3):
+    """
+    Time of the run a ParallelEngine on `processes` workers gives, in one
+    process: ArrayEngine on the same partitions, house logging off. Best of
+    `repeat` runs.
+    """
+    def run():
+        simulation = build_simulation(scenario, house_log=HouseLogSink(mode='off'))
+        partitions = default_partitions([len(grid.bank) for grid in simulation.grids], processes)
+        random.seed(seed)
+        ArrayEngine(simulation, partitions).run(0, 24 * num_days)
+
+    return best_of(repeat, run)[0]
+
+
+def benchmark(name, vectorized, quick=False, seed=0, processes=None, repeat=3):
+    """
+    Time one scenario with one engine. Returns a dict of results. With
+    processes, the ParallelEngine on that many workers, which adds the
+    speedup over the same run in one process.
+
+    'seconds' is the best of `repeat` runs without any wrappers. The split
+    into logging and physics comes from one more run with the logging
+    methods and hot paths wrapped (timed), which is slower by the cost of
+    the wrappers; its total is 'split_seconds'.
+    """
+    build, days, quick_days = SCENARIOS[name]
+    scenario = build()
+    num_days = quick_days if quick else days
+    num_houses = sum(grid['num_houses'] for grid in scenario['grids'])
+
+    with tempfile.TemporaryDirectory() as directory:
+        cwd = os.getcwd()
+        os.chdir(directory)
+        try:
+            # Timing passes, unwrapped
+            seconds, simulation = best_of(repeat, lambda: run_once(scenario, num_days, vectorized, seed, processes))
+            start = time.perf_counter()
+            simulation.save_logs()
+            for grid in simulation.grids:
+                grid.save_logs()
+            save_seconds = time.perf_counter() - start
+
+            # Split pass, with every logging method and hot path wrapped
+            totals = defaultdict(lambda: [0, 0.0])
+            with timed(LOGGING, totals, category='logging'), timed(HOT_PATHS, totals):
+                start = time.perf_counter()
+                run_once(scenario, num_days, vectorized, seed, processes)
+                split_seconds = time.perf_counter() - start
+            logging_seconds = totals['logging'][1]
+
+            # Memory pass, tracemalloc slows things down so it is kept separate
+            tracemalloc.start()
+            run_once(scenario, num_days, vectorized, seed, processes)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        finally:
+            os.chdir(cwd)
+
+    hours = 24 * num_days
+    extra = {}
+    if processes:
+        reference = serial_seconds(scenario, num_days, seed, processes, repeat)
+        extra = {'processes': processes, 'serial_seconds': reference, 'speedup': reference / seconds}
+    return {
+        'scenario': name,
+        'engine': 'parallel' if processes else 'vectorized' if vectorized else 'object',
+        'grids': len(scenario['grids']),
+        'houses': num_houses,
+        'hours': hours,
+        'seconds': seconds,
+        'hours_per_second': hours / seconds,
+        'split_seconds': split_seconds,
+        'logging_seconds': logging_seconds,
+        'physics_seconds': split_seconds - logging_seconds,
+        'save_logs_seconds': save_seconds,
+        'peak_memory_MB': peak / 2 ** 20,
+        'calls': {label: {'calls': calls, 'seconds': total} for label, (calls, total) in totals.items() if label != 'logging'},
+        **extra,
+    }
+
+
+def micro_benchmarks(number=20000):
+    """
+    Per-call cost of House.consume_energy on the app scenario.
+    """
+    simulation = build_simulation(example_scenario(), house_log=HouseLogSink(mode='off'))
+    house = simulation.grids[0].houses[0]
+    seconds = timeit.timeit(lambda: house.consume_energy(12), number=number)
+    return {'House.consume_energy_us': seconds / number * 1e6}
+
+
+def compare(old, new):
+    """
+    Print the speed of every scenario/engine in new relative to old.
+    """
+    old_results = {(r['scenario'], r['engine']): r for r in old['results']}
+    print(f"{'scenario':<14}{'engine':<12}{'hours/s old':>14}{'hours/s new':>14}{'speedup':>10}{'peak MB':>10}")
+    for result in new['results']:
+        before = old_results.get((result['scenario'], result['engine']))
+        if before is None:
+            continue
+        print(f"{result['scenario']:<14}{result['engine']:<12}{before['hours_per_second']:>14.1f}"
+              f"{result['hours_per_second']:>14.1f}{result['hours_per_second'] / before['hours_per_second']:>10.2f}"
+              f"{result['peak_memory_MB']:>10.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the MasterNetwork hot paths.")
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument('--engines', nargs='+', default=['object', 'vectorized'], choices=['object', 'vectorized', 'parallel'])
+    parser.add_argument('--processes', type=int, default=max(2, os.cpu_count() or 1),
+                        help="Worker processes of the parallel engine")
+    parser.add_argument('--quick', action='store_true', help="Simulate fewer days")
+    parser.add_argument('--repeat', type=int, default=3, help="Timed runs per result, the best one counts")
+    parser.add_argument('--output', default='benchmark.json', help="Where to save the results as JSON")
+    parser.add_argument('--compare', help="Earlier results JSON to compare against")
+    args = parser.parse_args(argv)
+
+    results = []
+    for name in args.scenarios:
+        for engine in args.engines:
+            result = benchmark(name, engine != 'object', quick=args.quick,
+                               processes=args.processes if engine == 'parallel' else None, repeat=args.repeat)
+            results.append(result)
+            print(f"{name:<14}{engine:<12}{result['hours_per_second']:>10.1f} hours/s  "
+                  f"logging {result['logging_seconds']:.2f}s  physics {result['physics_seconds']:.2f}s  "
+                  f"save_logs {result['save_logs_seconds']:.2f}s  peak {result['peak_memory_MB']:.1f} MB"
+                  + (f"  {result['speedup']:.2f}x on {result['processes']} processes" if 'speedup' in result else ''))
+
+    report = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'quick': args.quick,
+        'micro': micro_benchmarks(),
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+    return report
+
+
+
+
+if __name__ == "__main__":
+    main()
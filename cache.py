@@ -0,0 +1,115 @@
+import os
+import threading
+from collections import OrderedDict
+
+from checkpoint import Checkpoint
+
+
+# Part of every ResultCache key; bump it when a change alters simulation results
+RESULT_CACHE_VERSION = 2
+
+
+class ResultCache:
+    """
+    Content-addressed cache of simulation runs (see Simulation.cache_key and
+    run_record), kept in memory and optionally on disk.
+
+    Entries are stored in their Checkpoint binary form. Both levels are LRU
+    and evict by size: the in-memory level holds up to max_memory_bytes, the
+    directory up to max_disk_bytes of '<key>.npz' files, least recently used
+    first. A pickled ResultCache (e.g. sent to a worker process) keeps its
+    directory and limits but starts with an empty memory level.
+
+    :param directory: Directory of the on-disk level, None to keep entries in memory only.
+    """
+
+    def __init__(self, directory=None, max_memory_bytes=256 * 2 ** 20, max_disk_bytes=4 * 2 ** 30):
+        self.directory = directory
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.memory = OrderedDict()  # key -> bytes, least recently used first
+        self.memory_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def __getstate__(self):
+        return {'directory': self.directory, 'max_memory_bytes': self.max_memory_bytes, 'max_disk_bytes': self.max_disk_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.npz')
+
+    def get(self, key):
+        """
+        The cached Checkpoint for key, or None.
+        """
+        with self.lock:
+            data = self.memory.get(key)
+            if data is not None:
+                self.memory.move_to_end(key)
+        if data is None and self.directory is not None:
+            try:
+                with open(self._path(key), 'rb') as f:
+                    data = f.read()
+                os.utime(self._path(key))  # Mark as recently used
+            except FileNotFoundError:
+                pass
+            else:
+                self._remember(key, data)
+
+        if data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return Checkpoint.from_bytes(data)
+
+    def put(self, key, record):
+        data = record.to_bytes()
+        self._remember(key, data)
+        if self.directory is not None:
+            temporary = f'{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(temporary, 'wb') as f:
+                f.write(data)
+            os.replace(temporary, self._path(key))  # Atomic, readers never see a partial entry
+            self._evict_disk()
+
+    def _remember(self, key, data):
+        if len(data) > self.max_memory_bytes:
+            return
+        with self.lock:
+            if key in self.memory:
+                self.memory_bytes -= len(self.memory.pop(key))
+            self.memory[key] = data
+            self.memory_bytes += len(data)
+            while self.memory_bytes > self.max_memory_bytes:
+                self.memory_bytes -= len(self.memory.popitem(last=False)[1])
+
+    def _evict_disk(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.npz'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            self.memory_bytes = 0
+        if self.directory is not None:
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith('.npz'):
+                    os.remove(entry.path)
@@ -0,0 +1,54 @@
+import io
+import json
+
+import numpy as np
+
+
+class Checkpoint:
+    """
+    Snapshot of the full state of a Simulation between two steps, made with
+    Simulation.checkpoint and applied with Simulation.restore.
+
+    It holds the clock, the running totals of the simulation, the conventional
+    grid and every grid, battery levels and capacities, the house accumulators
+    of every HouseBank, the state of the random module (which draws the PV
+    factors) and how many rows every columnar log had received. Scalars are
+    kept as JSON, so ints stay ints and floats round-trip exactly; house
+    accumulators stay NumPy arrays.
+
+    The binary form (to_bytes, save) is a single uncompressed .npz without
+    pickles. A checkpoint only covers state, not structure: restore it into a
+    Simulation built from the same scenario.
+    """
+
+    def __init__(self, state, arrays):
+        self.state = state  # JSON-compatible dict
+        self.arrays = arrays  # name -> array
+
+    @property
+    def hours(self):
+        """
+        Simulation time of the next step, in hours.
+        """
+        return self.state['clock'] / self.state['steps_per_hour']
+
+    def to_bytes(self):
+        buffer = io.BytesIO()
+        np.savez(buffer, state=np.array(json.dumps(self.state)), **self.arrays)
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        with np.load(io.BytesIO(data), allow_pickle=False) as npz:
+            state = json.loads(npz['state'].item())
+            arrays = {name: npz[name] for name in npz.files if name != 'state'}
+        return cls(state, arrays)
+
+    def save(self, file_name):
+        with open(file_name, 'wb') as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, file_name):
+        with open(file_name, 'rb') as f:
+            return cls.from_bytes(f.read())
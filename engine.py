@@ -0,0 +1,637 @@
+import random
+
+import numpy as np
+
+from houses import allocate
+
+
+def _store(level, capacity, energy):
+    # Same arithmetic as Battery.store on plain numbers, returns (new_level, excess)
+    stored_energy = min(energy, capacity - level)
+    return level + stored_energy, energy - stored_energy
+
+
+def _partition_owners(partitions, num_grids):
+    # Partition index of every grid
+    owner = [None] * num_grids
+    for p, part in enumerate(partitions):
+        for g in part:
+            if owner[g] is not None:
+                raise ValueError("Every grid should be in exactly one partition.")
+            owner[g] = p
+    if None in owner:
+        raise ValueError("Every grid should be in exactly one partition.")
+    return owner
+
+
+class ArrayEngine:
+    """
+    Array-backed engine for a Simulation.
+
+    House demands, PV output, battery levels and the house accumulators are held
+    as NumPy arrays and every grid and house is advanced with batched operations
+    each hour. The exchange between neighbouring grids is still resolved grid by
+    grid in list order, exactly like MiniGrid.step, so the grid and simulation
+    logs match the object model for the same random seed.
+
+    The engine reads the state of the grids, houses and the conventional grid
+    when a run starts and writes it back when the run ends. House rows go to
+    the simulation's HouseLogSink a whole grid at a time.
+
+    With partitions, grids only trade with neighbours in their own partition
+    while they step. Grids with neighbours in other partitions (the boundary)
+    keep the surplus or deficit left after that, and trade it with those
+    neighbours and then the conventional grid once every grid has stepped, in
+    list order (see settle). That is the model ParallelEngine runs on worker
+    processes; this engine gives the same results on one. Without links across
+    partitions it is the same as the object model.
+
+    :param partitions: Lists of grid indices, by default one partition of all grids.
+    """
+
+    def __init__(self, simulation, partitions=None):
+        self.simulation = simulation
+        self.conventional_grid = simulation.conventional_grid
+        self.grids = simulation.grids
+
+        index = {id(grid): g for g, grid in enumerate(self.grids)}
+        self.neighbors = []
+        for grid in self.grids:
+            if any(id(ng) not in index for ng in grid.neighboring_grids):
+                raise ValueError(f"MiniGrid {grid.id} has a neighboring grid that is not part of the simulation.")
+            self.neighbors.append([index[id(ng)] for ng in grid.neighboring_grids])
+
+        if simulation.market is not None:
+            raise ValueError("ArrayEngine does not support market clearing, run the object model instead.")
+
+        self.topology = self.grids[0].topology
+        if any(grid.topology is not self.topology for grid in self.grids):
+            raise ValueError("All grids of the simulation should share the same Topology.")
+        if self.topology is not None and self.topology.grids != list(self.grids):
+            raise ValueError("The Topology should list the grids in simulation order.")
+        self.neighbor_pairs = [[(n, None) for n in neighbors] for neighbors in self.neighbors]
+
+        self.grid_ids = [grid.id for grid in self.grids]
+        self.total_daily_energy_requirement = [grid.total_daily_energy_requirement for grid in self.grids]
+        self.selling_price = np.array([grid.selling_price for grid in self.grids], dtype=float)
+        self.pv_capacity = np.array([grid.solar_pv.capacity for grid in self.grids], dtype=float)
+        self.supply_limit = self.conventional_grid.supply_limit(simulation.step_hours)
+        # Grids whose PV output comes from a SolarSite trace, and the ones drawing random factors
+        self.sited = [g for g, grid in enumerate(self.grids) if grid.solar_pv.site is not None]
+        self.random_pv = [g for g, grid in enumerate(self.grids) if grid.solar_pv.site is None]
+
+        # Hourly house demand for every hour of the day, padded to the largest grid.
+        # Padding has zero demand, which leaves every sum and difference unchanged.
+        self.num_houses = np.array([len(grid.bank) for grid in self.grids])
+        width = int(self.num_houses.max(initial=0))
+        self.demand_table = np.zeros((24, len(self.grids), width))
+        self.occupied = np.arange(width) < self.num_houses[:, None]
+        self.priority = np.zeros((len(self.grids), width), dtype=np.int64)
+        for g, grid in enumerate(self.grids):
+            self.demand_table[:, g, :len(grid.bank)] = grid.bank.demand_table()
+            self.priority[g, :len(grid.bank)] = grid.bank.priority
+        self.allocation = [grid.allocation for grid in self.grids]
+        self._policy_rows = None
+
+        # Total demand of each grid per hour of the day, summed house by house like MiniGrid.step
+        self.hourly_demand = self._grid_totals(self.demand_table)
+
+        # Metered houses and sub-hourly clocks need the demand of every step
+        # instead of the hour-of-day table
+        self.steps_per_hour = simulation.steps_per_hour
+        self.step_hours = simulation.step_hours
+        self.per_step_demand = self.steps_per_hour != 1 or any(len(grid.bank.metered) for grid in self.grids)
+
+        # Exchange partners within and across partitions: (grid index, None)
+        # pairs without a Topology, line indices with one, in the order tried
+        self.owner = _partition_owners(partitions or [range(len(self.grids))], len(self.grids))
+        lines = self.topology.lines if self.topology is not None else self.neighbor_pairs
+        targets = self.topology.targets if self.topology is not None else None
+        self.local_partners, self.cross_partners = [], []
+        for g, out in enumerate(lines):
+            partner = [targets[line] if targets else line[0] for line in out]
+            self.local_partners.append([line for line, n in zip(out, partner) if self.owner[n] == self.owner[g]])
+            self.cross_partners.append([line for line, n in zip(out, partner) if self.owner[n] != self.owner[g]])
+        self.boundary = frozenset(g for g, cross in enumerate(self.cross_partners) if cross)
+        # Grids settle works on: the boundary and its partners in other partitions
+        self.shared = self.boundary.union(targets[line] if targets else line[0]
+                                          for g in self.boundary for line in self.cross_partners[g])
+
+        # Grids this engine advances, all of them unless it runs one partition of a
+        # ParallelEngine, their position in self.part and their rows of the per-grid arrays
+        self.part = range(len(self.grids))
+        self.position = {g: g for g in self.part}
+        self.block = slice(None)
+        self.live = simulation.live
+
+        if simulation.stats is not None:
+            simulation.stats.instrument(self)
+
+
+    def _grid_totals(self, demand):
+        # Sum over the house axis in list order, 0 for grids without houses
+        counts = self.num_houses.tolist()
+        totals = np.add.accumulate(demand, axis=-1)[..., -1] if demand.shape[-1] else np.zeros(demand.shape[:-1])
+
+        def per_grid(row):
+            return [total if n else 0 for total, n in zip(row, counts)]
+
+        totals = totals.tolist()
+        return [per_grid(row) for row in totals] if demand.ndim == 3 else per_grid(totals)
+
+
+    def step_demand(self, hours):
+        """
+        House demands (grids, houses) and grid totals for the step starting at hours.
+        """
+        if not self.per_step_demand:
+            return self.demand_table[hours % 24], self.hourly_demand[hours % 24]
+        demand = np.zeros(self.demand_table.shape[1:])
+        for g in self.part:
+            bank = self.grids[g].bank
+            demand[g, :len(bank)] = bank.demand(hours, self.step_hours)
+        return demand, self._grid_totals(demand)
+
+
+    @staticmethod
+    def _accumulate(ufunc, first, rows):
+        # Running ufunc along each row, starting from `first`. Left to right, so it
+        # rounds exactly like the sequential Python loops it replaces.
+        return ufunc.accumulate(np.concatenate([first[:, None], rows], axis=1), axis=1)
+
+
+    def pv_output(self, times):
+        """
+        Pre-generate the PV output of every grid for a block of steps.
+
+        The random factors are drawn from the global random module in the same
+        order SolarPV.generate_energy draws them: step by step, grid by grid,
+        only during daylight hours and only for grids without a SolarSite.
+        Grids with a site look their output up in the site's trace.
+
+        :param times: Start of every step in hours.
+        :return: (producing, output) where producing is a list of booleans per step
+                 and output holds one row of kWh per grid for each producing step.
+        """
+        daylight = [9 <= hours % 24 < 17 for hours in times]
+        draws = np.array([random.random() for _ in range(sum(daylight) * len(self.random_pv))])
+        factors = 0.7 + (0.95 - 0.7) * draws.reshape(sum(daylight), len(self.random_pv))
+        if not self.sited:
+            return daylight, self.pv_capacity * factors * self.step_hours
+
+        # Sited grids produce (possibly zero) output every step
+        output = np.zeros((len(times), len(self.grids)))
+        output[np.ix_(np.flatnonzero(daylight), self.random_pv)] = self.pv_capacity[self.random_pv] * factors * self.step_hours
+        times = np.array(times)
+        for g in self.sited:
+            site = self.grids[g].solar_pv.site
+            output[:, g] = self.pv_capacity[g] * site.trace[site.index(times)] * self.step_hours
+        return [True] * len(times), output
+
+
+    def load_state(self):
+        self.pool = [grid.total_generation for grid in self.grids]
+        self.total_demand = [grid.total_demand for grid in self.grids]
+        self.unmet_demand = [grid.unmet_demand for grid in self.grids]
+        self.generation = [grid.generation for grid in self.grids]
+        self.revenue = np.array([grid.revenue for grid in self.grids], dtype=float)
+        self.battery_level = np.array([grid.battery.level for grid in self.grids], dtype=float)
+        self.battery_capacity = np.array([grid.battery.capacity for grid in self.grids], dtype=float)
+        self.total_energy_generated = np.array([grid.solar_pv.total_energy_generated for grid in self.grids], dtype=float)
+
+        shape = self.demand_table.shape[1:]
+        self.current_demand = np.zeros(shape)
+        self.house_unmet_demand = np.zeros(shape)
+        self.cost = np.zeros(shape)
+        self.supplied_energy = np.zeros(shape)
+        self.mixed_source = np.zeros(shape, dtype=bool)
+        for g, grid in enumerate(self.grids):
+            bank = grid.bank
+            n = len(bank)
+            self.current_demand[g, :n] = bank.current_demand
+            self.house_unmet_demand[g, :n] = bank.unmet_demand
+            self.cost[g, :n] = bank.cost
+            self.supplied_energy[g, :n] = bank.supplied_energy
+            self.mixed_source[g, :n] = bank.source == bank.source_code('mixed')
+
+
+    def store_state(self):
+        levels = self.battery_level.tolist()
+        revenue = self.revenue.tolist()
+        total_energy_generated = self.total_energy_generated.tolist()
+        for g in self.part:
+            grid = self.grids[g]
+            grid.total_generation = self.pool[g]
+            grid.total_demand = self.total_demand[g]
+            grid.generation = self.generation[g]
+            grid.unmet_demand = self.unmet_demand[g]
+            grid.revenue = revenue[g]
+            grid.battery.level = levels[g]
+            grid.solar_pv.total_energy_generated = total_energy_generated[g]
+
+            bank = grid.bank
+            n = len(bank)
+            bank.current_demand = self.current_demand[g, :n].copy()
+            bank.unmet_demand = self.house_unmet_demand[g, :n].copy()
+            bank.cost = self.cost[g, :n].copy()
+            bank.supplied_energy = self.supplied_energy[g, :n].copy()
+            bank.source[:] = np.where(self.mixed_source[g, :n], bank.source_code('mixed'), bank.source_code('generation'))
+
+
+    def run(self, start_hour, num_hours):
+        """
+        Advance the simulation by num_hours hours starting at start_hour.
+        """
+        self.load_state()
+        self.level = self.battery_level.tolist()
+        self.capacity = self.battery_capacity.tolist()
+
+        first_step = start_hour * self.steps_per_hour
+        times = [self.simulation.time(step) for step in range(first_step, first_step + num_hours * self.steps_per_hour)]
+        producing, output = self.pv_output(times)
+        k = 0
+        for hours, is_producing in zip(times, producing):
+            generation = None
+            if is_producing:
+                generation = output[k]
+                k += 1
+            self.step(hours, generation)
+
+        self.battery_level = np.array(self.level, dtype=float)
+        self.store_state()
+
+
+    def log_grids(self, hours, generation, total_demand, revenue, rows):
+        # Grid logs, same rows as MiniGrid.log_to_csv. revenue and rows follow self.part.
+        for i, g in enumerate(self.part):
+            grid = self.grids[g]
+            internal, external, battery_level, state_of_charge, unmet_demand = rows[i]
+            grid.log.append({
+                'simulation_hour': hours,
+                'generation_kWh': round(generation[g], 3),
+                'total_demand_kWh': round(total_demand[g], 3),
+                'unmet_demand_kWh': round(unmet_demand, 3),
+                'internal_grid_transactions_kWh': str([(x[0], round(x[1], 3), x[2]) for x in internal]),
+                'external_grid_transactions_kWh': str([(x[0], round(x[1], 3), round(x[2], 3)) for x in external]),
+                'revenue_USD': round(revenue[i], 3),
+                'battery_level_kWh': round(battery_level, 3),
+                'battery_%': round(state_of_charge, 2),
+            })
+            if grid.columnar_log.enabled:
+                grid.columnar_log.append(hours, generation[g], total_demand[g], unmet_demand, revenue[i], battery_level, state_of_charge)
+                grid.columnar_log.append_transactions(hours, internal, external)
+
+
+    def log_houses(self, hours):
+        # Hand the house rows of every grid to the simulation's HouseLogSink
+        unmet_demand = self.house_unmet_demand.tolist()
+        current_demand = self.current_demand.tolist()
+        cost = self.cost.tolist()
+        served = self.mixed_source.tolist()
+        for g, grid in enumerate(self.grids):
+            n = len(grid.bank)
+            energy_source = ['mixed' if s else 'generation' for s in served[g][:n]]
+            self.simulation.house_log.record_grid(grid, hours, current_demand[g][:n], unmet_demand[g][:n], cost[g][:n], energy_source)
+
+
+    def _partners(self, g, direction, lines):
+        # Same partners and order as MiniGrid.exchange_partners among `lines`
+        # (local_partners or cross_partners), as (grid index, line)
+        if self.topology is None:
+            return lines[g]
+        if direction == 'supply':
+            key = lambda n: self.capacity[n] - self.level[n]
+        else:
+            key = lambda n: (max(0, self.pool[n] - self.total_demand[n])
+                             + max(0, self.level[n] - 2 * self.total_daily_energy_requirement[n]))
+        return [(self.topology.targets[line], line) for line in self.topology.ordered_lines(g, key, lines[g])]
+
+
+    def _offer(self, g, excess, partners, internal):
+        # Offer surplus to the partners in turn, returns the surplus left
+        topology = self.topology
+        for n, line in partners:
+            if excess <= 0:
+                break
+            initial_excess = excess
+            if line is None:
+                excess = self._accept_energy(n, excess, self.grid_ids[g])
+            else:
+                # Same arithmetic as Topology.offer
+                offered = min(excess, topology.remaining(line))
+                loss = topology.line_loss[line]
+                not_accepted = self._accept_energy(n, offered * (1 - loss), self.grid_ids[g])
+                excess = (excess - offered) + not_accepted / (1 - loss)
+                topology.used[line] += initial_excess - excess
+            energy_transferred = initial_excess - excess
+            if energy_transferred > 0:
+                internal.append((self.grid_ids[n], energy_transferred, 'supply'))
+        return excess
+
+
+    def _request(self, g, energy_balance, total_energy_acquired, partners, internal):
+        # Ask the partners in turn, returns the balance and energy acquired after it
+        topology = self.topology
+        for n, line in partners:
+            if energy_balance >= 0:
+                break
+            if line is None:
+                energy_provided = self._provide_energy(n, abs(energy_balance), self.grid_ids[g])
+            else:
+                # Same arithmetic as Topology.request
+                loss = topology.line_loss[line]
+                energy_sent = self._provide_energy(n, min(abs(energy_balance) / (1 - loss), topology.remaining(line)), self.grid_ids[g])
+                topology.used[line] += energy_sent
+                energy_provided = energy_sent * (1 - loss)
+            total_energy_acquired += energy_provided
+            energy_balance += energy_provided
+            if energy_provided > 0:
+                internal.append((self.grid_ids[n], energy_provided, 'demand'))
+        return energy_balance, total_energy_acquired
+
+
+    def _trade_conventional(self, excess, energy_balance, external):
+        # Sell what is left of a surplus or buy what is left of a deficit, up to the
+        # supply limit. Returns (excess, shortage, revenue, cost, energy bought).
+        revenue_from_sale = cost_of_energy = amount_bought = 0
+        if excess > 0:
+            revenue_from_sale = self.conventional_grid.buy_energy(excess)
+            external.append(('sell', excess, revenue_from_sale))
+        elif energy_balance < 0:
+            amount_needed = min(abs(energy_balance), self.supply_limit)
+            if amount_needed > 0:
+                cost_of_energy = self.conventional_grid.sell_energy(amount_needed)
+                amount_bought = amount_needed
+                energy_balance += amount_needed
+                external.append(('buy', amount_needed, cost_of_energy))
+        return excess, max(0, -energy_balance), revenue_from_sale, cost_of_energy, amount_bought
+
+
+    def _row(self, g, shortage):
+        # Log row of grid g after its trades, the transaction logs start over
+        grid = self.grids[g]
+        internal = grid.internal_transactions_log
+        external = grid.external_transactions_log
+        row = (internal.copy(), external.copy(), self.level[g], max((self.level[g] / self.capacity[g]) * 100, 0), shortage)
+        internal.clear()
+        external.clear()
+        return row
+
+
+    def exchange(self, hours, deferred):
+        """
+        Hook between the steps of the grids and settle. A partition of a
+        ParallelEngine swaps the state of the boundary grids here.
+        """
+
+
+    def settle(self, deferred):
+        """
+        Trades of the boundary grids with their neighbours in other partitions
+        and then the conventional grid, grid by grid in list order.
+
+        :param deferred: Boundary grid -> [excess, energy_balance, energy acquired]
+                         after its step.
+        :return: Grid of self.part -> (excess, shortage, revenue, cost, energy acquired).
+        """
+        settled = {}
+        for g in sorted(deferred):
+            excess, energy_balance, total_energy_acquired = deferred[g]
+            internal = self.grids[g].internal_transactions_log
+            if excess > 0:
+                excess = self._offer(g, excess, self._partners(g, 'supply', self.cross_partners), internal)
+            elif energy_balance < 0:
+                energy_balance, total_energy_acquired = self._request(
+                    g, energy_balance, total_energy_acquired, self._partners(g, 'demand', self.cross_partners), internal)
+            if g in self.position:
+                excess, shortage, revenue_from_sale, cost_of_energy, amount_bought = self._trade_conventional(
+                    excess, energy_balance, self.grids[g].external_transactions_log)
+                settled[g] = (excess, shortage, revenue_from_sale, cost_of_energy, total_energy_acquired + amount_bought)
+        return settled
+
+
+    def _accept_energy(self, n, amount, from_grid_id):
+        # Same logic as MiniGrid.accept_energy on the engine state of grid n
+        accepted = min(max(0, self.capacity[n] - self.level[n]), amount)
+        self.level[n], _ = _store(self.level[n], self.capacity[n], accepted)
+        if accepted > 0:
+            self.grids[n].internal_transactions_log.append((from_grid_id, accepted, 'receive'))
+        return amount - accepted
+
+
+    def _provide_energy(self, n, amount_needed, to_grid_id):
+        # Same logic as MiniGrid.provide_energy on the engine state of grid n
+        current_surplus = self.pool[n] - self.total_demand[n]
+        two_day_reserve = 2 * self.total_daily_energy_requirement[n]
+        max_draw_from_battery = max(0, self.level[n] - two_day_reserve)
+
+        energy_from_generation = 0
+        if current_surplus > 0:
+            energy_from_generation = min(amount_needed, current_surplus)
+            self.pool[n] -= energy_from_generation
+            amount_needed -= energy_from_generation
+
+        energy_from_battery = 0
+        if amount_needed > 0 and max_draw_from_battery > 0:
+            energy_from_battery = min(amount_needed, max_draw_from_battery)
+            self.level[n] -= min(energy_from_battery, self.level[n])
+
+        total_energy_provided = energy_from_generation + energy_from_battery
+        if total_energy_provided > 0:
+            self.grids[n].internal_transactions_log.append((to_grid_id, total_energy_provided, 'supply'))
+
+        return total_energy_provided
+
+
+    def step(self, hours, generation=None):
+        """
+        Advance every grid and house by one step.
+
+        :param generation: PV output of every grid for this step, None at night.
+        """
+        num_grids = len(self.grids)
+        part, block = self.part, self.block
+        demand, hourly_demand = self.step_demand(hours)
+        demand = demand[block]
+        pool, level, capacity = self.pool, self.level, self.capacity
+        topology = self.topology
+        if topology is not None:
+            topology.start_hour(hours)
+
+        if generation is None:
+            gen = [0] * num_grids
+            expected_pool = np.array(pool, dtype=float)[block]
+        else:
+            gen = generation.tolist()
+            if self.sited and not 9 <= hours % 24 < 17:
+                # SolarPV without a site returns an int 0 outside daylight hours
+                for g in self.random_pv:
+                    gen[g] = 0
+            expected_pool = np.array(pool, dtype=float)[block] + generation[block]
+            # Revenue for energy supplied from ongoing generation
+            from_generation = np.minimum(generation[block, None], demand) * self.selling_price[block, None]
+            self.revenue[block] = self._accumulate(np.add, self.revenue[block], from_generation)[:, -1]
+            self.total_energy_generated[block] = self.total_energy_generated[block] + generation[block]
+        self.generation = gen
+
+        # Houses draw on the generation pool in list order. Work it out for all grids
+        # at once assuming nobody touches the pool before the grid steps; grids whose
+        # pool was drawn on by an earlier grid this hour are redone on their own.
+        remaining_pool = self._accumulate(np.subtract, expected_pool, demand)
+        pool_after = np.where((remaining_pool[:, 1:] < 0).any(axis=1), 0.0, remaining_pool[:, -1]).tolist()
+        expected_pool = expected_pool.tolist()
+        start_pool = [0] * len(part)
+
+        excesses = [0] * len(part)
+        shortages = [0] * len(part)
+        acquired = [0] * len(part)
+        sales = np.zeros(len(part))
+        purchases = np.zeros(len(part))
+        rows = [None] * len(part)
+        deferred = {}  # Boundary grid -> [excess, energy_balance, energy acquired], see settle
+
+        for i, g in enumerate(part):
+            grid = self.grids[g]
+            internal = grid.internal_transactions_log
+            external = grid.external_transactions_log
+
+            pool[g] += gen[g]
+            start_pool[i] = pool[g]
+            if pool[g] > 0:
+                if pool[g] == expected_pool[i]:
+                    pool[g] = pool_after[i]
+                else:
+                    own = self._accumulate(np.subtract, np.array([pool[g]], dtype=float), demand[i:i + 1])
+                    pool[g] = 0.0 if (own[0, 1:] < 0).any() else float(own[0, -1])
+
+            self.total_demand[g] = hourly_demand[g]
+            energy_balance = gen[g] - hourly_demand[g]
+            excess = 0
+            total_energy_acquired = 0
+
+            # Surplus: battery first, then neighbours, then the conventional grid
+            if energy_balance > 0:
+                level[g], excess = _store(level[g], capacity[g], energy_balance)
+                excess = self._offer(g, excess, self._partners(g, 'supply', self.local_partners), internal)
+
+            # Deficit: battery first, then neighbours, then the conventional grid
+            elif energy_balance < 0:
+                min_reserve = 0.0 * self.total_daily_energy_requirement[g]
+                max_draw_from_battery = max(0, level[g] - min_reserve)
+
+                if max_draw_from_battery > 0:
+                    energy_to_draw = min(abs(energy_balance), max_draw_from_battery)
+                    energy_from_battery = min(energy_to_draw, level[g])
+                    level[g] -= energy_from_battery
+                    total_energy_acquired += energy_from_battery
+                    energy_balance += energy_from_battery
+
+                if energy_balance < 0:
+                    energy_balance, total_energy_acquired = self._request(
+                        g, energy_balance, total_energy_acquired, self._partners(g, 'demand', self.local_partners), internal)
+
+            if g in self.boundary:
+                # Trades with other partitions and the conventional grid wait for settle
+                deferred[g] = [excess, energy_balance, total_energy_acquired]
+                continue
+            excesses[i], shortages[i], sales[i], purchases[i], amount_bought = self._trade_conventional(excess, energy_balance, external)
+            acquired[i] = total_energy_acquired + amount_bought
+            rows[i] = self._row(g, shortages[i])
+
+        self.exchange(hours, deferred)
+        for g, settled in self.settle(deferred).items():
+            i = self.position[g]
+            excesses[i], shortages[i], sales[i], purchases[i], acquired[i] = settled
+            rows[i] = self._row(g, shortages[i])
+        for i, g in enumerate(part):
+            self.unmet_demand[g] = shortages[i]
+
+        # Houses, all grids at once, from the pool each grid had when it stepped
+        if start_pool != expected_pool:
+            remaining_pool = self._accumulate(np.subtract, np.array(start_pool, dtype=float), demand)
+        price = self.selling_price[block, None]
+        supplied = np.minimum(demand, np.maximum(remaining_pool[:, :-1], 0))
+        unmet_demand = np.maximum(demand - supplied, 0)
+        current_demand = demand.copy()
+        cost = self.cost[block] + supplied * price
+        revenue = (self.revenue[block] + sales) - purchases
+
+        # Distribute the energy acquired in a deficit among houses with unmet demand, by the grids' allocation policies
+        acquired = np.array(acquired, dtype=float)
+        served = (unmet_demand > 0) & (acquired > 0)[:, None]
+        if served.any():
+            energy = np.where(served, self._allocate(acquired, np.where(served, unmet_demand, 0)), 0)
+            unmet_demand = np.where(served, np.maximum(unmet_demand - energy, 0), unmet_demand)
+            current_demand = np.where(served, np.maximum(current_demand - energy, 0), current_demand)
+            cost = cost + energy * price
+            self.supplied_energy[block] = self.supplied_energy[block] + energy
+            revenue = self._accumulate(np.add, revenue, energy * price)[:, -1]
+
+            # Supply log rows, same as HouseBank.distribute
+            for i in np.flatnonzero(served.any(axis=1)).tolist():
+                bank = self.grids[part[i]].bank
+                index = np.flatnonzero(served[i])
+                state = (unmet_demand[i, index], current_demand[i, index], cost[i, index],
+                         self.supplied_energy[part[i], index], bank.source_code('mixed'))
+                bank.log_supply(index, energy[i, index], state)
+
+        self.current_demand[block] = current_demand
+        self.house_unmet_demand[block] = unmet_demand
+        self.cost[block] = cost
+        self.mixed_source[block] = served
+        self.revenue[block] = revenue
+
+        self.log_grids(hours, gen, hourly_demand, revenue.tolist(), rows)
+
+        if self.simulation.house_log.should_log(hours):
+            self.log_houses(hours)
+
+        self.totals(hours, excesses, shortages)
+
+
+    def _allocate(self, energy, unmet):
+        # allocate for the grids of self.part, a batch per allocation policy
+        if self._policy_rows is None:
+            policies = np.array([self.allocation[g] for g in self.part])
+            self._policy_rows = {policy: np.flatnonzero(policies == policy) for policy in np.unique(policies).tolist()}
+        priority = self.priority[self.block]
+        if len(self._policy_rows) == 1:
+            return allocate(energy, unmet, next(iter(self._policy_rows)), priority)
+        supplied = np.zeros_like(unmet)
+        for policy, rows in self._policy_rows.items():
+            supplied[rows] = allocate(energy[rows], unmet[rows], policy, priority[rows])
+        return supplied
+
+
+    def totals(self, hours, excesses, shortages):
+        """
+        Simulation totals and log row of the step, same as Simulation.step.
+        """
+        simulation = self.simulation
+        total_excess = 0
+        total_shortage = 0
+        for excess, shortage in zip(excesses, shortages):
+            total_excess += excess
+            total_shortage += shortage
+        if total_excess > 0:
+            self.conventional_grid.buy_energy(total_excess)
+            simulation.total_grid_transactions += total_excess
+
+        simulation.total_generation = sum(self.pool)
+        simulation.total_demand = sum(self.total_demand)
+        simulation.unmet_demand += total_shortage
+        simulation.total_client_revenue = float(np.add.accumulate(self.cost.ravel())[-1]) if self.cost.size else 0
+        simulation.revenue = sum(self.revenue.tolist())
+        simulation.log_to_csv(hours)
+        if self.live is not None:
+            self.publish(hours)
+
+
+    def publish(self, hours):
+        # State of the step for the simulation's LiveState, from the engine's arrays
+        level = np.array(self.level, dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            state_of_charge = np.maximum(level / self.battery_capacity * 100, 0)
+        grids = [self.generation, self.total_demand, level, state_of_charge, self.revenue]
+        houses = [values[self.occupied] for values in (self.current_demand, self.house_unmet_demand, self.cost, self.supplied_energy)]
+        self.live.publish(self.simulation, hours, grids, houses)
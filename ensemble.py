@@ -0,0 +1,182 @@
+import numpy as np
+
+from engine import ArrayEngine
+
+
+class Ensemble:
+    """
+    Monte Carlo ensemble of a Simulation.
+
+    Runs N stochastic realizations of the same network in one vectorized pass:
+    the state of every grid is an array over members and each hour is advanced
+    for all members at once, following the same rules as MiniGrid.step. PV
+    draws are pre-generated per member from a seeded numpy.random.Generator,
+    so member i sees the same weather whatever the ensemble size.
+
+    The Simulation is only read, its state is the starting point of every member.
+    Grids trade with their neighboring_grids in list order and houses are
+    served in list order. Simulations with a Topology, MarketClearing, another
+    allocation policy or a capped conventional grid are rejected, the ensemble
+    does not model them.
+    """
+
+    def __init__(self, simulation, num_members, seed=0):
+        self.simulation = simulation
+        self.grids = simulation.grids
+        self.num_members = num_members
+        self.seed = seed
+
+        if simulation.market is not None:
+            raise ValueError("Ensemble trades greedily between neighbours, MarketClearing is not supported.")
+        if any(grid.topology is not None for grid in simulation.grids):
+            raise ValueError("Ensemble trades over unlimited lossless lines, a Topology is not supported.")
+        if any(grid.allocation != 'order' for grid in simulation.grids):
+            raise ValueError("Ensemble serves houses in list order, only the 'order' allocation is supported.")
+
+        # Reuse the engine's precomputed network tables
+        engine = ArrayEngine(simulation)
+        if engine.per_step_demand:
+            raise ValueError("Ensemble needs an hourly clock and demand profiles, metered houses are not supported.")
+        if engine.sited:
+            raise ValueError("Ensemble draws random PV factors, grids with a SolarSite are not supported.")
+        if simulation.conventional_grid.max_supply is not None:
+            raise ValueError("Ensemble buys every deficit from the conventional grid, a max_supply is not supported.")
+        self.neighbors = engine.neighbors
+        self.pv_capacity = engine.pv_capacity
+        self.selling_price = engine.selling_price
+        self.hourly_demand = np.array(engine.hourly_demand, dtype=float)  # (24, grids)
+        self.reserve = 2 * np.array(engine.total_daily_energy_requirement, dtype=float)
+
+        # Sorted house demands and their running sums, to evaluate
+        # sum(min(generation, demand)) for every member with one searchsorted
+        self.sorted_demand = []
+        self.demand_prefix = []
+        for g, n in enumerate(engine.num_houses.tolist()):
+            demand = np.sort(engine.demand_table[:, g, :n], axis=1)
+            self.sorted_demand.append(demand)
+            self.demand_prefix.append(np.concatenate([np.zeros((24, 1)), np.cumsum(demand, axis=1)], axis=1))
+
+    def pv_factors(self, num_daylight_hours):
+        """
+        Random PV factors with shape (members, daylight hours, grids).
+        """
+        children = np.random.SeedSequence(self.seed).spawn(self.num_members)
+        return np.stack([np.random.default_rng(child).uniform(0.7, 0.95, size=(num_daylight_hours, len(self.grids)))
+                         for child in children])
+
+    def _from_generation(self, g, hod, generation):
+        # Energy the houses of grid g take from this hour's generation, summed over houses
+        demand = self.sorted_demand[g][hod]
+        k = np.searchsorted(demand, generation, side='right')
+        return self.demand_prefix[g][hod][k] + generation * (len(demand) - k)
+
+    def run(self, num_days, start_hour=0, percentiles=(10, 50, 90), pv_factors=None):
+        """
+        Run the ensemble and return percentile bands.
+
+        Unmet demand is the energy the grids could not cover from their own
+        generation, battery or neighbours and had to buy from the conventional grid.
+
+        :param pv_factors: Optional (members, daylight hours, grids) factors instead of random draws.
+        :return: dict with 'hour', 'percentiles' and bands with a leading percentile axis:
+                 'unmet_demand_kWh' (hours), 'battery_%' (hours, grids), 'revenue_USD' (hours)
+                 for the network as a whole, plus the final per-member totals under 'members'.
+        """
+        num_hours = 24 * num_days
+        hours = np.arange(start_hour, start_hour + num_hours)
+        daylight = (hours % 24 >= 9) & (hours % 24 < 17)
+        if pv_factors is None:
+            pv_factors = self.pv_factors(int(daylight.sum()))
+
+        shape = (self.num_members, len(self.grids))
+        pool = np.full(shape, [float(grid.total_generation) for grid in self.grids])
+        total_demand = np.full(shape, [float(grid.total_demand) for grid in self.grids])
+        level = np.full(shape, [float(grid.battery.level) for grid in self.grids])
+        capacity = np.array([grid.battery.capacity for grid in self.grids], dtype=float)
+        revenue = np.full(shape, [float(grid.revenue) for grid in self.grids])
+        buying_price = self.simulation.conventional_grid.buying_price
+        grid_selling_price = self.simulation.conventional_grid.selling_price
+
+        unmet = np.zeros((num_hours, self.num_members))
+        state_of_charge = np.zeros((num_hours, self.num_members, len(self.grids)))
+        total_revenue = np.zeros((num_hours, self.num_members))
+        zero = np.zeros(self.num_members)
+
+        k = 0
+        for t, is_daylight in enumerate(daylight):
+            hod = hours[t] % 24
+            generation = pv_factors[:, k] * self.pv_capacity if is_daylight else None
+            k += int(is_daylight)
+
+            for g in range(len(self.grids)):
+                gen = generation[:, g] if generation is not None else zero
+                demand = self.hourly_demand[hod, g]
+                price = self.selling_price[g]
+
+                # Houses draw on the generation pool
+                pool[:, g] += gen
+                unmet_after_generation = demand - np.minimum(pool[:, g], demand)
+                pool[:, g] = np.where(pool[:, g] >= demand, pool[:, g] - demand, 0)
+                if generation is not None:
+                    revenue[:, g] += self._from_generation(g, hod, gen) * price
+                total_demand[:, g] = demand
+                balance = gen - demand
+
+                # Surplus: battery, neighbours, conventional grid
+                surplus = balance > 0
+                stored = np.where(surplus, np.minimum(balance, capacity[g] - level[:, g]), 0)
+                level[:, g] += stored
+                excess = np.where(surplus, balance - stored, 0)
+                for n in self.neighbors[g]:
+                    offering = excess > 0
+                    accepted = np.where(offering, np.minimum(np.maximum(0, capacity[n] - level[:, n]), excess), 0)
+                    level[:, n] += np.where(offering, np.minimum(accepted, capacity[n] - level[:, n]), 0)
+                    excess -= accepted
+                revenue[:, g] += np.where(excess > 0, excess, 0) * buying_price
+
+                # Deficit: battery, neighbours, conventional grid
+                deficit = balance < 0
+                drawn = np.where(deficit & (level[:, g] > 0), np.minimum(-balance, level[:, g]), 0)
+                level[:, g] -= drawn
+                balance = balance + drawn
+                acquired = drawn
+                for n in self.neighbors[g]:
+                    needed = np.where(deficit & (balance < 0), -balance, 0)
+                    available = pool[:, n] - total_demand[:, n]
+                    from_generation = np.where(available > 0, np.minimum(needed, available), 0)
+                    pool[:, n] -= from_generation
+                    needed = needed - from_generation
+                    spare = np.maximum(0, level[:, n] - self.reserve[n])
+                    from_battery = np.where((needed > 0) & (spare > 0), np.minimum(needed, spare), 0)
+                    level[:, n] -= np.minimum(from_battery, level[:, n])
+                    balance = balance + from_generation + from_battery
+                    acquired = acquired + from_generation + from_battery
+                bought = np.where(deficit & (balance < 0), -balance, 0)
+                revenue[:, g] -= bought * grid_selling_price
+                acquired = acquired + bought
+                unmet[t] += bought
+
+                # Acquired energy is sold on to houses with unmet demand
+                revenue[:, g] += np.where(deficit, np.minimum(acquired, unmet_after_generation), 0) * price
+
+            state_of_charge[t] = np.maximum(level / capacity * 100, 0)
+            total_revenue[t] = revenue.sum(axis=1)
+
+        return {
+            'hour': hours,
+            'percentiles': np.asarray(percentiles),
+            'unmet_demand_kWh': np.percentile(unmet, percentiles, axis=1),
+            'battery_%': np.percentile(state_of_charge, percentiles, axis=1),
+            'revenue_USD': np.percentile(total_revenue, percentiles, axis=1),
+            'members': {
+                'unmet_demand_kWh': unmet.sum(axis=0),
+                'revenue_USD': total_revenue[-1],
+            },
+        }
+
+
+def run_ensemble(simulation, num_members, num_days, seed=0, percentiles=(10, 50, 90)):
+    """
+    Run num_members realizations of a Simulation and return P10/P50/P90 bands.
+    """
+    return Ensemble(simulation, num_members, seed=seed).run(num_days, percentiles=percentiles)
@@ -0,0 +1,513 @@
+import numpy as np
+
+from logs import RingBuffer, default_house_log
+
+
+def _house_field(name):
+    # House attribute kept in the grid's HouseBank, or in the house itself
+    # while it does not belong to a bank yet
+    def get(self):
+        if self.bank is None:
+            return self._state[name]
+        return self.bank.get(name, self.index)
+
+    def set(self, value):
+        if self.bank is None:
+            self._state[name] = value
+        else:
+            self.bank.set(name, self.index, value)
+
+    return property(get, set)
+
+
+class House:
+    """
+    A house connected to a MiniGrid.
+
+    Demand follows either a 24-value demand_profile that repeats every day or,
+    for metered houses, one meter column of a DemandSeries scaled by base_demand.
+
+    Once the house joins a grid its state is stored in the grid's HouseBank and
+    the House is only a view on its row there, so the attributes below read and
+    write the bank's arrays.
+    """
+    __slots__ = ('id', 'grid', 'bank', 'index', '_state')
+
+    base_demand = _house_field('base_demand')
+    demand_profile = _house_field('demand_profile')
+    demand_series = _house_field('demand_series')
+    meter = _house_field('meter')
+    current_demand = _house_field('current_demand')
+    unmet_demand = _house_field('unmet_demand')
+    cost = _house_field('cost')
+    supplied_energy = _house_field('supplied_energy')
+    energy_source = _house_field('energy_source')
+    simulation_time = _house_field('simulation_time')
+
+    def __init__(self, id, base_demand, demand_profile=None, demand_series=None, meter=None):
+        if (demand_profile is None) == (demand_series is None):
+            raise ValueError("Give either a demand_profile or a demand_series.")
+
+        # Check that demand_profile is a list with 24 elements
+        if demand_profile is not None and len(demand_profile) != 24:
+            raise ValueError("demand_profile should have 24 values representing hourly consumption.")
+        
+        self.id = id
+        self.grid = None
+        self.bank = None
+        self.index = None
+        self._state = {'log': []}  # A log to keep track of various details
+        self.base_demand = base_demand
+        self.current_demand = self.base_demand if demand_series is None else 0
+        self.demand_profile = demand_profile
+        self.demand_series = demand_series
+        self.meter = None if demand_series is None else demand_series.column(meter if meter is not None else 0)
+        self.unmet_demand = 0
+        self.cost = 0
+        self.simulation_time = 0
+        self.supplied_energy = 0
+        self.energy_source = None # This should be updated when energy is supplied
+
+    @classmethod
+    def view(cls, bank, index):
+        """
+        House for row `index` of a HouseBank.
+        """
+        house = cls.__new__(cls)
+        house.id = bank.ids[index].item()
+        house.grid = bank.grid
+        house.bank = bank
+        house.index = index
+        house._state = None
+        return house
+
+    @property
+    def log(self):
+        if self.bank is None:
+            return self._state['log']
+        return self.bank.house_log(self.index)
+
+    def assign_to_grid(self, grid):
+        self.grid = grid
+
+    def demand_at(self, hours, duration=1):
+        """
+        Energy demand in kWh from hours to hours + duration.
+        """
+        if self.demand_series is not None:
+            return self.base_demand * self.demand_series.read(hours, duration, [self.meter])[0].item()
+        demand = self.base_demand * self.demand_profile[int(hours % 24)]
+        return demand if duration == 1 else demand * duration
+
+    def consume_energy(self, hours):
+        self.current_demand = self.demand_at(hours, 1 if self.grid is None else self.grid.step_hours)
+        self.energy_source = "generation" # setting the source to generation as it is during generation
+
+        if self.grid is not None:
+            # energy from ongoing generation
+            supplied_energy = self.grid.supply_energy_to_house(self.current_demand) 
+            # Ensure that supplied energy is not negative.
+            supplied_energy = max(0, supplied_energy)
+            # Unmet demand is current demand minus the energy supplied.
+            self.unmet_demand = max(self.current_demand - supplied_energy, 0)
+            # Update the cost.
+            self.cost += supplied_energy * self.grid.selling_price
+            
+        return self.current_demand
+
+    
+    
+    def supply_energy(self, amount_supplied, simulation_hour, source = 'mixed'):
+        """
+        Receive supplied energy.
+        
+        :param amount_supplied: Amount of energy supplied in kWh.
+        """
+        # Update unmet demand
+        self.unmet_demand = max(self.unmet_demand - amount_supplied, 0)
+        
+        # Update current demand (reduce it by the supplied amount)
+        self.current_demand = max(self.current_demand - amount_supplied, 0)
+        
+        # Update cost
+        self.cost += amount_supplied * self.grid.selling_price
+        
+        # Keep track of the total energy supplied to the house
+        self.supplied_energy += amount_supplied
+        
+        # Store the source of energy being supplied
+        self.energy_source = source
+        
+        
+        # Log the information
+        if self.bank is not None:
+            self.bank.log_supply([self.index], [amount_supplied])
+            return
+
+        log_entry = {
+            'action': 'energy_supplied',
+            'amount_supplied': amount_supplied,
+            'remaining_unmet_demand': self.unmet_demand,
+            'current_demand': self.current_demand,
+            'total_cost': self.cost,
+            'total_energy_supplied': self.supplied_energy,
+            'energy_source': source
+        }
+        self.log.append(log_entry)
+
+    
+    def log_to_csv(self, simulation_hour, house_log=None):
+        """
+        Log the state of the house to house_log_grid_{grid_id}_house_{house_id}.csv
+        through a HouseLogSink, by default default_house_log.
+        """
+        (house_log or default_house_log).record(self, simulation_hour)
+
+
+    def step(self, hours, house_log=None):
+        self.consume_energy(hours)
+        self.log_to_csv(hours, house_log)
+        self.simulation_time += 1
+
+
+# How a MiniGrid shares the energy it acquired in a deficit among its houses, see allocate
+ALLOCATION_POLICIES = ('order', 'proportional', 'priority', 'max_min')
+
+
+def allocate(energy, unmet, policy='order', priority=None):
+    """
+    Share energy among houses by their unmet demand, for many grids at once.
+
+    Policies:
+        'order'        - first come, first served in list order
+        'proportional' - every house gets the same fraction of its unmet demand
+        'priority'     - higher priority classes first, list order within a class
+        'max_min'      - max-min fair: the same amount for every house, capped
+                         at its unmet demand (water-filling)
+    Every policy hands out min(energy, total unmet demand). Sums run left to
+    right, so houses padded with zero unmet demand change nothing.
+
+    :param energy: Energy to share per row, shape (rows,).
+    :param unmet: Unmet demand, shape (rows, houses), 0 for houses not served.
+    :param priority: Priority class of every house, same shape as unmet. Only used by 'priority'.
+    :return: Energy supplied to every house, shape (rows, houses).
+    """
+    energy = np.asarray(energy, dtype=float)
+    if policy == 'order':
+        remaining = np.subtract.accumulate(np.concatenate([energy[:, None], unmet], axis=1), axis=1)
+        return np.minimum(np.maximum(remaining[:, :-1], 0), unmet)
+
+    if policy == 'priority':
+        order = np.argsort(-priority, axis=1, kind='stable')
+        supplied = np.empty_like(unmet)
+        np.put_along_axis(supplied, order, allocate(energy, np.take_along_axis(unmet, order, axis=1)), axis=1)
+        return supplied
+
+    if policy == 'proportional':
+        total = np.add.accumulate(unmet, axis=1)[:, -1] if unmet.shape[1] else np.zeros(len(energy))
+        share = np.minimum(1, np.divide(energy, total, out=np.ones_like(energy), where=total > 0))
+        return unmet * share[:, None]
+
+    if policy == 'max_min':
+        # The water level lies between the k-1th and kth smallest demand for the
+        # first k at which sharing what is left equally stays within the kth
+        n = unmet.shape[1]
+        if not n:
+            return unmet.copy()
+        ordered = np.sort(unmet, axis=1)
+        before = np.add.accumulate(np.concatenate([np.zeros((len(energy), 1)), ordered[:, :-1]], axis=1), axis=1)
+        level = (energy[:, None] - before) / np.arange(n, 0, -1)
+        fits = level <= ordered
+        k = fits.argmax(axis=1)
+        cap = np.where(fits.any(axis=1), level[np.arange(len(energy)), k], np.inf)
+        return np.minimum(unmet, cap[:, None])
+
+    raise ValueError(f"allocation should be one of {', '.join(ALLOCATION_POLICIES)}.")
+
+
+class HouseBank:
+    """
+    The houses of a MiniGrid stored column-wise: one typed array per attribute
+    instead of one Python object per house, so a whole grid can be updated
+    with array operations.
+
+    Demand profiles are kept once in a shared profile table and every house
+    points to its row. Metered houses read one meter column of the bank's
+    DemandSeries instead. energy_source is stored as an index into
+    self.sources. Indexing or iterating a bank gives House views on its rows.
+
+    :param ids: House ids.
+    :param base_demand: Base demand of every house, or one value for all of them.
+                        Scales the readings of metered houses.
+    :param demand_profile: One 24-value profile for all houses, or one profile per
+                           house (None for metered houses).
+    :param demand_series: DemandSeries shared by the metered houses.
+    :param meters: Meter column (index or name) of every house, None for houses
+                   with a profile.
+    :param profile_index: Row of demand_profile of every house, when
+                          demand_profile is a (profiles, 24) table. Builds
+                          large banks without looking at the houses one by one.
+    """
+    # Columns of the supply log, one row per House.supply_energy
+    log_dtype = [('house', np.int64), ('amount_supplied', float), ('remaining_unmet_demand', float),
+                 ('current_demand', float), ('total_cost', float), ('total_energy_supplied', float),
+                 ('energy_source', np.int8)]
+    # House accumulators saved in a Checkpoint, energy_source as its source codes
+    state_fields = ('current_demand', 'unmet_demand', 'cost', 'supplied_energy', 'simulation_time', 'source')
+    # The ones that grow run after run instead of cycling, see Simulation.simulate_days(fast_forward=...)
+    accumulating_fields = ('cost', 'supplied_energy', 'simulation_time')
+
+    def __init__(self, ids, base_demand, demand_profile=None, demand_series=None, meters=None, profile_index=None):
+        self.ids = np.asarray(ids if isinstance(ids, np.ndarray) else list(ids))
+        n = len(self.ids)
+        self.grid = None
+
+        # Meter column of every house, -1 for houses with a profile
+        self.series = demand_series
+        self.meter = np.full(n, -1, dtype=np.int64)
+        if demand_series is not None:
+            meters = range(n) if meters is None else list(meters)
+            if len(meters) != n:
+                raise ValueError("meters should have one entry per house.")
+            for i, meter in enumerate(meters):
+                if meter is not None:
+                    self.meter[i] = demand_series.column(meter)
+        elif meters is not None:
+            raise ValueError("meters need a demand_series.")
+        self.metered = np.flatnonzero(self.meter >= 0)
+
+        if profile_index is not None:
+            self._set_profile_table(demand_profile, profile_index)
+        else:
+            self._set_profiles(demand_profile)
+
+        self.base_demand = np.zeros(n) + base_demand
+        self.current_demand = self.base_demand.copy()
+        self.current_demand[self.metered] = 0
+        self.unmet_demand = np.zeros(n)
+        self.cost = np.zeros(n)
+        self.supplied_energy = np.zeros(n)
+        self.simulation_time = np.zeros(n, dtype=np.int64)
+        self.sources = [None, 'generation', 'mixed']
+        self.source = np.zeros(n, dtype=np.int8)
+        self.priority = np.zeros(n, dtype=np.int64)  # Priority class, for the 'priority' allocation
+        self.log = RingBuffer(self.log_dtype)
+
+    def _set_profiles(self, demand_profile):
+        # Deduplicate the profiles, keeping the first list object of each
+        n = len(self.ids)
+        if demand_profile is None:
+            profiles = [None] * n
+        elif len(demand_profile) == 0 or np.isscalar(demand_profile[0]):
+            profiles = [demand_profile] * n
+        else:
+            profiles = list(demand_profile)
+        if len(profiles) != n:
+            raise ValueError("demand_profile should have one profile per house.")
+        if any((profile is None) != (meter >= 0) for profile, meter in zip(profiles, self.meter.tolist())):
+            raise ValueError("Every house needs either a demand_profile or a meter.")
+        self.profile_lists = []
+        rows = {}
+        self.profile_index = np.zeros(n, dtype=np.int32)
+        for i, profile in enumerate(profiles):
+            row = self._profile_row(profile, rows)
+            self.profile_index[i] = row
+        self.profiles = self._profile_table()
+
+    def _set_profile_table(self, table, profile_index):
+        table = np.asarray(table, dtype=float)
+        profile_index = np.asarray(profile_index)
+        if table.ndim != 2 or table.shape[1] != 24:
+            raise ValueError("demand_profile should be a table of profiles with 24 values representing hourly consumption.")
+        if len(self.metered):
+            raise ValueError("Every house needs either a demand_profile or a meter.")
+        if profile_index.shape != self.ids.shape:
+            raise ValueError("profile_index should have one entry per house.")
+        if len(profile_index) and not (profile_index.min() >= 0 and profile_index.max() < len(table)):
+            raise ValueError("profile_index should point at rows of the demand_profile table.")
+        self.profile_lists = table.tolist()
+        self.profile_index = profile_index.astype(np.int32)
+        self.profiles = self._profile_table()
+
+    def _profile_row(self, profile, rows=None):
+        # Row of the profile table holding this profile, added if new.
+        # Metered houses share a row of zeros.
+        if profile is not None and len(profile) != 24:
+            raise ValueError("demand_profile should have 24 values representing hourly consumption.")
+        if rows is None:
+            rows = {None if p is None else tuple(p): i for i, p in enumerate(self.profile_lists)}
+        key = None if profile is None else tuple(profile)
+        if key not in rows:
+            rows[key] = len(self.profile_lists)
+            self.profile_lists.append(profile)
+        return rows[key]
+
+    def _profile_table(self):
+        return np.array([[0] * 24 if p is None else p for p in self.profile_lists], dtype=float).reshape(-1, 24)
+
+    @classmethod
+    def from_houses(cls, houses):
+        """
+        Bank holding the state of existing houses, which become views on it.
+        """
+        series = {id(house.demand_series): house.demand_series for house in houses if house.demand_series is not None}
+        if len(series) > 1:
+            raise ValueError("The metered houses of a grid should share one DemandSeries.")
+        bank = cls([house.id for house in houses], [house.base_demand for house in houses],
+                   [house.demand_profile for house in houses], demand_series=next(iter(series.values()), None),
+                   meters=[house.meter for house in houses] if series else None)
+        for i, house in enumerate(houses):
+            for name in ('current_demand', 'unmet_demand', 'cost', 'supplied_energy', 'energy_source', 'simulation_time'):
+                bank.set(name, i, getattr(house, name))
+            for entry in house.log:
+                bank.log.append((i, entry['amount_supplied'], entry['remaining_unmet_demand'], entry['current_demand'],
+                                 entry['total_cost'], entry['total_energy_supplied'], bank.source_code(entry['energy_source'])))
+        for i, house in enumerate(houses):
+            house.bank = bank
+            house.index = i
+            house._state = None
+        return bank
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("house index out of range")
+        return House.view(self, index)
+
+    def __iter__(self):
+        return (House.view(self, i) for i in range(len(self)))
+
+    def source_code(self, source):
+        if source not in self.sources:
+            self.sources.append(source)
+        return self.sources.index(source)
+
+    def get(self, name, index):
+        if name == 'energy_source':
+            return self.sources[self.source[index]]
+        if name == 'demand_profile':
+            return self.profile_lists[self.profile_index[index]]
+        if name == 'demand_series':
+            return self.series if self.meter[index] >= 0 else None
+        if name == 'meter':
+            return self.meter[index].item() if self.meter[index] >= 0 else None
+        return getattr(self, name)[index].item()
+
+    def set(self, name, index, value):
+        if name == 'energy_source':
+            self.source[index] = self.source_code(value)
+        elif name == 'demand_profile':
+            if self.meter[index] >= 0:
+                raise ValueError("A metered house has no demand_profile.")
+            self.profile_index[index] = self._profile_row(value)
+            self.profiles = self._profile_table()
+        elif name in ('demand_series', 'meter'):
+            raise AttributeError(f"{name} cannot be changed once the house belongs to a grid.")
+        else:
+            getattr(self, name)[index] = value
+
+    def demand_table(self):
+        """
+        Demand of every house for every hour of the day, shape (24, houses).
+        Metered houses get their average day.
+        """
+        table = (self.base_demand[:, None] * self.profiles[self.profile_index]).T
+        if len(self.metered):
+            table[:, self.metered] = self.base_demand[self.metered] * self.series.average_day()[:, self.meter[self.metered]]
+        return table
+
+    def demand(self, hours, duration=1):
+        """
+        Demand of every house from hours to hours + duration.
+        """
+        demand = self.base_demand * self.profiles[self.profile_index, int(hours % 24)]
+        if duration != 1:
+            demand = demand * duration
+        if len(self.metered):
+            demand[self.metered] = self.base_demand[self.metered] * self.series.read(hours, duration, self.meter[self.metered])
+        return demand
+
+    def consume(self, hours, pool, selling_price, duration=1):
+        """
+        Every house takes its demand for the step from the grid's generation pool,
+        in list order, exactly like House.consume_energy for each house in turn.
+
+        :param pool: The grid's generation pool (MiniGrid.total_generation).
+        :param duration: Length of the step in hours.
+        :return: (demand, pool) - array of house demands and what is left of the pool.
+        """
+        demand = self.demand(hours, duration)
+
+        # Running pool before each house. Once it would go negative a house took
+        # the rest and the pool stays empty; the houses after it get nothing.
+        remaining = np.subtract.accumulate(np.concatenate([[pool], demand]))
+        supplied = np.minimum(demand, np.maximum(remaining[:-1], 0))
+        if pool > 0 and len(demand):
+            pool = 0.0 if (remaining[1:] < 0).any() else remaining[-1].item()
+
+        self.current_demand = demand
+        self.unmet_demand = np.maximum(demand - supplied, 0)
+        self.cost = self.cost + supplied * selling_price
+        self.source[:] = 1
+        return demand, pool
+
+    def distribute(self, energy, selling_price, source='mixed', policy='order'):
+        """
+        Share energy among the houses with unmet demand by an allocation
+        policy (see allocate). With 'order' that is like calling
+        House.supply_energy on each of them in turn. Every such house is
+        served and logged, even once the energy has run out.
+
+        :return: Energy supplied to every house (zero for houses not served).
+        """
+        served = np.flatnonzero(self.unmet_demand > 0)
+        unmet = self.unmet_demand[served]
+        supplied = allocate([energy], unmet[None], policy, self.priority[served][None])[0]
+
+        self.unmet_demand[served] = np.maximum(unmet - supplied, 0)
+        self.current_demand[served] = np.maximum(self.current_demand[served] - supplied, 0)
+        self.cost[served] += supplied * selling_price
+        self.supplied_energy[served] += supplied
+        self.source[served] = self.source_code(source)
+        self.log_supply(served, supplied)
+
+        energy = np.zeros(len(self))
+        energy[served] = supplied
+        return energy
+
+    def log_supply(self, index, amount_supplied, state=None):
+        """
+        Add supply log rows for the houses at index.
+
+        :param state: (unmet_demand, current_demand, cost, supplied_energy, source code)
+                      of those houses after the supply. Read from the bank by default.
+        """
+        if state is None:
+            state = (self.unmet_demand[index], self.current_demand[index], self.cost[index],
+                     self.supplied_energy[index], self.source[index])
+        rows = np.zeros(len(index), dtype=self.log_dtype)
+        rows['house'] = index
+        rows['amount_supplied'] = amount_supplied
+        for name, values in zip(self.log_dtype[2:], state):
+            rows[name[0]] = values
+        self.log.extend(rows)
+
+    def house_log(self, index):
+        """
+        Supply log of one house as a list of dicts, like House.log.
+        """
+        rows = self.log.rows()
+        rows = rows[rows['house'] == index]
+        return [{
+            'action': 'energy_supplied',
+            'amount_supplied': row[1],
+            'remaining_unmet_demand': row[2],
+            'current_demand': row[3],
+            'total_cost': row[4],
+            'total_energy_supplied': row[5],
+            'energy_source': self.sources[row[6]],
+        } for row in rows.tolist()]
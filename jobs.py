@@ -0,0 +1,286 @@
+import ctypes
+import multiprocessing
+import os
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from MasterNetwork import build_simulation
+from logs import HouseLogSink
+from sweep import summarize
+
+
+# Shared with the pool workers: per worker slot, a cancel flag and the days done
+_cancel = None
+_progress = None
+
+
+def _init_worker(cancel, progress):
+    global _cancel, _progress
+    _cancel = cancel
+    _progress = progress
+
+
+def run_job(slot, scenario, num_days, seed, vectorized, cache=None, stats=False):
+    """
+    Run one job in a pool worker, a day at a time so it can report progress
+    and stop when its slot's cancel flag is set. A run found in the cache is
+    replayed instead, and a finished run is added to it.
+
+    :param stats: Profile the run, see SimulationStats.
+    :return: dict with 'status' ('done' or 'cancelled'), 'cached' and, when
+             done, the end-of-run 'summary' and the hourly simulation log as
+             lists. With stats, a simulated run adds the 'stats' snapshot.
+    """
+    simulation = build_simulation(scenario, house_log=HouseLogSink(mode='off'))
+    simulation.configure_logs()  # The hourly log of the result
+    vectorized = vectorized and simulation.market is None
+    random.seed(seed)
+    key = simulation.cache_key(num_days) if cache is not None else None
+    record = cache.get(key) if cache is not None else None
+    if record is not None:
+        simulation.replay(record)
+        _progress[slot] = num_days
+        return dict(job_result(simulation), cached=True)
+
+    if stats:
+        simulation.enable_stats()
+    marks = simulation.log_marks()
+    for day in range(num_days):
+        if _cancel[slot]:
+            return {'status': 'cancelled', 'cached': False}
+        simulation.simulate_days(1, vectorized=vectorized)
+        _progress[slot] = day + 1
+
+    if cache is not None:
+        record = simulation.run_record(marks)
+        if record is not None:
+            cache.put(key, record)
+    result = dict(job_result(simulation), cached=False)
+    if stats:
+        result['stats'] = simulation.stats.snapshot()
+    return result
+
+
+def job_result(simulation):
+    return {
+        'status': 'done',
+        'summary': summarize(simulation),
+        'hourly': {name: values.tolist() for name, values in simulation.columnar_log.to_arrays().items()},
+    }
+
+
+class JobService:
+    """
+    Queue of simulation jobs run on a bounded process pool.
+
+    Submitting only queues the job; jobs are handed to the pool as workers
+    free up, from completion callbacks, so no caller ever waits for a
+    simulation. Every running job owns a worker slot in shared memory holding
+    its cancel flag and the number of days done, which status reads without
+    talking to the worker.
+
+    :param max_workers: Worker processes, all cores by default.
+    :param max_queued: Jobs waiting for a worker, over all tenants.
+    :param max_per_tenant: Queued plus running jobs of one tenant.
+    :param max_finished: Finished jobs kept for their results, oldest dropped first.
+    :param cache: Optional ResultCache. Workers replay cached runs instead of
+                  simulating them, and add their runs through its directory.
+    :param stats: Optional SimulationStats that the profiles of the simulated
+                  jobs are merged into.
+    """
+
+    def __init__(self, max_workers=None, max_queued=100, max_per_tenant=4, max_finished=1000, cache=None, stats=None):
+        self.max_workers = max_workers or os.cpu_count()
+        self.max_queued = max_queued
+        self.max_per_tenant = max_per_tenant
+        self.max_finished = max_finished
+        self.cache = cache
+        self.stats = stats
+        self.jobs = OrderedDict()  # id -> job dict
+        self.queue = deque()  # ids of queued jobs
+        self.free_slots = list(range(self.max_workers))
+        self.lock = threading.Lock()
+        self.pool = None  # Started on the first submit, so importing stays cheap
+        self.cancel_flags = None
+        self.progress = None
+
+    def _start_pool(self):
+        self.cancel_flags = multiprocessing.Array(ctypes.c_bool, self.max_workers, lock=False)
+        self.progress = multiprocessing.Array(ctypes.c_int, self.max_workers, lock=False)
+        self.pool = ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_worker,
+                                        initargs=(self.cancel_flags, self.progress))
+
+    def _restart_pool(self):
+        # A worker died, e.g. killed for memory, and the pool takes no more
+        # jobs. Its running jobs fail through their futures.
+        self.pool.shutdown(wait=False)
+        self._start_pool()
+
+    def submit(self, tenant, scenario, num_days=7, seed=0, vectorized=True):
+        """
+        Queue a job. Returns its id.
+
+        :raises ValueError: On a bad num_days.
+        :raises RuntimeError: When the queue or the tenant's quota is full.
+        :raises BrokenProcessPool: When the pool broke and so did the one
+                                   started in its place. The job is dropped.
+        """
+        if not isinstance(num_days, int) or num_days <= 0:
+            raise ValueError("num_days should be a positive integer.")
+
+        started = []
+        try:
+            with self.lock:
+                if len(self.queue) >= self.max_queued:
+                    raise RuntimeError("The job queue is full, try again later.")
+                active = sum(1 for job in self.jobs.values() if job['tenant'] == tenant and job['status'] in ('queued', 'running'))
+                if active >= self.max_per_tenant:
+                    raise RuntimeError(f"At most {self.max_per_tenant} jobs per tenant can be queued or running.")
+
+                job_id = uuid.uuid4().hex
+                self.jobs[job_id] = {
+                    'id': job_id, 'tenant': tenant, 'status': 'queued', 'num_days': num_days,
+                    'submitted': time.time(), 'started': None, 'finished': None, 'slot': None,
+                    'days_done': 0, 'error': None, 'result': None, 'cached': False,
+                    'args': (scenario, num_days, seed, vectorized, self.cache, self.stats is not None),
+                }
+                self.queue.append(job_id)
+                if self.pool is None:
+                    self._start_pool()
+                try:
+                    self._dispatch(started)
+                except BrokenProcessPool:
+                    if job_id in self.queue:
+                        self.queue.remove(job_id)
+                        del self.jobs[job_id]
+                    raise
+        finally:
+            self._watch(started)
+        return job_id
+
+    def _dispatch(self, started):
+        # Hand queued jobs to free worker slots. Called with the lock held; the
+        # (job, future) pairs go to started, for _watch once the lock is released.
+        # A broken pool is restarted once.
+        restarted = False
+        while self.queue and self.free_slots:
+            job = self.jobs[self.queue[0]]
+            slot = self.free_slots[-1]
+            self.cancel_flags[slot] = False
+            self.progress[slot] = 0
+            try:
+                future = self.pool.submit(run_job, slot, *job['args'])
+            except BrokenProcessPool:
+                if restarted:
+                    raise
+                self._restart_pool()
+                restarted = True
+                continue
+            self.queue.popleft()
+            self.free_slots.pop()
+            del job['args']
+            job.update(status='running', slot=slot, started=time.time())
+            started.append((job, future))
+
+    def _watch(self, started):
+        # A future that is already done runs its callback right away, which takes the lock
+        for job, future in started:
+            future.add_done_callback(lambda future, job=job: self._finished(job, future))
+
+    def _finished(self, job, future):
+        started = []
+        with self.lock:
+            slot = job['slot']
+            job['days_done'] = self.progress[slot]
+            try:
+                result = future.result()
+                job['status'] = result.pop('status')
+                job['cached'] = result.pop('cached')
+                if 'stats' in result:
+                    self.stats.merge(result.pop('stats'))
+                job['result'] = result if job['status'] == 'done' else None
+            except Exception as error:
+                job['status'] = 'failed'
+                job['error'] = f'{type(error).__name__}: {error}'
+            job.update(slot=None, finished=time.time())
+            self.free_slots.append(slot)
+            self._evict()
+            try:
+                self._dispatch(started)
+            except BrokenProcessPool:
+                pass  # The queued jobs wait for the next submit
+        self._watch(started)
+
+    def _evict(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job['finished'] is not None]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self.jobs[job_id]
+
+    def _job(self, tenant, job_id):
+        job = self.jobs.get(job_id)
+        if job is None or job['tenant'] != tenant:
+            raise KeyError(job_id)
+        return job
+
+    def status(self, tenant, job_id):
+        """
+        Status of a job of the tenant, without its result.
+
+        :raises KeyError: For unknown jobs and jobs of other tenants.
+        """
+        with self.lock:
+            return self._status(self._job(tenant, job_id))
+
+    def _status(self, job):
+        status = {name: job[name] for name in ('id', 'status', 'num_days', 'submitted', 'started', 'finished', 'error', 'cached')}
+        status['days_done'] = self.progress[job['slot']] if job['status'] == 'running' else job['days_done']
+        if job['status'] == 'queued':
+            status['queue_position'] = self.queue.index(job['id'])
+        return status
+
+    def list(self, tenant):
+        with self.lock:
+            return [self._status(job) for job in self.jobs.values() if job['tenant'] == tenant]
+
+    def result(self, tenant, job_id):
+        """
+        Result of a finished job, None while it is not done.
+        """
+        with self.lock:
+            return self._job(tenant, job_id)['result']
+
+    def cancel(self, tenant, job_id):
+        """
+        Cancel a queued or running job. A running job stops at the end of the
+        day it is simulating.
+
+        :return: False if the job had already finished.
+        """
+        with self.lock:
+            job = self._job(tenant, job_id)
+            if job['status'] == 'queued':
+                self.queue.remove(job_id)
+                job.pop('args')
+                job.update(status='cancelled', finished=time.time())
+                return True
+            if job['status'] == 'running':
+                self.cancel_flags[job['slot']] = True
+                return True
+            return False
+
+    def shutdown(self):
+        with self.lock:
+            for job_id in self.queue:
+                self.jobs[job_id].pop('args')
+                self.jobs[job_id].update(status='cancelled', finished=time.time())
+            self.queue.clear()
+            for job in self.jobs.values():
+                if job['status'] == 'running':
+                    self.cancel_flags[job['slot']] = True
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
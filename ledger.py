@@ -0,0 +1,142 @@
+import numpy as np
+
+from logs import RingBuffer
+
+
+class TransactionLedger:
+    """
+    Append-only ledger of every trade in a network, one row per trade:
+
+        simulation_hour, from_grid, to_grid, kWh, price, action
+
+    Trades between grids ('supply') are taken from the sender's record, with
+    the kWh as sent; what arrived after line losses is in the receiving grid's
+    transactions. The conventional grid is grid -1: 'sell' rows go to it and
+    'buy' rows come from it, with the price paid per kWh. Internal trades have
+    a NaN price. Rows are ordered by hour, and by grid within an hour.
+
+    Rows are added as the grids log their transactions (see
+    Simulation.enable_ledger), so the ledger keeps every trade when those
+    logs are bounded or cleared.
+
+    Queries go through two indices, built on the first query after new rows
+    arrive: per-hour offsets into the rows, and the rows of every
+    (from_grid, to_grid) pair.
+    """
+    actions = ('supply', 'sell', 'buy')
+
+    def __init__(self, time_dtype=np.int64):
+        self.rows = RingBuffer([('simulation_hour', time_dtype), ('from_grid', np.int64), ('to_grid', np.int64),
+                                ('kWh', float), ('price', float), ('action', 'U6')])
+        self.pending = []  # (grid id, transaction rows) not converted yet
+        self._index = None
+
+    def __len__(self):
+        self._flush()
+        return len(self.rows)
+
+    def add(self, parts):
+        """
+        Add rows of the grids' columnar transaction logs. They are converted
+        to ledger rows in one batch before the next query.
+
+        :param parts: List of (grid id, transaction rows), in the order the
+                      grids logged them.
+        """
+        self.pending += parts
+
+    def _flush(self):
+        if not self.pending:
+            return
+        parts = []
+        for grid_id, rows in self.pending:
+            part = np.zeros(len(rows), dtype=self.rows.dtype)
+            part['simulation_hour'] = rows['simulation_hour']
+            part['from_grid'] = grid_id
+            part['to_grid'] = rows['counterparty']
+            part['kWh'] = rows['kWh']
+            part['price'] = rows['cost_USD']
+            part['action'] = rows['action']
+            parts.append(part)
+        self.pending = []
+
+        # Rows of several hours at once, e.g. a whole parallel run added grid by
+        # grid, go in hour order; within an hour they stay in the order logged
+        rows = np.concatenate(parts)
+        rows = rows[np.isin(rows['action'], self.actions)]
+        rows = rows[np.argsort(rows['simulation_hour'], kind='stable')]
+        internal = rows['to_grid'] >= 0
+        bought = rows['action'] == 'buy'
+        rows['to_grid'] = np.where(bought, rows['from_grid'], rows['to_grid'])
+        rows['from_grid'] = np.where(bought, -1, rows['from_grid'])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rows['price'] = np.where(internal, np.nan, rows['price'] / rows['kWh'])
+        self.rows.extend(rows)
+        self._index = None
+
+    def truncate(self, hours):
+        """
+        Drop the rows from hours on, e.g. when a simulation is restored to an earlier time.
+        """
+        self._flush()
+        rows = self.rows.rows()
+        keep = rows[:np.searchsorted(rows['simulation_hour'], hours)].copy()
+        self.rows.reset()
+        self.rows.extend(keep)
+        self._index = None
+
+    def _build_index(self):
+        rows = self.rows.rows()
+        hours = rows['simulation_hour']
+        self.hours, first = np.unique(hours, return_index=True)
+        self.offsets = np.append(first, len(rows))
+
+        order = np.lexsort((rows['to_grid'], rows['from_grid']))  # Stable, so hour order within a pair
+        pairs = np.stack([rows['from_grid'][order], rows['to_grid'][order]], axis=1)
+        starts = np.flatnonzero(np.r_[True, (pairs[1:] != pairs[:-1]).any(axis=1)]) if len(rows) else np.zeros(0, dtype=int)
+        self.pair_rows = order
+        self.pair_indptr = np.append(starts, len(rows))
+        self.pairs = {pair: k for k, pair in enumerate(map(tuple, pairs[starts].tolist()))}
+        self._index = rows
+
+    def _rows(self):
+        self._flush()
+        if self._index is None:
+            self._build_index()
+        return self._index
+
+    def between(self, start=None, stop=None):
+        """
+        Rows with start <= simulation_hour < stop, a view.
+        """
+        rows = self._rows()
+        hours = self.hours
+        first = 0 if start is None else np.searchsorted(hours, start)
+        last = len(hours) if stop is None else np.searchsorted(hours, stop)
+        return rows[self.offsets[first]:self.offsets[last]]
+
+    def pair(self, from_grid, to_grid, start=None, stop=None):
+        """
+        Trades from one grid to another (-1 for the conventional grid) with
+        start <= simulation_hour < stop.
+        """
+        rows = self._rows()
+        k = self.pairs.get((from_grid, to_grid))
+        if k is None:
+            return rows[:0]
+        index = self.pair_rows[self.pair_indptr[k]:self.pair_indptr[k + 1]]
+        hours = rows['simulation_hour'][index]
+        first = 0 if start is None else np.searchsorted(hours, start)
+        last = len(index) if stop is None else np.searchsorted(hours, stop)
+        return rows[index[first:last]]
+
+    def total(self, from_grid, to_grid, start=None, stop=None):
+        """
+        kWh sent from one grid to another with start <= simulation_hour < stop.
+        """
+        return float(self.pair(from_grid, to_grid, start, stop)['kWh'].sum())
+
+    def to_arrays(self):
+        self._flush()
+        rows = self.rows.rows()
+        return {name: rows[name] for name in rows.dtype.names}
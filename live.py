@@ -0,0 +1,207 @@
+import platform
+import sys
+import time
+import warnings
+
+import numpy as np
+
+from MasterNetwork import Simulation
+
+
+class LiveState:
+    """
+    State of a running Simulation in a shared memory block, for other
+    processes to read while it runs, see Simulation.share_state.
+
+    The simulation rewrites the block after every step. Readers map it with
+    LiveState.attach(name) and take consistent copies with snapshot. The
+    arrays under totals, grids and houses are zero-copy views of the block,
+    which a reader may catch half-written.
+
+    Layout, native byte order, every value 8 bytes wide:
+
+        int64    header[8]      magic, layout version, sequence, grids G, houses H, 3 unused
+        float64  totals[7]      Simulation.log_columns of the last step
+        int64    grid_ids[G]
+        int64    offsets[G+1]   the houses of grid g are offsets[g]:offsets[g+1]
+        float64  grids[5, G]    one row per name in grid_fields
+        float64  houses[4, H]   one row per name in house_fields, grid after grid
+
+    The sequence is a seqlock: the writer makes it odd before an update and
+    even again after. A copy is consistent when the sequence was the same even
+    number before and after it.
+
+    Only x86 and x86-64 are supported. Python has no memory fences, so nothing
+    orders the accesses to the block beyond what the CPU does by itself. x86
+    keeps stores in program order and loads in program order, which is all
+    the seqlock needs. ARM and POWER reorder them, and a reader there can get
+    a torn copy with a matching sequence. create warns on those machines.
+    """
+    magic = int.from_bytes(b'SOLELIVE', 'little')
+    # Machines whose memory ordering the seqlock relies on, see above
+    ordered_machines = ('x86_64', 'amd64', 'i386', 'i686', 'x86')
+    layout_version = 1
+    grid_fields = ('generation_kWh', 'total_demand_kWh', 'battery_level_kWh', 'battery_%', 'revenue_USD')
+    house_fields = ('current_demand', 'unmet_demand', 'cost', 'supplied_energy')
+
+    def __init__(self, memory, owner=False):
+        self.memory = memory
+        self.owner = owner  # The writer, which unlinks the block
+        self.header = np.ndarray(8, dtype=np.int64, buffer=memory.buf)
+        if self.header[0] != self.magic or self.header[1] != self.layout_version:
+            raise ValueError(f"Shared memory block {memory.name} holds no LiveState of layout version {self.layout_version}.")
+        self.num_grids, self.num_houses = self.header[3:5].tolist()
+        self.start = self.header.nbytes
+        self.end = self._size(self.num_grids, self.num_houses)
+        self._bind(self._views(memory.buf, self.start))
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    @staticmethod
+    def _sections(num_grids, num_houses):
+        return [('totals', np.float64, (len(Simulation.log_columns),)),
+                ('grid_ids', np.int64, (num_grids,)),
+                ('offsets', np.int64, (num_grids + 1,)),
+                ('grids', np.float64, (len(LiveState.grid_fields), num_grids)),
+                ('houses', np.float64, (len(LiveState.house_fields), num_houses))]
+
+    @classmethod
+    def _size(cls, num_grids, num_houses):
+        return 8 * (8 + sum(int(np.prod(shape)) for _, _, shape in cls._sections(num_grids, num_houses)))
+
+    def _views(self, buffer, offset):
+        # Arrays of every section, for a buffer holding the block from `offset` on
+        views = {}
+        for name, dtype, shape in self._sections(self.num_grids, self.num_houses):
+            views[name] = np.ndarray(shape, dtype=dtype, buffer=buffer, offset=offset)
+            offset += views[name].nbytes
+        return views
+
+    def _bind(self, views):
+        self.totals = views['totals']
+        self.grid_ids = views['grid_ids']
+        self.offsets = views['offsets']
+        self.grids = dict(zip(self.grid_fields, views['grids']))
+        self.houses = dict(zip(self.house_fields, views['houses']))
+        self.grid_values = views['grids']
+        self.house_values = views['houses']
+
+    @classmethod
+    def create(cls, grid_ids, num_houses, name=None):
+        """
+        New block for grids with these ids and house counts.
+
+        :param name: Name of the block, a random one by default.
+        """
+        from multiprocessing import shared_memory
+
+        if platform.machine().lower() not in cls.ordered_machines:
+            warnings.warn(f"LiveState snapshots can be torn on {platform.machine()}, the seqlock needs x86 memory ordering.",
+                          RuntimeWarning, stacklevel=2)
+        offsets = np.concatenate([[0], np.cumsum(num_houses, dtype=np.int64)])
+        memory = shared_memory.SharedMemory(name, create=True, size=cls._size(len(grid_ids), int(offsets[-1])))
+        header = np.ndarray(8, dtype=np.int64, buffer=memory.buf)
+        header[:] = (cls.magic, cls.layout_version, 0, len(grid_ids), offsets[-1], 0, 0, 0)
+        del header
+        live = cls(memory, owner=True)
+        live.grid_ids[:] = grid_ids
+        live.offsets[:] = offsets
+        live.totals[:] = np.nan
+        return live
+
+    @classmethod
+    def attach(cls, name):
+        """
+        Map the block of a running simulation, read-only by convention.
+        """
+        from multiprocessing import resource_tracker, shared_memory
+
+        if sys.version_info >= (3, 13):
+            memory = shared_memory.SharedMemory(name, track=False)
+        else:
+            # Before 3.13 every process mapping a block tracks it and unlinks it on exit
+            memory = shared_memory.SharedMemory(name)
+            resource_tracker.unregister(memory._name, 'shared_memory')
+        return cls(memory)
+
+    def write(self, totals, grids, houses):
+        """
+        Update the block under the seqlock.
+
+        :param totals: Values of Simulation.log_columns.
+        :param grids: One row of per-grid values for every name in grid_fields.
+        :param houses: One row over all houses for every name in house_fields.
+        """
+        self.header[2] += 1
+        self.totals[:] = totals
+        self.grid_values[:] = grids
+        self.house_values[:] = houses
+        self.header[2] += 1
+
+    def publish(self, simulation, simulation_hour, grids=None, houses=None):
+        """
+        Write the state of a Simulation after the step at simulation_hour.
+        grids and houses default to the state of its MiniGrids and HouseBanks.
+        """
+        if grids is None:
+            grids = [[grid.generation for grid in simulation.grids],
+                     [grid.total_demand for grid in simulation.grids],
+                     [grid.battery.get_level() for grid in simulation.grids],
+                     [grid.battery.get_state_of_charge() for grid in simulation.grids],
+                     [grid.revenue for grid in simulation.grids]]
+        if houses is None:
+            banks = [grid.bank for grid in simulation.grids]
+            houses = [np.concatenate([getattr(bank, name) for bank in banks]) for name in self.house_fields]
+        self.write((simulation_hour, simulation.total_generation, simulation.total_demand, simulation.unmet_demand,
+                    simulation.total_grid_transactions, simulation.total_client_revenue, simulation.revenue),
+                   grids, houses)
+
+    @property
+    def sequence(self):
+        """
+        Updates written so far, times two; odd while an update is under way.
+        """
+        return int(self.header[2])
+
+    def snapshot(self, timeout=1.0):
+        """
+        Consistent copy of the state.
+
+        :return: dict with the 'sequence' it was taken at, every column of
+                 Simulation.log_columns, 'grid_ids', 'offsets' and the 'grids'
+                 and 'houses' arrays by field name.
+        :raises TimeoutError: When no consistent copy could be taken within
+                              timeout seconds, e.g. the writer died mid-update.
+        """
+        body = np.ndarray(self.end - self.start, dtype=np.uint8, buffer=self.memory.buf, offset=self.start)
+        deadline = time.monotonic() + timeout
+        while True:
+            sequence = self.sequence
+            if not sequence & 1:
+                data = body.copy()
+                if self.sequence == sequence:
+                    break
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"No consistent snapshot of {self.name} within {timeout} s.")
+            time.sleep(0)
+
+        views = self._views(data, 0)
+        snapshot = {'sequence': sequence}
+        snapshot.update(zip(Simulation.log_columns, views['totals'].tolist()))
+        snapshot.update(grid_ids=views['grid_ids'], offsets=views['offsets'],
+                        grids=dict(zip(self.grid_fields, views['grids'])),
+                        houses=dict(zip(self.house_fields, views['houses'])))
+        return snapshot
+
+    def close(self):
+        """
+        Unmap the block; the writer also removes it. Views taken from
+        totals, grids and houses must be gone by then.
+        """
+        self.header = self.totals = self.grid_ids = self.offsets = None
+        self.grids = self.houses = self.grid_values = self.house_values = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
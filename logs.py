@@ -0,0 +1,374 @@
+import atexit
+import csv
+import os
+
+import numpy as np
+
+
+class HouseLogSink:
+    """
+    Collects the per-house log rows in memory and appends them to the
+    house_log_grid_{grid_id}_house_{house_id}.csv files in large batches,
+    instead of opening every file once per house and hour.
+
+    :param mode: 'all' logs every house every hour, 'sampled' only every
+                 sample_every hours, 'off' disables house logging.
+    :param sample_every: Hours between logged rows in 'sampled' mode.
+    :param flush_rows: Number of buffered rows that triggers a flush.
+    """
+    headers = ['simulation_hour', 'current_demand', 'unmet_demand', 'cost', 'energy_source']
+
+    def __init__(self, mode='all', sample_every=24, flush_rows=250000):
+        if mode not in ('all', 'sampled', 'off'):
+            raise ValueError("mode should be 'all', 'sampled' or 'off'.")
+
+        if sample_every <= 0:
+            raise ValueError("sample_every should be a positive number.")
+
+        self.mode = mode
+        self.sample_every = sample_every
+        self.flush_rows = flush_rows
+        self.buffers = {}  # (grid_id, house_id) -> list of rows
+        self.buffered_rows = 0
+
+    def should_log(self, simulation_hour):
+        if self.mode == 'off':
+            return False
+        if self.mode == 'sampled':
+            return simulation_hour % self.sample_every == 0
+        return True
+
+    def record(self, house, simulation_hour):
+        """
+        Buffer one row with the current state of a house.
+        """
+        if house.grid is None or not self.should_log(simulation_hour):
+            return
+
+        row = [simulation_hour, round(house.current_demand, 3), round(house.unmet_demand, 3), round(house.cost, 3), house.energy_source]
+        self.buffers.setdefault((house.grid.id, house.id), []).append(row)
+        self.buffered_rows += 1
+
+        if self.buffered_rows >= self.flush_rows:
+            self.flush()
+
+    def record_grid(self, grid, simulation_hour, current_demand, unmet_demand, cost, energy_source):
+        """
+        Buffer one row for every house of a grid from lists ordered like grid.houses.
+        """
+        if not self.should_log(simulation_hour):
+            return
+
+        rows = zip(grid.bank.ids.tolist(), current_demand, unmet_demand, cost, energy_source)
+        for house_id, demand, unmet, house_cost, source in rows:
+            row = [simulation_hour, round(demand, 3), round(unmet, 3), round(house_cost, 3), source]
+            self.buffers.setdefault((grid.id, house_id), []).append(row)
+        self.buffered_rows += len(grid.bank)
+
+        if self.buffered_rows >= self.flush_rows:
+            self.flush()
+
+    def flush(self):
+        """
+        Append all buffered rows to their CSV files, one open per file.
+        """
+        for (grid_id, house_id), rows in self.buffers.items():
+            file_name = f'house_log_grid_{grid_id}_house_{house_id}.csv'
+            file_is_empty = not os.path.isfile(file_name) or os.path.getsize(file_name) == 0
+
+            with open(file_name, 'a', newline='') as f:
+                writer = csv.writer(f)
+                if file_is_empty:
+                    writer.writerow(self.headers)
+                writer.writerows(rows)
+
+        self.buffers.clear()
+        self.buffered_rows = 0
+
+
+# Sink of the houses stepped on their own (House.step), flushed at exit
+default_house_log = HouseLogSink()
+atexit.register(default_house_log.flush)
+
+
+class RingBuffer:
+    """
+    Rows of a structured NumPy dtype in a preallocated array.
+
+    Without a capacity the array grows as needed and keeps every row. With a
+    capacity only the last `capacity` rows are kept; if spill_to is given the
+    full buffer is written to '{spill_to}_{n}.npz' before it is reused and
+    the buffer then starts empty.
+
+    Running aggregates (count, sum, min, max) of the numeric fields cover every
+    row ever appended, including rows that have been evicted or spilled.
+    """
+
+    def __init__(self, dtype, capacity=None, spill_to=None):
+        if capacity is not None and capacity <= 0:
+            raise ValueError("capacity should be a positive number.")
+
+        self.dtype = np.dtype(dtype)
+        self.capacity = capacity
+        self.spill_to = spill_to
+        self.data = np.zeros(capacity or 1024, dtype=self.dtype)
+        self.next = 0  # Write position; rows before it have not been folded into the aggregates yet
+        self.wrapped = False  # Ring buffer has overwritten old rows
+        self.count = 0  # Rows ever appended
+        self.spilled = []  # Files written by spill_to
+        self.numeric = [name for name in self.dtype.names if self.dtype[name].kind in 'if']
+        self.aggregates = {name: [0, 0.0, np.inf, -np.inf] for name in self.numeric}
+
+    def __len__(self):
+        return len(self.data) if self.wrapped else self.next
+
+    def _make_room(self):
+        # Called when the write position is at the end of the array
+        if self.capacity is None:
+            self.data = np.concatenate([self.data, np.zeros(len(self.data), dtype=self.dtype)])
+        else:
+            # The buffer is about to be reused
+            self._fold(self.data)
+            if self.spill_to is not None:
+                file_name = f'{self.spill_to}_{len(self.spilled)}.npz'
+                np.savez(file_name, **{name: self.data[name] for name in self.dtype.names})
+                self.spilled.append(file_name)
+            else:
+                self.wrapped = True
+            self.next = 0
+
+    def append(self, row):
+        if self.next == len(self.data):
+            self._make_room()
+
+        self.data[self.next] = row
+        self.next += 1
+        self.count += 1
+
+    def extend(self, rows):
+        """
+        Append a structured array of rows, same as appending them one by one.
+        """
+        start = 0
+        while start < len(rows):
+            if self.next == len(self.data):
+                self._make_room()
+            n = min(len(rows) - start, len(self.data) - self.next)
+            self.data[self.next:self.next + n] = rows[start:start + n]
+            self.next += n
+            self.count += n
+            start += n
+
+    def _fold(self, rows):
+        for name in self.numeric:
+            values = rows[name]
+            if values.dtype.kind == 'f':
+                values = values[~np.isnan(values)]
+            if len(values):
+                aggregate = self.aggregates[name]
+                aggregate[0] += len(values)
+                aggregate[1] += values.sum()
+                aggregate[2] = min(aggregate[2], values.min())
+                aggregate[3] = max(aggregate[3], values.max())
+
+    def rows(self):
+        """
+        The rows held in memory, oldest first. A view when the buffer has not wrapped.
+        """
+        if self.wrapped:
+            return np.concatenate([self.data[self.next:], self.data[:self.next]])
+        return self.data[:self.next]
+
+    def tail(self, n):
+        """
+        The last n rows held in memory, oldest first.
+        """
+        n = min(n, len(self))
+        if n <= self.next:
+            return self.data[self.next - n:self.next]
+        return np.concatenate([self.data[len(self.data) - (n - self.next):], self.data[:self.next]])
+
+    def clear(self):
+        """
+        Drop the rows held in memory. The aggregates keep them.
+        """
+        self._fold(self.data[:self.next])
+        self.next = 0
+        self.wrapped = False
+
+    def reset(self, count=0):
+        """
+        Drop every row held in memory and the aggregates, and continue counting
+        from count, as if count rows had been appended and spilled elsewhere.
+        """
+        self.next = 0
+        self.wrapped = False
+        self.count = count
+        self.aggregates = {name: [0, 0.0, np.inf, -np.inf] for name in self.numeric}
+
+    def summary(self):
+        """
+        count, sum, min, max and mean of every numeric field over all rows ever appended.
+        """
+        pending = RingBuffer(self.dtype)
+        pending.aggregates = {name: list(aggregate) for name, aggregate in self.aggregates.items()}
+        pending._fold(self.data[:self.next])
+
+        summary = {}
+        for name, (count, total, low, high) in pending.aggregates.items():
+            summary[name] = {
+                'count': count,
+                'sum': float(total),
+                'min': float(low) if count else None,
+                'max': float(high) if count else None,
+                'mean': float(total) / count if count else None,
+            }
+        return summary
+
+
+class ColumnarLog:
+    """
+    Full-precision, column-oriented copy of a log.
+
+    Rows go into RingBuffer arrays, so the log can be bounded with a capacity
+    and spilled to disk (see RingBuffer). Transactions, when kept, are stored as
+    structured columns (hour, counterparty, action, kWh, cost) instead of the
+    Python reprs written to the CSV logs. The conventional grid is recorded
+    as counterparty -1 and internal trades have a NaN cost.
+
+    simulation_hour is stored as time_dtype, float for sub-hourly clocks.
+    Transactions also go to the ledger when one is set, see
+    Simulation.enable_ledger.
+
+    The logs of a Simulation and its grids start disabled, so the steps do
+    not fill them, until Simulation.configure_logs turns them on.
+    """
+    transaction_dtype = [('simulation_hour', np.int64), ('counterparty', np.int64), ('action', 'U7'),
+                         ('kWh', float), ('cost_USD', float)]
+
+    def __init__(self, columns, transactions=False, capacity=None, spill_to=None, time_dtype=np.int64, enabled=True):
+        self.time_dtype = time_dtype
+        self.enabled = enabled  # Whether the steps log to it
+        dtype = [(column, time_dtype if column == 'simulation_hour' else float) for column in columns]
+        self.rows = RingBuffer(dtype, capacity, spill_to)
+        self.transactions = None
+        self.ledger = None  # TransactionLedger of the network
+        self.grid_id = None  # Grid the transactions belong to, for the ledger
+        if transactions:
+            transaction_dtype = [('simulation_hour', time_dtype)] + self.transaction_dtype[1:]
+            self.transactions = RingBuffer(transaction_dtype, capacity, spill_to and f'{spill_to}_transactions')
+
+    def append(self, *values):
+        self.rows.append(values)
+
+    def append_transactions(self, simulation_hour, internal, external):
+        if not internal and not external:
+            return
+        rows = [(simulation_hour, grid_id, direction, amount, np.nan) for grid_id, amount, direction in internal]
+        rows += [(simulation_hour, -1, direction, amount, price) for direction, amount, price in external]
+        self.extend_transactions(np.array(rows, dtype=self.transactions.dtype))
+
+    def extend_transactions(self, rows):
+        """
+        Append a structured array of transaction rows.
+        """
+        self.transactions.extend(rows)
+        if self.ledger is not None:
+            self.ledger.add([(self.grid_id, rows)])
+
+    def clear(self):
+        self.rows.clear()
+        if self.transactions is not None:
+            self.transactions.clear()
+
+    def tail(self, n):
+        """
+        The last n hourly rows held in memory, as a dict of arrays.
+        """
+        rows = self.rows.tail(n)
+        return {name: rows[name] for name in rows.dtype.names}
+
+    def to_arrays(self):
+        """
+        Return the hourly columns held in memory as a dict of NumPy arrays.
+        """
+        rows = self.rows.rows()
+        return {name: rows[name] for name in rows.dtype.names}
+
+    def transactions_to_arrays(self):
+        """
+        Return the transaction columns held in memory as a dict of NumPy arrays.
+        """
+        rows = self.transactions.rows()
+        return {name: rows[name] for name in rows.dtype.names}
+
+
+def save_columns(file_name, columns, file_format, transactions=False):
+    """
+    Write a ColumnarLog to disk.
+
+    'npy' writes a directory of one .npy file per column, which load_log
+    memory-maps; transaction columns are stored in the same directory with a
+    'tx_' prefix. 'parquet' needs pyarrow and writes the transactions to a
+    separate '<name>_transactions.parquet' file.
+
+    :param file_name: File name without extension, the directory for 'npy'.
+    """
+    if not columns.enabled:
+        raise ValueError("The columnar logs are off, turn them on with Simulation.configure_logs before the run.")
+
+    if file_format == 'npy':
+        arrays = columns.to_arrays()
+        if transactions:
+            arrays.update({f'tx_{k}': v for k, v in columns.transactions_to_arrays().items()})
+        os.makedirs(file_name, exist_ok=True)
+        for name, values in arrays.items():
+            np.save(os.path.join(file_name, f'{name}.npy'), values)
+
+    elif file_format == 'parquet':
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Writing parquet logs requires pyarrow (pip install pyarrow).")
+        pq.write_table(pa.table(columns.to_arrays()), f'{file_name}.parquet')
+        if transactions:
+            pq.write_table(pa.table(columns.transactions_to_arrays()), f'{file_name}_transactions.parquet')
+
+    else:
+        raise ValueError("file_format should be 'csv', 'npy' or 'parquet'.")
+
+
+def load_log(file_name, transactions=False, as_frame=True):
+    """
+    Load a log written with save_logs(file_format='npy' or 'parquet'): the
+    directory of an 'npy' log or the .parquet file.
+
+    Arrays are handed over without copying: both formats are memory-mapped.
+
+    :param transactions: Load the transaction table instead of the hourly log.
+    :param as_frame: Return a pandas DataFrame, otherwise a dict of arrays.
+    """
+    if os.path.isdir(file_name):
+        arrays = {}
+        for entry in sorted(os.scandir(file_name), key=lambda entry: entry.name):
+            name = entry.name[:-len('.npy')]
+            if entry.name.endswith('.npy') and name.startswith('tx_') == transactions:
+                arrays[name[3:] if transactions else name] = np.load(entry.path, mmap_mode='r')
+
+    elif file_name.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        if transactions:
+            file_name = file_name[:-len('.parquet')] + '_transactions.parquet'
+        table = pq.read_table(file_name, memory_map=True)
+        if as_frame:
+            return table.to_pandas()
+        arrays = {name: column.to_numpy() for name, column in zip(table.column_names, table.columns)}
+
+    else:
+        raise ValueError("file_name should be the directory of an 'npy' log or end with '.parquet'.")
+
+    if as_frame:
+        import pandas as pd  # Only needed here, kept out of the module import
+        return pd.DataFrame(arrays, copy=False)
+    return arrays
@@ -0,0 +1,135 @@
+import numpy as np
+
+from topology import Topology
+
+
+class MarketClearing:
+    """
+    Per-hour market clearing between mini-grids.
+
+    Instead of every MiniGrid trading greedily with its neighbours in list
+    order, all grids first balance locally (MiniGrid.balance_locally), then the
+    surpluses and deficits of the hour are matched over the lines of the
+    network in one batched pass, and finally every grid settles
+    (MiniGrid.settle). The result does not depend on the order of the grids.
+
+    Methods:
+        'proportional' - NumPy water-filling: every source splits its supply
+                         over its lines in proportion to the buyers' remaining
+                         deficits, repeated until nothing more can move.
+        'lp'           - Linear program maximising the energy delivered after
+                         losses (needs scipy).
+
+    :param topology: Lines to trade over; defaults to unlimited, lossless lines
+                     built from the grids' neighboring_grids.
+    """
+
+    def __init__(self, grids, topology=None, method='proportional', max_rounds=100, tolerance=1e-9):
+        if method not in ('proportional', 'lp'):
+            raise ValueError("method should be 'proportional' or 'lp'.")
+
+        self.grids = list(grids)
+        self.topology = topology if topology is not None else Topology.from_neighbors(self.grids)
+        self.method = method
+        self.max_rounds = max_rounds
+        self.tolerance = tolerance
+
+        topology = self.topology
+        sources = np.repeat(np.arange(len(topology.grids)), np.diff(topology.indptr))
+        lines = sources != topology.indices  # No trading with yourself
+        self.source = sources[lines]
+        self.target = topology.indices[lines]
+        self.capacity = topology.capacity[lines]
+        self.loss = topology.loss[lines]
+        self.used = np.zeros(len(self.source))  # Energy sent on each line this hour
+        self.hour = None
+
+    def clear(self, supply, need):
+        """
+        Energy sent on every line for the given supply and need of every grid,
+        within what is left of the line capacities this hour. Energy delivered
+        on a line is the energy sent times (1 - loss).
+        """
+        room = np.maximum(self.capacity - self.used, 0)
+        if self.method == 'lp':
+            return self._clear_lp(supply, need, room)
+
+        n = len(supply)
+        source, target, efficiency = self.source, self.target, 1 - self.loss
+        supply = np.asarray(supply, dtype=float).copy()
+        need = np.asarray(need, dtype=float).copy()
+        flow = np.zeros(len(source))
+
+        for _ in range(self.max_rounds):
+            open_lines = (room > self.tolerance) & (supply[source] > self.tolerance) & (need[target] > self.tolerance)
+            if not open_lines.any():
+                break
+
+            # Sources split their supply in proportion to the buyers' deficits
+            weight = np.where(open_lines, need[target], 0)
+            total_weight = np.bincount(source, weight, minlength=n)
+            share = np.divide(weight, total_weight[source], out=np.zeros_like(weight), where=weight > 0)
+            offer = np.minimum(supply[source] * share, room)
+
+            # Buyers take no more than they need
+            incoming = np.bincount(target, offer * efficiency, minlength=n)
+            scale = np.minimum(1, np.divide(need, incoming, out=np.ones(n), where=incoming > 0))
+            sent = offer * scale[target]
+
+            flow += sent
+            room -= sent
+            supply = np.maximum(supply - np.bincount(source, sent, minlength=n), 0)
+            need = np.maximum(need - np.bincount(target, sent * efficiency, minlength=n), 0)
+
+        return flow
+
+    def _clear_lp(self, supply, need, room):
+        try:
+            from scipy.optimize import linprog
+            from scipy.sparse import csr_matrix
+        except ImportError:
+            raise ImportError("method='lp' requires scipy (pip install scipy).")
+
+        n, m = len(supply), len(self.source)
+        if m == 0:
+            return np.zeros(0)
+        efficiency = 1 - self.loss
+        columns = np.arange(m)
+        # Sent by each source <= supply, delivered to each buyer <= need
+        a_ub = csr_matrix((np.concatenate([np.ones(m), efficiency]),
+                           (np.concatenate([self.source, n + self.target]), np.concatenate([columns, columns]))),
+                          shape=(2 * n, m))
+        b_ub = np.concatenate([supply, need])
+        # Maximise delivered energy, prefer low-loss lines on ties
+        cost = -efficiency + 1e-9 * self.loss
+        bounds = [(0, None if np.isinf(c) else c) for c in room]
+        result = linprog(cost, A_ub=a_ub, b_ub=b_ub, bounds=bounds, method='highs')
+        if not result.success:
+            raise RuntimeError(f"Market clearing failed: {result.message}")
+        return np.maximum(result.x, 0)
+
+    def step(self, hours):
+        """
+        Run one step for all grids. Returns (excess, shortage) per grid, like MiniGrid.step.
+        """
+        hour = int(hours // 1)
+        if hour != self.hour:
+            self.hour = hour
+            self.used = np.zeros(len(self.source))
+        positions = [grid.balance_locally(hours) for grid in self.grids]
+        supply = np.array([position[0] for position in positions], dtype=float)
+        need = np.array([position[1] for position in positions], dtype=float)
+
+        flow = self.clear(supply, need)
+        self.used += flow
+        delivered = flow * (1 - self.loss)
+        n = len(self.grids)
+        sent = np.bincount(self.source, flow, minlength=n).tolist()
+        received = np.bincount(self.target, delivered, minlength=n).tolist()
+
+        for line in np.flatnonzero(flow > 0).tolist():
+            seller, buyer = self.grids[self.source[line]], self.grids[self.target[line]]
+            seller.internal_transactions_log.append((buyer.id, float(flow[line]), 'supply'))
+            buyer.internal_transactions_log.append((seller.id, float(delivered[line]), 'demand'))
+
+        return [grid.settle(hours, sent[g], received[g], positions[g][1]) for g, grid in enumerate(self.grids)]
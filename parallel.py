@@ -0,0 +1,367 @@
+import os
+import threading
+import traceback
+import weakref
+
+import numpy as np
+
+from engine import ArrayEngine
+from logs import ColumnarLog, RingBuffer
+
+
+def default_partitions(num_houses, processes):
+    """
+    Cut the grids into `processes` contiguous runs with about the same number
+    of houses each.
+
+    :param num_houses: Number of houses of every grid, in simulation order.
+    """
+    processes = max(1, min(processes, len(num_houses)))
+    weights = np.cumsum(np.asarray(num_houses) + 1)
+    cuts = np.searchsorted(weights, weights[-1] * np.arange(1, processes) / processes, side='right')
+    return [part.tolist() for part in np.split(np.arange(len(num_houses)), cuts) if len(part)]
+
+
+class _Discard(list):
+    # Transaction log of a grid of another partition, whose worker keeps the real one
+    def append(self, entry):
+        pass
+
+
+class _PartitionEngine(ArrayEngine):
+    """
+    ArrayEngine advancing one partition of a ParallelEngine in a worker process.
+
+    The engine lives as long as the worker and runs every block of steps the
+    coordinator sends it. In each step its grids trade among themselves; then
+    it posts the state of its shared grids (see ArrayEngine.shared) and the
+    surplus or deficit its boundary grids kept, meets the other workers and
+    the coordinator at the step's barrier and reads theirs. Every worker then
+    runs the whole settle on the same numbers, so all of them agree on the
+    shared grids without another exchange, and keeps the results for its own
+    grids. The totals of the step go to shared memory for the coordinator.
+    """
+
+    def __init__(self, simulation, partitions, index, views, barrier):
+        super().__init__(simulation, partitions)
+        part = partitions[index]
+        self.index = index
+        self.part = part
+        self.position = {g: i for i, g in enumerate(part)}
+        self.block = slice(part[0], part[-1] + 1) if part[-1] - part[0] + 1 == len(part) else np.array(part)
+        self.own_shared = sorted(g for g in self.shared if self.owner[g] == index)
+        self.foreign_shared = sorted(g for g in self.shared if self.owner[g] != index)
+        self.views = views
+        self.barrier = barrier
+        self.live = None
+        self.t = 0
+
+        ArrayEngine.load_state(self)  # Capacities and array shapes, the state comes with every block
+        self.capacity = self.battery_capacity.tolist()
+        for g, grid in enumerate(self.grids):
+            if self.owner[g] != index:
+                grid.internal_transactions_log = _Discard()
+                grid.external_transactions_log = _Discard()
+
+    def exchange(self, hours, deferred):
+        slot = self.views['exchange'][self.t % 2]
+        own = self.own_shared
+        if own:
+            slot[:, own] = [[self.pool[g] for g in own], [self.total_demand[g] for g in own], [self.level[g] for g in own],
+                            *zip(*[deferred.get(g, (0, 0, 0)) for g in own])]
+        self.barrier.wait()
+
+        # Values of the other partitions; equal ones keep their type, e.g. an int 0 pool
+        foreign = self.foreign_shared
+        for g, (pool, total_demand, level, *kept) in zip(foreign, zip(*slot[:, foreign].tolist())):
+            for local, value in ((self.pool, pool), (self.total_demand, total_demand), (self.level, level)):
+                if local[g] != value:
+                    local[g] = value
+            if g in self.boundary:
+                deferred[g] = kept
+
+    def log_grids(self, hours, generation, total_demand, revenue, rows):
+        self.trades = [row[1][0] if row[1] else None for row in rows]
+        ArrayEngine.log_grids(self, hours, generation, total_demand, revenue, rows)
+
+    def totals(self, hours, excesses, shortages):
+        # Totals of the step, read by the coordinator after the next barrier
+        values, flags = self.views['values'][self.t % 3], self.views['flags'][self.t % 3]
+        part = self.part
+        pool = [self.pool[g] for g in part]
+        total_demand = [self.total_demand[g] for g in part]
+        values[:, part] = [pool, total_demand, self.revenue[self.block], excesses,
+                           [trade[1] if trade else 0 for trade in self.trades], [self.level[g] for g in part], shortages]
+        flags[:, part] = [[type(x) is int for x in pool], [type(x) is int for x in total_demand],
+                          [0 if not trade else 1 if trade[0] == 'sell' else 2 for trade in self.trades]]
+        self.views['hour_cost'][self.t % 3][self.block] = self.cost[self.block]
+
+    def run_block(self, state, carried, enabled, times, producing, output):
+        (self.pool, self.total_demand, self.unmet_demand, self.generation,
+         revenue, self.level, total_energy_generated) = state
+        self.revenue = np.array(revenue, dtype=float)
+        self.total_energy_generated = np.array(total_energy_generated, dtype=float)
+        # House state lives in shared memory, the coordinator reads it back at the end
+        for name in ('current_demand', 'house_unmet_demand', 'cost', 'supplied_energy', 'mixed_source'):
+            setattr(self, name, self.views[name])
+        if self.topology is not None:
+            self.topology.hour = None
+
+        # Fresh logs for the rows of this block, sent back when it ends
+        for g in self.part:
+            grid = self.grids[g]
+            grid.internal_transactions_log = carried[g]
+            grid.log = []
+            grid.columnar_log = ColumnarLog(grid.log_columns, transactions=True, time_dtype=self.simulation.time_dtype,
+                                            enabled=enabled[g])
+            grid.bank.log = RingBuffer(grid.bank.log_dtype)
+
+        k = 0
+        for t, (hours, is_producing) in enumerate(zip(times, producing)):
+            generation = None
+            if is_producing:
+                generation = output[k]
+                k += 1
+            self.t = t
+            self.step(hours, generation)
+
+        own = {}
+        for g in self.part:
+            grid = self.grids[g]
+            own[g] = {
+                'generation': self.generation[g],
+                'total_energy_generated': self.total_energy_generated[g].item(),
+                'internal_transactions_log': grid.internal_transactions_log,
+                'log': grid.log,
+                'columnar_log': grid.columnar_log.rows.rows(),
+                'transactions': grid.columnar_log.transactions.rows(),
+                'supply_log': grid.bank.log.rows(),
+            }
+        return own
+
+
+def _shared_views(buffers, num_grids, width):
+    # NumPy views on the shared buffers of a ParallelEngine
+    shape = (num_grids, width)
+    views = {
+        # Pool, demand and battery of the shared grids, excess, balance and energy acquired of the boundary
+        'exchange': np.frombuffer(buffers['exchange'], dtype=float).reshape(2, 6, num_grids),
+        'values': np.frombuffer(buffers['values'], dtype=float).reshape(3, 7, num_grids),
+        'flags': np.frombuffer(buffers['flags'], dtype=np.int8).reshape(3, 3, num_grids),
+        'hour_cost': np.frombuffer(buffers['hour_cost'], dtype=float).reshape((3,) + shape),
+        'mixed_source': np.frombuffer(buffers['mixed_source'], dtype=bool).reshape(shape),
+    }
+    house = np.frombuffer(buffers['house'], dtype=float).reshape((4,) + shape)
+    for name, view in zip(('current_demand', 'house_unmet_demand', 'cost', 'supplied_energy'), house):
+        views[name] = view
+    return views
+
+
+def _serve(simulation, partitions, index, buffers, width, barrier, connection):
+    # Worker process of a ParallelEngine, runs the blocks it is sent until it gets None
+    try:
+        engine = _PartitionEngine(simulation, partitions, index, _shared_views(buffers, len(simulation.grids), width), barrier)
+    except BaseException:
+        engine = traceback.format_exc()
+    while True:
+        command = connection.recv()
+        if command is None:
+            break
+        try:
+            if isinstance(engine, str):
+                raise RuntimeError(engine)
+            connection.send(engine.run_block(*command))
+        except BaseException:
+            barrier.abort()
+            connection.send(traceback.format_exc())
+
+
+def _shutdown(workers, connections):
+    for connection in connections:
+        try:
+            connection.send(None)
+        except OSError:
+            pass
+    for worker in workers:
+        worker.join(timeout=5)
+        if worker.is_alive():
+            worker.terminate()
+    for connection in connections:
+        connection.close()
+
+
+def _signature(simulation):
+    # What the workers of a ParallelEngine copied when they started
+    return (simulation.step_minutes, simulation.house_log.mode, simulation.conventional_grid.max_supply,
+            [(id(grid), len(grid.bank), grid.battery.capacity, grid.solar_pv.capacity, grid.selling_price, grid.allocation)
+             for grid in simulation.grids])
+
+
+class ParallelEngine:
+    """
+    ArrayEngine run over persistent worker processes, each advancing a
+    partition of the grids.
+
+    The workers start with the engine and keep their grids, houses and
+    partition engine between runs; a run only sends them the grid state and
+    the PV output. Every worker owns the house state of its grids in shared
+    memory and does their per-house work (demand, consumption, supply, logs)
+    on its own. Grids trade with neighbours in their own partition while they
+    step. What the grids on the boundary of a partition have left over is
+    traded with their neighbours in other partitions, and then with the
+    conventional grid, once every grid has stepped. That is the partitioned
+    model of ArrayEngine(simulation, partitions), which gives the same results
+    in one process. It differs from the object model only in the order of the
+    trades across partitions, so partitions that do not trade with each other
+    give the object model's results.
+
+    Workers meet the coordinator (this process) at one barrier per step,
+    where they swap the state of the boundary grids and their partners. The
+    coordinator meanwhile adds up the previous step's simulation totals and
+    replays its conventional-grid trades in the serial engine's order.
+
+    :param processes: Worker processes, all cores by default.
+    :param partitions: Lists of grid indices, one per worker. By default the
+                       grids are cut into contiguous runs with about the same
+                       number of houses (see default_partitions).
+    """
+
+    def __init__(self, simulation, processes=None, partitions=None):
+        import multiprocessing
+
+        if simulation.house_log.mode != 'off':
+            raise ValueError("ParallelEngine needs house logging off.")
+        self.simulation = simulation
+        self.processes = processes
+        if partitions is None:
+            partitions = default_partitions([len(grid.bank) for grid in simulation.grids], processes or os.cpu_count())
+        self.partitions = [sorted(int(g) for g in part) for part in partitions if len(part)]
+        self.engine = engine = ArrayEngine(simulation, self.partitions)
+        engine.live = None  # The house state is in the workers, publish once at the end
+        # Conventional-grid trades in the serial engine's order: the grids that
+        # trade while they step, then the boundary grids as they settle
+        self.trade_order = [g for g in range(len(simulation.grids)) if g not in engine.boundary] + sorted(engine.boundary)
+        self.signature = _signature(simulation)
+
+        num_grids, width = len(simulation.grids), engine.demand_table.shape[2]
+        buffers = {
+            # Written before the barrier of a step and read after it
+            'exchange': multiprocessing.RawArray('d', 2 * 6 * num_grids),
+            # Totals of a step are written until the next barrier and read until the one after
+            'values': multiprocessing.RawArray('d', 3 * 7 * num_grids),
+            'flags': multiprocessing.RawArray('b', 3 * 3 * num_grids),
+            'hour_cost': multiprocessing.RawArray('d', 3 * num_grids * width),
+            'house': multiprocessing.RawArray('d', 4 * num_grids * width),
+            'mixed_source': multiprocessing.RawArray('b', num_grids * width),
+        }
+        self.views = _shared_views(buffers, num_grids, width)
+        self.barrier = multiprocessing.Barrier(len(self.partitions) + 1)
+
+        self.workers, self.connections = [], []
+        for p in range(len(self.partitions)):
+            connection, worker_connection = multiprocessing.Pipe()
+            worker = multiprocessing.Process(target=_serve, daemon=True,
+                                             args=(simulation, self.partitions, p, buffers, width, self.barrier, worker_connection))
+            worker.start()
+            worker_connection.close()
+            self.workers.append(worker)
+            self.connections.append(connection)
+        self._finalizer = weakref.finalize(self, _shutdown, self.workers, self.connections)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Stop the workers.
+        """
+        self._finalizer()
+
+    def reusable(self, simulation, processes):
+        """
+        True if the workers are running and were started for this simulation,
+        as it is now, and this many processes.
+        """
+        return (self._finalizer.alive and simulation is self.simulation and processes == self.processes
+                and _signature(simulation) == self.signature)
+
+    def run(self, start_hour, num_hours):
+        """
+        Advance the simulation by num_hours hours starting at start_hour.
+        """
+        if not self._finalizer.alive:
+            raise RuntimeError("The workers of this ParallelEngine were stopped.")
+        simulation, engine, views = self.simulation, self.engine, self.views
+        first_step = start_hour * simulation.steps_per_hour
+        times = [simulation.time(step) for step in range(first_step, first_step + num_hours * simulation.steps_per_hour)]
+        if not times:
+            return
+        producing, output = engine.pv_output(times)
+        engine.load_state()
+
+        for name in ('current_demand', 'house_unmet_demand', 'cost', 'supplied_energy', 'mixed_source'):
+            views[name][:] = getattr(engine, name)
+        state = (engine.pool, engine.total_demand, engine.unmet_demand, engine.generation, engine.revenue.tolist(),
+                 engine.battery_level.tolist(), engine.total_energy_generated.tolist())
+        for part, connection in zip(self.partitions, self.connections):
+            grids = [simulation.grids[g] for g in part]
+            connection.send((state, {g: list(grid.internal_transactions_log) for g, grid in zip(part, grids)},
+                             {g: grid.columnar_log.enabled for g, grid in zip(part, grids)}, times, producing, output))
+
+        try:
+            for t in range(len(times)):
+                self.barrier.wait()
+                if t:
+                    self.totals(t - 1, times[t - 1])
+        except threading.BrokenBarrierError:
+            pass
+        finished = [connection.recv() for connection in self.connections]
+        for p, own in enumerate(finished):
+            if isinstance(own, str):
+                self.close()  # The barrier stays broken
+                raise RuntimeError(f"Partition {p} of the parallel run failed:\n{own}")
+        self.totals(len(times) - 1, times[-1])
+
+        # Final state, then the log rows of the run
+        states = {g: grid_state for own in finished for g, grid_state in own.items()}
+        engine.generation = [states[g]['generation'] for g in range(len(simulation.grids))]
+        engine.total_energy_generated = np.array([states[g]['total_energy_generated'] for g in range(len(simulation.grids))])
+        engine.battery_level = views['values'][(len(times) - 1) % 3][5].copy()
+        for name in ('current_demand', 'house_unmet_demand', 'cost', 'supplied_energy', 'mixed_source'):
+            setattr(engine, name, views[name].copy())
+        engine.store_state()
+        if simulation.live is not None:
+            simulation.live.publish(simulation, times[-1])
+
+        for g, grid_state in sorted(states.items()):
+            grid = simulation.grids[g]
+            grid.internal_transactions_log = grid_state['internal_transactions_log']
+            grid.log.extend(grid_state['log'])
+            grid.columnar_log.rows.extend(grid_state['columnar_log'])
+            grid.columnar_log.transactions.extend(grid_state['transactions'])
+            grid.bank.log.extend(grid_state['supply_log'])
+        if simulation.ledger is not None:
+            simulation.ledger.add([(simulation.grids[g].id, states[g]['transactions']) for g in sorted(states)])
+
+    def totals(self, t, hours):
+        # Conventional-grid trades and simulation totals of step t
+        values, flags = self.views['values'][t % 3], self.views['flags'][t % 3]
+        pool, total_demand, revenue, excesses, amounts, _, shortages = values.tolist()
+        shortages = [shortage or 0 for shortage in shortages]  # A grid without shortage reports an int 0
+        pool_is_int, demand_is_int, trades = flags.tolist()
+        for g in self.trade_order:
+            if trades[g] == 1:
+                self.engine.conventional_grid.buy_energy(amounts[g])
+            elif trades[g] == 2:
+                self.engine.conventional_grid.sell_energy(amounts[g])
+
+        engine = self.engine
+        engine.pool = [int(value) if is_int else value for value, is_int in zip(pool, pool_is_int)]
+        engine.total_demand = [int(value) if is_int else value for value, is_int in zip(total_demand, demand_is_int)]
+        engine.revenue = values[2].copy()
+        engine.unmet_demand = shortages
+        engine.cost = self.views['hour_cost'][t % 3]
+        engine.totals(hours, excesses, shortages)
@@ -0,0 +1,286 @@
+import copy
+import random
+
+import numpy as np
+
+from MasterNetwork import build_simulation, example_scenario
+from engine import ArrayEngine
+from logs import HouseLogSink
+
+
+class SizingOptimizer:
+    """
+    Search the PV and battery capacity of every grid of a scenario for the
+    cheapest design that keeps the energy bought from the conventional grid
+    below a target share of demand.
+
+    Capacities are expressed like MiniGrid sizes them: PV through safety_factor
+    (total_daily_energy_requirement * safety_factor / avg_sunlight_hours) and
+    the battery through num_days_backup. The search is a coordinate search over
+    the grids. For every grid it tries a ladder of battery sizes and bisects the
+    smallest PV that meets the target, with the other grids held fixed.
+
+    Before any full run an islanded surrogate evaluates the whole PV x battery
+    candidate table of the grid in one vectorized pass, hour by hour over all
+    candidates, on the PV draws of the full runs. Its estimates order the
+    battery sizes and bracket the bisection. They are not bounds (the surrogate
+    ignores neighbours), so a battery size is only skipped when it costs more
+    with the smallest PV searched than the best design found so far. Full
+    simulations (ArrayEngine, fixed seed) are memoized per candidate scenario.
+
+    :param scenario: Scenario dict, see build_simulation.
+    :param target: Largest share of each grid's demand that may be bought from
+                   the conventional grid.
+    :param num_days: Days simulated per evaluation.
+    :param pv_cost: Cost per kW of PV.
+    :param battery_cost: Cost per kWh of battery.
+    :param battery_days: num_days_backup values tried for every grid.
+    :param safety_factors: (lowest, highest) safety_factor searched.
+    :param tolerance: Relative width at which the PV bisection stops.
+    :param margin: Relative slack around the surrogate estimates, since the
+                   surrogate ignores trades with neighbouring grids.
+    """
+
+    def __init__(self, scenario, target=0.05, num_days=14, seed=0, pv_cost=1000.0, battery_cost=300.0,
+                 battery_days=(0.5, 1, 1.5, 2, 3, 4, 5), safety_factors=(0.25, 4.0), tolerance=0.02,
+                 margin=0.15, num_candidates=48, max_passes=3):
+        if not 0 <= target < 1:
+            raise ValueError("target should be between 0 and 1.")
+        if min(battery_days) <= 0:
+            raise ValueError("battery_days should be positive numbers.")
+        if not 0 < safety_factors[0] < safety_factors[1]:
+            raise ValueError("safety_factors should be (lowest, highest) with 0 < lowest < highest.")
+
+        self.scenario = copy.deepcopy(scenario)
+        self.target = target
+        self.num_days = num_days
+        self.seed = seed
+        self.pv_cost = pv_cost
+        self.battery_cost = battery_cost
+        self.battery_days = sorted(battery_days)
+        self.safety_factors = safety_factors
+        self.tolerance = tolerance
+        self.margin = margin
+        self.num_candidates = num_candidates
+        self.max_passes = max_passes
+
+        self.cache = {}  # candidate sizes -> per-grid results of a full run
+        self.full_runs = 0
+        self.cache_hits = 0
+        self.surrogate_candidates = 0
+
+        # Current sizes, (safety_factor, num_days_backup) per grid
+        self.sizes = [(grid['safety_factor'], grid['num_days_backup']) for grid in self.scenario['grids']]
+        self._prepare_surrogate()
+
+    def _prepare_surrogate(self):
+        # Demand and PV output per kW of every grid for every step of an evaluation
+        simulation = build_simulation(self.scenario, house_log=HouseLogSink(mode='off'))
+        engine = ArrayEngine(simulation)
+        self.requirement = np.array(engine.total_daily_energy_requirement, dtype=float)
+        self.sunlight_hours = np.array([grid['avg_sunlight_hours'] for grid in self.scenario['grids']], dtype=float)
+
+        steps = 24 * self.num_days * simulation.steps_per_hour
+        times = [simulation.time(step) for step in range(steps)]
+        self.demand = np.array([engine.step_demand(hours)[1] for hours in times], dtype=float)  # (steps, grids)
+
+        # The PV output of 1 kW in the full runs, which draw from random.seed(self.seed)
+        random_state = random.getstate()
+        random.seed(self.seed)
+        engine.pv_capacity = np.ones(len(simulation.grids))
+        producing, output = engine.pv_output(times)
+        random.setstate(random_state)
+        self.pv_per_kw = np.zeros(self.demand.shape)
+        self.pv_per_kw[np.flatnonzero(producing)] = output
+
+    def pv_capacity(self, g, safety_factor):
+        return self.requirement[g] * safety_factor / self.sunlight_hours[g]
+
+    def battery_capacity(self, g, num_days_backup):
+        return self.requirement[g] * num_days_backup
+
+    def cost(self, g, safety_factor, num_days_backup):
+        return (self.pv_cost * self.pv_capacity(g, safety_factor)
+                + self.battery_cost * self.battery_capacity(g, num_days_backup))
+
+    def surrogate(self, g, safety_factor, num_days_backup):
+        """
+        Share of demand grid g would buy from the conventional grid on its own,
+        for arrays of candidate sizes (broadcast against each other).
+        """
+        safety_factor, num_days_backup = np.broadcast_arrays(np.asarray(safety_factor, dtype=float),
+                                                             np.asarray(num_days_backup, dtype=float))
+        pv = self.pv_capacity(g, safety_factor.ravel())
+        capacity = self.battery_capacity(g, num_days_backup.ravel())
+        level = np.full(pv.shape, 0.5 * self.requirement[g])
+        bought = np.zeros(pv.shape)
+        self.surrogate_candidates += pv.size
+
+        # Same energy balance as MiniGrid.step without neighbours
+        for demand, pv_per_kw in zip(self.demand[:, g].tolist(), self.pv_per_kw[:, g].tolist()):
+            balance = pv * pv_per_kw - demand
+            stored = np.clip(balance, 0, np.maximum(capacity - level, 0))
+            drawn = np.minimum(np.maximum(-balance, 0), level)
+            level = level + stored - drawn
+            bought += np.maximum(-balance, 0) - drawn
+
+        total = self.demand[:, g].sum()
+        share = bought / total if total > 0 else np.zeros(pv.shape)
+        return share.reshape(safety_factor.shape)
+
+    def evaluate(self, sizes):
+        """
+        Full simulation of the scenario with the given (safety_factor,
+        num_days_backup) per grid, memoized.
+
+        :return: Share of demand bought from the conventional grid, per grid.
+                 Demand left unmet under a capped conventional grid (see
+                 ConventionalGrid.max_supply) counts as bought.
+        """
+        key = tuple((round(s, 6), round(d, 6)) for s, d in sizes)
+        if key in self.cache:
+            self.cache_hits += 1
+            return self.cache[key]
+
+        scenario = self.sized_scenario(sizes)
+        simulation = build_simulation(scenario, house_log=HouseLogSink(mode='off'))
+        simulation.configure_logs()
+        random.seed(self.seed)
+        simulation.simulate_days(self.num_days, vectorized=simulation.market is None)
+        self.full_runs += 1
+
+        shares = []
+        for grid in simulation.grids:
+            arrays = grid.columnar_log.to_arrays()
+            demand = arrays['total_demand_kWh'].sum()
+            transactions = grid.columnar_log.transactions_to_arrays()
+            bought = transactions['kWh'][transactions['action'] == 'buy'].sum() + arrays['unmet_demand_kWh'].sum()
+            shares.append(bought / demand if demand > 0 else 0.0)
+        self.cache[key] = shares
+        return shares
+
+    def sized_scenario(self, sizes=None):
+        """
+        Copy of the scenario with the given sizes, the current ones by default.
+        """
+        scenario = copy.deepcopy(self.scenario)
+        for grid, (safety_factor, num_days_backup) in zip(scenario['grids'], sizes or self.sizes):
+            grid['safety_factor'] = safety_factor
+            grid['num_days_backup'] = num_days_backup
+        return scenario
+
+    def _feasible(self, g, safety_factor, num_days_backup, protected):
+        sizes = list(self.sizes)
+        sizes[g] = (safety_factor, num_days_backup)
+        shares = self.evaluate(sizes)
+        return shares[g] <= self.target and all(shares[n] <= self.target for n in protected)
+
+    def _smallest_pv(self, g, num_days_backup, guess, protected):
+        # Bisect the smallest safety_factor meeting the target, starting around the guess
+        lowest, highest = self.safety_factors
+        feasible = lambda s: self._feasible(g, s, num_days_backup, protected)
+
+        hi = min(highest, guess * (1 + self.margin))
+        while not feasible(hi):
+            if hi >= highest:
+                return None
+            hi = min(highest, hi * 2)
+
+        lo = max(lowest, guess / (1 + self.margin))
+        while lo < hi and feasible(lo):
+            if lo <= lowest:
+                return lowest
+            hi, lo = lo, max(lowest, lo / 2)
+
+        while hi - lo > self.tolerance * hi:
+            mid = (lo + hi) / 2
+            if feasible(mid):
+                hi = mid
+            else:
+                lo = mid
+        return hi
+
+    def size_grid(self, g):
+        """
+        Cheapest (safety_factor, num_days_backup) for grid g with the other grids fixed.
+        """
+        shares = self.evaluate(self.sizes)
+        protected = [n for n, share in enumerate(shares) if n != g and share <= self.target]
+
+        # Surrogate estimate of the smallest PV for every battery size at once
+        lowest, highest = self.safety_factors
+        candidates = np.geomspace(lowest, highest, self.num_candidates)
+        table = self.surrogate(g, candidates[:, None], np.array(self.battery_days)[None, :])
+        estimates = []
+        for b, days in enumerate(self.battery_days):
+            meets = np.flatnonzero(table[:, b] <= self.target)
+            guess = candidates[meets[0]] if len(meets) else highest
+            estimates.append((self.cost(g, guess, days), guess, days))
+
+        best = None
+        for _, guess, days in sorted(estimates):
+            if best is not None and self.cost(g, lowest, days) >= best[0]:
+                continue  # Even with the smallest PV this battery size is not cheaper
+            safety_factor = self._smallest_pv(g, days, guess, protected)
+            if safety_factor is not None:
+                cost = self.cost(g, safety_factor, days)
+                if best is None or cost < best[0]:
+                    best = (cost, safety_factor, days)
+
+        return None if best is None else best[1:]
+
+    def optimize(self):
+        """
+        Coordinate search over the grids until no grid changes size.
+
+        :return: dict with the sized 'scenario', per-grid results under 'grids'
+                 (grid id -> safety_factor, num_days_backup, pv_kW, battery_kWh,
+                 cost and unmet share) and the evaluation counts.
+        """
+        for _ in range(self.max_passes):
+            changed = False
+            for g in range(len(self.sizes)):
+                sizes = self.size_grid(g)
+                if sizes is not None and sizes != self.sizes[g]:
+                    self.sizes[g] = sizes
+                    changed = True
+            if not changed:
+                break
+
+        shares = self.evaluate(self.sizes)
+        grids = {}
+        for g, (grid, (safety_factor, num_days_backup)) in enumerate(zip(self.scenario['grids'], self.sizes)):
+            grids[grid['id']] = {
+                'safety_factor': safety_factor,
+                'num_days_backup': num_days_backup,
+                'pv_kW': self.pv_capacity(g, safety_factor),
+                'battery_kWh': self.battery_capacity(g, num_days_backup),
+                'cost_USD': self.cost(g, safety_factor, num_days_backup),
+                'unmet_share': shares[g],
+                'meets_target': shares[g] <= self.target,
+            }
+        return {
+            'scenario': self.sized_scenario(),
+            'grids': grids,
+            'full_runs': self.full_runs,
+            'cache_hits': self.cache_hits,
+            'surrogate_candidates': self.surrogate_candidates,
+        }
+
+
+def optimize_sizing(scenario, target=0.05, num_days=14, seed=0, **kwargs):
+    """
+    Cost-minimal PV and battery size of every grid, see SizingOptimizer.
+    """
+    return SizingOptimizer(scenario, target=target, num_days=num_days, seed=seed, **kwargs).optimize()
+
+
+
+
+if __name__ == "__main__":
+    result = optimize_sizing(example_scenario(), target=0.05, num_days=14)
+    for grid_id, sizes in result['grids'].items():
+        print(f"MiniGrid {grid_id}: PV {sizes['pv_kW']:.2f} kW, battery {sizes['battery_kWh']:.1f} kWh, "
+              f"cost ${sizes['cost_USD']:.0f}, bought {100 * sizes['unmet_share']:.1f}% of demand")
+    print(f"{result['full_runs']} full runs, {result['cache_hits']} cache hits, "
+          f"{result['surrogate_candidates']} surrogate candidates")
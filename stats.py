@@ -0,0 +1,156 @@
+import sys
+import threading
+import time
+
+
+class SimulationStats:
+    """
+    Opt-in profile of where the time of a simulation step goes.
+
+    Every phase of a step (PV generation, house consumption, neighbour exchange,
+    conventional-grid trades, logging) keeps a call counter, its wall time and,
+    with allocations=True, the net number of memory blocks it allocated
+    (sys.getallocatedblocks, which costs microseconds per call once a large
+    heap exists, so it is off by default). Times and blocks are exclusive: a nested phase, e.g. a conventional-grid
+    trade inside MiniGrid.step, is not counted again in the enclosing one, and
+    'step' keeps whatever is not attributed to another phase.
+
+    Methods are wrapped on the instances given to instrument, so other
+    simulations are not affected and a simulation without stats pays nothing.
+    One SimulationStats can instrument several simulations, also from
+    several threads, and then holds their totals; merge adds the snapshot of
+    one in another process.
+    """
+    # (class name, method, phase)
+    targets = [
+        ('Simulation', 'step', 'step'),
+        ('Simulation', 'log_to_csv', 'logging'),
+        ('MiniGrid', 'step', 'step'),
+        ('MiniGrid', 'consume', 'houses'),
+        ('MiniGrid', 'supply_houses', 'houses'),
+        ('MiniGrid', 'accept_energy', 'exchange'),
+        ('MiniGrid', 'provide_energy', 'exchange'),
+        ('MiniGrid', 'log_to_csv', 'logging'),
+        ('SolarPV', 'generate_energy', 'generation'),
+        ('ConventionalGrid', 'buy_energy', 'conventional'),
+        ('ConventionalGrid', 'sell_energy', 'conventional'),
+        ('Topology', 'offer', 'exchange'),
+        ('Topology', 'request', 'exchange'),
+        ('MarketClearing', 'clear', 'exchange'),
+        ('HouseBank', 'log_supply', 'logging'),
+        ('HouseLogSink', 'record', 'logging'),
+        ('HouseLogSink', 'record_grid', 'logging'),
+        ('HouseLogSink', 'flush', 'logging'),
+        ('ArrayEngine', 'step', 'step'),
+        ('ArrayEngine', 'pv_output', 'generation'),
+        ('ArrayEngine', '_accept_energy', 'exchange'),
+        ('ArrayEngine', '_provide_energy', 'exchange'),
+        ('ArrayEngine', 'log_grids', 'logging'),
+        ('ArrayEngine', 'log_houses', 'logging'),
+    ]
+    phases = ['step', 'generation', 'houses', 'exchange', 'conventional', 'logging']
+
+    def __init__(self, allocations=False):
+        self.allocations = allocations
+        self.totals = {phase: [0, 0, 0] for phase in self.phases}  # calls, nanoseconds, blocks
+        self.steps = 0
+        self.lock = threading.Lock()  # Guards totals and steps
+        self._local = threading.local()  # Stack of the phases running in this thread
+
+    def instrument(self, obj):
+        """
+        Time the methods of obj listed in targets. Returns obj.
+        """
+        for class_name, name, phase in self.targets:
+            if type(obj).__name__ == class_name and not hasattr(getattr(obj, name), '__wrapped__'):
+                setattr(obj, name, self._wrap(getattr(obj, name), phase, counts_steps=name == 'step' and class_name != 'MiniGrid'))
+        return obj
+
+    @staticmethod
+    def uninstrument(obj):
+        for class_name, name, phase in SimulationStats.targets:
+            if type(obj).__name__ == class_name and name in vars(obj):
+                delattr(obj, name)
+
+    def _wrap(self, method, phase, counts_steps=False):
+        totals = self.totals[phase]
+        local = self._local
+        clock = time.perf_counter_ns
+        blocks = sys.getallocatedblocks if self.allocations else int
+
+        def wrapper(*args, **kwargs):
+            stack = local.__dict__.setdefault('stack', [])
+            stack.append([0, 0])  # Time and blocks of nested phases
+            start_blocks = blocks()
+            start = clock()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                elapsed = clock() - start
+                allocated = blocks() - start_blocks
+                nested_time, nested_blocks = stack.pop()
+                with self.lock:
+                    totals[0] += 1
+                    totals[1] += elapsed - nested_time
+                    totals[2] += allocated - nested_blocks
+                    if not stack and counts_steps:
+                        self.steps += 1
+                if stack:
+                    stack[-1][0] += elapsed
+                    stack[-1][1] += allocated
+
+        wrapper.__wrapped__ = method
+        return wrapper
+
+    def reset(self):
+        with self.lock:
+            for totals in self.totals.values():
+                totals[:] = [0, 0, 0]
+            self.steps = 0
+
+    def snapshot(self):
+        """
+        The counters as a dict: 'steps' and per phase calls, seconds and, if
+        counted, allocated_blocks.
+        """
+        with self.lock:
+            return {
+                'steps': self.steps,
+                'phases': {phase: dict({'calls': calls, 'seconds': ns / 1e9}, **({'allocated_blocks': allocated} if self.allocations else {}))
+                           for phase, (calls, ns, allocated) in self.totals.items()},
+            }
+
+    def merge(self, snapshot):
+        """
+        Add the counters of a snapshot, e.g. of a run in a worker process.
+        """
+        with self.lock:
+            self.steps += snapshot['steps']
+            for phase, counters in snapshot['phases'].items():
+                totals = self.totals[phase]
+                totals[0] += counters['calls']
+                totals[1] += round(counters['seconds'] * 1e9)
+                totals[2] += counters.get('allocated_blocks', 0)
+
+    def to_prometheus(self, prefix='sole'):
+        """
+        The counters in the Prometheus text exposition format.
+        """
+        with self.lock:
+            steps = self.steps
+            phase_totals = {phase: list(totals) for phase, totals in self.totals.items()}
+        lines = [
+            f'# HELP {prefix}_steps_total Simulation steps run.',
+            f'# TYPE {prefix}_steps_total counter',
+            f'{prefix}_steps_total {steps}',
+        ]
+        metrics = [
+            ('phase_calls_total', 'Calls of the methods of each phase of a step.', lambda t: t[0]),
+            ('phase_seconds_total', 'Wall time spent in each phase of a step.', lambda t: t[1] / 1e9),
+        ]
+        if self.allocations:
+            metrics.append(('phase_allocated_blocks_total', 'Net memory blocks allocated in each phase of a step.', lambda t: t[2]))
+        for name, help_text, value in metrics:
+            lines += [f'# HELP {prefix}_{name} {help_text}', f'# TYPE {prefix}_{name} counter']
+            lines += [f'{prefix}_{name}{{phase="{phase}"}} {value(totals)}' for phase, totals in phase_totals.items()]
+        return '\n'.join(lines) + '\n'
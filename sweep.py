@@ -0,0 +1,179 @@
+import copy
+import itertools
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+
+from MasterNetwork import build_simulation, example_scenario
+from checkpoint import Checkpoint
+from logs import HouseLogSink
+
+
+# Parameters that are set on every MiniGrid of the scenario
+GRID_PARAMETERS = ('safety_factor', 'num_days_backup', 'avg_sunlight_hours', 'selling_price')
+
+# Parameters of the ConventionalGrid
+CONVENTIONAL_PARAMETERS = {
+    'conventional_buying_price': 'buying_price',
+    'conventional_selling_price': 'selling_price',
+}
+
+
+
+def apply_parameters(scenario, parameters):
+    """
+    Return a copy of the scenario with the sweep parameters applied.
+    """
+    scenario = copy.deepcopy(scenario)
+    for name, value in parameters.items():
+        if name in GRID_PARAMETERS:
+            for grid in scenario['grids']:
+                grid[name] = value
+        elif name in CONVENTIONAL_PARAMETERS:
+            scenario['conventional_grid'][CONVENTIONAL_PARAMETERS[name]] = value
+        else:
+            raise ValueError(f"Unknown sweep parameter: {name}")
+    return scenario
+
+
+def summarize(simulation):
+    """
+    Compact end-of-run summary of a Simulation. Mini-grids buy whatever
+    their houses still need from the conventional grid, so the demand the
+    network could not cover itself (what ensemble.py reports as unmet) is
+    grid_purchases_kWh.
+    """
+    conventional_grid = simulation.conventional_grid
+    return {
+        'revenue_USD': simulation.revenue,
+        'client_expenditure_USD': simulation.total_client_revenue,
+        'grid_purchases_kWh': conventional_grid.energy_sold,  # bought by the mini-grids
+        'grid_sales_kWh': conventional_grid.energy_purchased,  # sold by the mini-grids
+        'conventional_revenue_USD': conventional_grid.cgrevenue,
+    }
+
+
+def run_scenario(scenario, seed, num_days, vectorized=True, cache=None):
+    """
+    Build and run one scenario. Runs are self-contained, so the result is the
+    same whether this is called in the current process or in a worker.
+
+    :param cache: Optional ResultCache, a cached run is replayed instead of simulated.
+    """
+    simulation = build_simulation(scenario, house_log=HouseLogSink(mode='off'))
+    random.seed(seed)
+    simulation.simulate_days(num_days, vectorized=vectorized, cache=cache)
+    return summarize(simulation)
+
+
+def _run(job):
+    return run_scenario(*job)
+
+
+def sweep(scenario, parameter_grid, num_days=7, seed=0, processes=None, vectorized=True, cache=None):
+    """
+    Run every combination of a parameter grid on a process pool.
+
+    :param scenario: Base scenario dict, see build_simulation.
+    :param parameter_grid: Dict of parameter name -> list of values. Names are
+                           the MiniGrid parameters in GRID_PARAMETERS or
+                           'conventional_buying_price'/'conventional_selling_price'.
+    :param seed: Scenario i is run with seed + i.
+    :param processes: Worker processes, all cores by default. 1 runs serially
+                      in this process and gives the same results.
+    :param cache: Optional ResultCache. Workers share its directory, not its
+                  in-memory level.
+    :return: DataFrame with one row per scenario: parameters, seed and summary.
+    """
+    names = list(parameter_grid)
+    combinations = [dict(zip(names, values)) for values in itertools.product(*parameter_grid.values())]
+    jobs = [(apply_parameters(scenario, parameters), seed + i, num_days, vectorized, cache)
+            for i, parameters in enumerate(combinations)]
+
+    if processes == 1:
+        results = [_run(job) for job in jobs]
+    else:
+        processes = processes or os.cpu_count()
+        chunksize = max(1, len(jobs) // (4 * processes))
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            results = list(pool.map(_run, jobs, chunksize=chunksize))
+
+    rows = [dict(parameters, seed=job[1], **result) for parameters, job, result in zip(combinations, jobs, results)]
+    import pandas as pd  # Only for the result table, so workers and job results skip it
+    return pd.DataFrame(rows)
+
+
+_checkpoint = None  # Checkpoint of the branches run by this worker, see _load_checkpoint
+
+
+def _load_checkpoint(data):
+    # Worker initializer: decode the checkpoint once, not once per branch
+    global _checkpoint
+    _checkpoint = Checkpoint.from_bytes(data)
+
+
+def run_branch(scenario, num_days, seed=None, vectorized=True, checkpoint=None):
+    """
+    Build a scenario, restore a checkpoint into it and run it on for num_days.
+    The grids keep the battery capacities of the branch scenario.
+
+    :param seed: Reseed the random module; None continues the random state of
+                 the checkpoint, so every branch sees the same weather.
+    :param checkpoint: The worker's checkpoint by default.
+    """
+    simulation = build_simulation(scenario, house_log=HouseLogSink(mode='off'))
+    simulation.restore(checkpoint or _checkpoint, capacities=False)
+    if seed is not None:
+        random.seed(seed)
+    simulation.simulate_days(num_days, vectorized=vectorized)
+    return summarize(simulation)
+
+
+def _run_branch(job):
+    return run_branch(*job)
+
+
+def branch(scenario, checkpoint, branches, num_days=7, seed=None, processes=None, vectorized=True):
+    """
+    Fork what-if branches of a scenario from one Checkpoint and run them on a
+    process pool. The checkpoint is sent to every worker once, as bytes.
+
+    :param checkpoint: Checkpoint taken on a simulation of the scenario.
+    :param branches: List of parameter dicts like the combinations of a sweep,
+                     {} for the unchanged scenario.
+    :param seed: Branch i is reseeded with seed + i; None continues the random
+                 state of the checkpoint in every branch.
+    :param processes: Worker processes, all cores by default. 1 runs serially
+                      in this process and gives the same results.
+    :return: DataFrame with one row per branch: parameters, seed and summary,
+             with totals accumulated since the start of the original run.
+    """
+    seeds = [None if seed is None else seed + i for i in range(len(branches))]
+    jobs = [(apply_parameters(scenario, parameters), num_days, branch_seed, vectorized)
+            for parameters, branch_seed in zip(branches, seeds)]
+
+    if processes == 1:
+        results = [run_branch(*job, checkpoint=checkpoint) for job in jobs]
+    else:
+        processes = processes or os.cpu_count()
+        chunksize = max(1, len(jobs) // (4 * processes))
+        with ProcessPoolExecutor(max_workers=processes, initializer=_load_checkpoint,
+                                 initargs=(checkpoint.to_bytes(),)) as pool:
+            results = list(pool.map(_run_branch, jobs, chunksize=chunksize))
+
+    rows = [dict(parameters, seed=branch_seed, **result) for parameters, branch_seed, result in zip(branches, seeds, results)]
+    import pandas as pd
+    return pd.DataFrame(rows)
+
+
+
+
+if __name__ == "__main__":
+    parameter_grid = {
+        'safety_factor': [1.0, 1.5, 2.0],
+        'num_days_backup': [1, 3, 5],
+        'conventional_selling_price': [0.06, 0.1],
+    }
+    table = sweep(example_scenario(), parameter_grid, num_days=7)
+    print(table.to_string())
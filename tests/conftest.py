@@ -0,0 +1,52 @@
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from MasterNetwork import ConventionalGrid, House, MiniGrid, Simulation
+from benchmark import grid_scenario
+
+
+DEMAND_PROFILE = [1.2, 1.1, 1.0, 0.9, 0.8, 0.7, 0.6, 0.7, 0.8, 0.9, 1.0, 1.2,
+                  1.4, 1.5, 1.6, 1.7, 1.8, 1.9, 1.8, 1.7, 1.6, 1.5, 1.3, 1.2]
+
+
+def build_network(num_grids=4, num_houses=5, seed=2):
+    """
+    Small network of fully meshed grids with varied sizing, so that grids
+    trade with each other and with the conventional grid.
+    """
+    rng = random.Random(seed)
+    conventional_grid = ConventionalGrid(0.03, 0.06)
+    grids = []
+    for g in range(num_grids):
+        houses = [House(i, rng.uniform(8, 14) / 24, DEMAND_PROFILE) for i in range(num_houses)]
+        grids.append(MiniGrid(id=g + 1, houses=houses, avg_sunlight_hours=rng.uniform(4, 9), selling_price=0.05,
+                              num_days_backup=rng.uniform(0.3, 1.5), neighboring_grids=[],
+                              conventional_grid=conventional_grid, safety_factor=rng.uniform(0.4, 2.5)))
+    for grid in grids:
+        grid.neighboring_grids = [other for other in grids if other is not grid]
+    return Simulation(conventional_grid, grids)
+
+
+@pytest.fixture
+def scenario():
+    """
+    Small network of 8 grids with varied sizing, so that grids trade with
+    each other and with the conventional grid.
+    """
+    scenario = grid_scenario(8, 6, neighbors=3)
+    rng = random.Random(2)
+    for grid in scenario['grids']:
+        grid['safety_factor'] = rng.uniform(0.4, 2.5)
+        grid['num_days_backup'] = rng.uniform(0.3, 1.5)
+    return scenario
+
+
+@pytest.fixture(autouse=True)
+def in_tmp_path(tmp_path, monkeypatch):
+    # Runs write their CSV logs to the working directory
+    monkeypatch.chdir(tmp_path)
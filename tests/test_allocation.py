@@ -0,0 +1,122 @@
+import random
+
+import numpy as np
+import pytest
+
+from engine import ArrayEngine
+from houses import ALLOCATION_POLICIES, allocate
+from MasterNetwork import HouseLogSink, build_simulation, example_scenario
+from parallel import default_partitions
+from test_engines import logs
+
+
+UNMET = np.array([[0.5, 2.0, 1.0, 0.0, 0.3],
+                  [1.0, 1.0, 1.0, 1.0, 1.0]])
+PRIORITY = np.array([[0, 1, 0, 2, 1],
+                     [0, 0, 3, 0, 1]])
+
+
+@pytest.mark.parametrize('policy', ALLOCATION_POLICIES)
+@pytest.mark.parametrize('energy', [0.0, 1.4, 100.0])
+def test_policies_hand_out_what_there_is(policy, energy):
+    supplied = allocate(np.full(2, energy), UNMET, policy, PRIORITY)
+    assert (supplied >= 0).all() and (supplied <= UNMET).all()
+    np.testing.assert_allclose(supplied.sum(axis=1), np.minimum(energy, UNMET.sum(axis=1)))
+
+
+def test_policies_share_scarce_energy_differently():
+    energy = np.array([1.4, 2.5])
+    np.testing.assert_allclose(allocate(energy, UNMET, 'order'), [[0.5, 0.9, 0, 0, 0], [1, 1, 0.5, 0, 0]])
+    np.testing.assert_allclose(allocate(energy, UNMET, 'proportional'), UNMET * np.array([[1.4 / 3.8], [0.5]]))
+    np.testing.assert_allclose(allocate(energy, UNMET, 'priority', PRIORITY), [[0, 1.4, 0, 0, 0], [0.5, 0, 1, 0, 1]])
+    np.testing.assert_allclose(allocate(energy, UNMET, 'max_min'), [[0.366667, 0.366667, 0.366667, 0, 0.3],
+                                                                    [0.5, 0.5, 0.5, 0.5, 0.5]], atol=1e-6)
+
+
+def test_unknown_policies_are_rejected():
+    with pytest.raises(ValueError):
+        allocate(np.ones(2), UNMET, 'lottery')
+    scenario = example_scenario()
+    scenario['grids'][0]['allocation'] = 'lottery'
+    with pytest.raises(ValueError):
+        build_simulation(scenario)
+
+
+def scarce_scenario(policy, max_supply):
+    scenario = example_scenario()
+    scenario['conventional_grid'] = dict(scenario['conventional_grid'], max_supply=max_supply)
+    for g, grid in enumerate(scenario['grids']):
+        grid.update(allocation=policy, num_days_backup=0.5, safety_factor=0.6)
+        grid['priority'] = [(house + g) % 3 for house in range(grid['num_houses'])]
+    return scenario
+
+
+def run(scenario, partitions=None, **kwargs):
+    simulation = build_simulation(scenario, house_log=HouseLogSink(mode='off'))
+    simulation.configure_logs()
+    random.seed(9)
+    if partitions is None:
+        simulation.simulate_days(2, **kwargs)
+    else:
+        ArrayEngine(simulation, partitions).run(0, 48)
+    return simulation
+
+
+def house_costs(simulation):
+    return np.concatenate([grid.bank.cost for grid in simulation.grids])
+
+
+@pytest.mark.parametrize('policy', ALLOCATION_POLICIES)
+@pytest.mark.parametrize('max_supply', [None, 0.5, 0])
+def test_engines_agree_on_every_policy(policy, max_supply):
+    scenario = scarce_scenario(policy, max_supply)
+    runs = [logs(run(scenario, **kwargs)) for kwargs in ({}, {'vectorized': True})]
+    assert runs[0] == runs[1]
+    partitions = default_partitions([grid['num_houses'] for grid in scenario['grids']], 2)
+    assert logs(run(scenario, processes=2)) == logs(run(scenario, partitions=partitions))
+
+
+def test_policies_only_differ_when_energy_is_scarce():
+    costs = {policy: house_costs(run(scarce_scenario(policy, None))) for policy in ALLOCATION_POLICIES}
+    assert all(np.allclose(cost, costs['order']) for cost in costs.values())
+
+    costs = {policy: house_costs(run(scarce_scenario(policy, 0))) for policy in ALLOCATION_POLICIES}
+    for policy in ALLOCATION_POLICIES[1:]:
+        assert not np.allclose(costs[policy], costs['order'])
+    # Between them the houses still get everything the grids acquired
+    totals = [cost.sum() for cost in costs.values()]
+    assert totals == pytest.approx([totals[0]] * len(totals), rel=1e-9)
+
+
+@pytest.mark.parametrize('vectorized', [False, True])
+def test_capped_grids_leave_the_rest_unmet(vectorized):
+    uncapped = run(scarce_scenario('order', None), vectorized=vectorized)
+    capped = run(scarce_scenario('order', 0.5), vectorized=vectorized)
+    islanded = run(scarce_scenario('order', 0), vectorized=vectorized)
+
+    assert islanded.conventional_grid.energy_sold == 0
+    assert 0 < capped.conventional_grid.energy_sold < uncapped.conventional_grid.energy_sold
+    assert uncapped.unmet_demand == 0
+    for simulation in (capped, islanded):
+        unmet = [grid.columnar_log.to_arrays()['unmet_demand_kWh'] for grid in simulation.grids]
+        assert simulation.unmet_demand == pytest.approx(sum(values.sum() for values in unmet), rel=1e-9)
+        for grid in simulation.grids:
+            transactions = grid.columnar_log.transactions_to_arrays()
+            buys = transactions['kWh'][transactions['action'] == 'buy']
+            assert (buys <= 0.5 + 1e-12).all()
+    assert 0 < capped.unmet_demand < islanded.unmet_demand
+
+
+def test_market_clearing_leaves_the_rest_unmet():
+    scenario = dict(scarce_scenario('max_min', 0.5), market={'method': 'proportional'})
+    simulation = run(scenario)
+    for grid in simulation.grids:
+        transactions = grid.columnar_log.transactions_to_arrays()
+        assert (transactions['kWh'][transactions['action'] == 'buy'] <= 0.5 + 1e-12).all()
+    unmet = sum(grid.columnar_log.to_arrays()['unmet_demand_kWh'].sum() for grid in simulation.grids)
+    assert simulation.unmet_demand == pytest.approx(unmet, rel=1e-9) and unmet > 0
+
+
+def test_max_supply_must_not_be_negative():
+    with pytest.raises(ValueError):
+        build_simulation(scarce_scenario('order', -1))
@@ -0,0 +1,132 @@
+import json
+import os
+import subprocess
+import sys
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+
+app = pytest.importorskip('app')
+
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+
+@pytest.mark.parametrize('entry', ['houses', 'edges', 'demand_series'])
+def test_submitted_scenarios_cannot_read_server_files(client, scenario, entry):
+    if entry == 'demand_series':
+        scenario['grids'][0]['demand_series'] = {'file': '/etc/passwd'}
+    else:
+        scenario[entry] = {'file': '/etc/passwd'}
+    response = client.post('/jobs', json={'scenario': scenario})
+    assert response.status_code == 400
+    assert not app.get_jobs().jobs
+
+
+def test_tenants_come_from_api_keys(client, monkeypatch):
+    monkeypatch.setattr(app, 'API_KEYS', {'secret': 'alice'})
+    assert client.get('/jobs').status_code == 401
+    assert client.get('/jobs', headers={'X-Tenant': 'alice'}).status_code == 401
+    assert client.get('/jobs', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    assert client.get('/jobs', headers={'Authorization': 'Bearer secret'}).status_code == 200
+
+
+def test_broken_pool_is_a_server_error(client, monkeypatch):
+    def submit(*args, **kwargs):
+        raise BrokenProcessPool("A worker died")
+
+    monkeypatch.setattr(app.get_jobs(), 'submit', submit)
+    assert client.post('/jobs', json={}).status_code == 500
+
+
+def test_stream_days_are_clamped(monkeypatch):
+    started = []
+    monkeypatch.setattr(app.socketio, 'start_background_task', lambda target, *args: started.append(args))
+    client = app.socketio.test_client(app.app)
+    for days in (10 ** 9, 0, -5):
+        client.emit('start_stream', {'days': days})
+    client.emit('start_stream', {'days': 'many'})
+    assert [num_days for sid, num_days in started] == [app.MAX_STREAM_DAYS, 1, 1]
+    assert client.get_received()[-1]['name'] == 'simulation_error'
+    client.disconnect()
+
+
+def test_finished_stream_keeps_the_newer_stream_state(monkeypatch):
+    sid = 'client'
+    newer = {'in_flight': 0, 'cancelled': False}
+
+    def emit(event, *args, **kwargs):
+        app.streams[sid] = newer  # The client restarted while this stream ran
+
+    monkeypatch.setattr(app.socketio, 'emit', emit)
+    app.streams[sid] = {'in_flight': 0, 'cancelled': False}
+    app.stream_simulation(sid, 1)
+    assert app.streams.pop(sid) is newer
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def python(code, **env):
+    return subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=dict(os.environ, **env),
+                          capture_output=True, text=True, check=True).stdout
+
+
+def test_imports_build_nothing():
+    out = python("import sys, app; print(app.simulation is app.jobs is app.cache is None, 'pandas' in sys.modules)")
+    assert out.split()[-2:] == ['True', 'False']
+
+
+def test_slow_startups_are_reported():
+    assert 'over the 0.00s budget' in python('import app', SOLE_STARTUP_BUDGET='0')
+    assert 'budget' not in python('import app', SOLE_STARTUP_BUDGET='60')
+
+
+def test_the_simulation_is_built_once_from_the_scenario_file(tmp_path, monkeypatch):
+    scenario = app.example_scenario()
+    scenario['grids'] = scenario['grids'][:2]
+    for grid in scenario['grids']:
+        grid['neighbors'] = [n for n in grid['neighbors'] if n <= 2]
+    (tmp_path / 'scenario.json').write_text(json.dumps(scenario))
+    monkeypatch.setattr(app, 'SCENARIO_FILE', str(tmp_path / 'scenario.json'))
+    monkeypatch.setattr(app, 'simulation', None)
+    app.load_scenario.cache_clear()
+    try:
+        simulation = app.get_simulation()
+        assert app.get_simulation() is simulation
+        assert [grid.id for grid in simulation.grids] == [1, 2]
+    finally:
+        app.load_scenario.cache_clear()
+
+
+def test_metrics_are_served_as_prometheus_text():
+    response = app.app.test_client().get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    assert 'sole_steps_total' in response.get_data(as_text=True)
+
+
+def test_bad_jobs_are_client_errors():
+    client = app.app.test_client()
+    assert client.post('/jobs', json={'days': 0}).status_code == 400
+    for path in ('/jobs/unknown', '/jobs/unknown/result'):
+        assert client.get(path).status_code == 404
+    assert client.delete('/jobs/unknown').status_code == 404
+    assert client.get('/jobs', headers={'X-Tenant': 'alice'}).get_json() == []
+
+
+@pytest.mark.parametrize('change', [
+    lambda data: data.update(days=app.MAX_JOB_DAYS + 1),
+    lambda data: data['scenario']['grids'][0].update(num_houses=app.MAX_JOB_HOUSES + 1),
+    lambda data: data['scenario']['grids'].extend([data['scenario']['grids'][0]] * app.MAX_JOB_GRIDS),
+], ids=['days', 'houses', 'grids'])
+def test_oversized_jobs_are_rejected(client, scenario, change):
+    data = {'scenario': scenario, 'days': 1}
+    change(data)
+    response = client.post('/jobs', json=data)
+    assert response.status_code == 400
+    assert 'at most' in response.get_json()['error']
+    assert not app.get_jobs().jobs
@@ -0,0 +1,44 @@
+import json
+from collections import defaultdict
+
+import benchmark
+from MasterNetwork import House
+
+
+def test_grid_scenarios_are_sparse_rings():
+    scenario = benchmark.grid_scenario(5, 3, neighbors=2)
+    assert [grid['neighbors'] for grid in scenario['grids']] == [[2, 3], [3, 4], [4, 5], [5, 1], [1, 2]]
+    assert all(grid['num_houses'] == 3 for grid in scenario['grids'])
+
+
+def test_timed_methods_are_restored():
+    original = House.consume_energy
+    totals = defaultdict(lambda: [0, 0.0])
+    with benchmark.timed([(House, 'consume_energy')], totals, category='houses'):
+        house = House(0, 0.5, [1.0] * 24)
+        house.consume_energy(3)
+        house.consume_energy(4)
+    assert House.consume_energy is original
+    assert totals['House.consume_energy'][0] == totals['houses'][0] == 2
+
+
+def test_results_are_saved_and_compared(monkeypatch, capsys):
+    monkeypatch.setitem(benchmark.SCENARIOS, 'tiny', (lambda: benchmark.grid_scenario(3, 4), 1, 1))
+    report = benchmark.main(['--scenarios', 'tiny', '--quick', '--output', 'old.json'])
+    assert [(result['engine'], result['hours']) for result in report['results']] == [('object', 24), ('vectorized', 24)]
+    for result in report['results']:
+        assert result['houses'] == 12
+        assert 0 <= result['logging_seconds'] <= result['split_seconds']
+        assert 0 < result['seconds']
+
+    benchmark.main(['--scenarios', 'tiny', '--quick', '--output', 'new.json', '--compare', 'old.json'])
+    assert json.load(open('new.json'))['results'][0]['scenario'] == 'tiny'
+    assert capsys.readouterr().out.count('tiny') == 6  # 2 + 2 results, 2 comparisons
+
+
+def test_parallel_rows_report_the_speedup(monkeypatch):
+    monkeypatch.setitem(benchmark.SCENARIOS, 'tiny', (lambda: benchmark.grid_scenario(4, 3), 1, 1))
+    report = benchmark.main(['--scenarios', 'tiny', '--engines', 'parallel', '--processes', '2', '--quick', '--output', 'p.json'])
+    result, = report['results']
+    assert (result['engine'], result['processes']) == ('parallel', 2)
+    assert result['speedup'] == result['serial_seconds'] / result['seconds'] > 0
@@ -0,0 +1,125 @@
+import pickle
+import random
+import time
+
+import pytest
+
+from MasterNetwork import build_simulation, example_scenario
+from benchmark import grid_scenario
+from cache import ResultCache
+from checkpoint import Checkpoint
+from jobs import JobService
+from logs import HouseLogSink
+from sweep import sweep
+
+
+def make(scenario):
+    simulation = build_simulation(scenario, house_log=HouseLogSink(mode='off'))
+    simulation.configure_logs()
+    random.seed(5)
+    return simulation
+
+
+def dump(simulation):
+    rows = [buffer.rows().tolist() for buffer in simulation._log_buffers()]
+    return [list(simulation.log)] + [list(grid.log) for grid in simulation.grids] + rows + \
+        [simulation.checkpoint().state, random.random()]
+
+
+@pytest.mark.parametrize('step_minutes', [60, 30])
+def test_cached_runs_replay_exactly(tmp_path, step_minutes):
+    scenario = dict(example_scenario(), step_minutes=step_minutes)
+    reference = make(scenario)
+    reference.simulate_days(3, vectorized=True)
+    reference.simulate_days(2, vectorized=True)
+    expected = repr(dump(reference))
+
+    cache = ResultCache(str(tmp_path))
+    for attempt in range(3):
+        if attempt == 2:
+            cache = ResultCache(str(tmp_path))  # Only the disk level
+        simulation = make(scenario)
+        simulation.simulate_days(3, vectorized=attempt == 0, cache=cache)
+        simulation.simulate_days(2, cache=cache)
+        assert repr(dump(simulation)) == expected
+    assert cache.hits == 2
+
+
+def test_cache_key_covers_the_clock():
+    simulation = make(example_scenario())
+    key = simulation.cache_key(3)
+    simulation.clock += 24
+    assert simulation.cache_key(3) != key
+
+
+def test_cache_key_covers_seed_and_parameters():
+    scenario = example_scenario()
+    key = make(scenario).cache_key(3)
+    assert make(scenario).cache_key(3) == key
+    random.seed(6)
+    assert build_simulation(scenario, house_log=HouseLogSink(mode='off')).cache_key(3) != key
+    priced = dict(scenario, conventional_grid={'buying_price': 0.03, 'selling_price': 0.07})
+    assert make(priced).cache_key(3) != key
+
+
+def test_restore_keeps_levels_within_smaller_batteries():
+    simulation = make(example_scenario())
+    simulation.simulate_days(2)
+    checkpoint = simulation.checkpoint()
+
+    smaller = dict(example_scenario())
+    smaller['grids'] = [dict(grid, num_days_backup=0.1) for grid in smaller['grids']]
+    branch = make(smaller)
+    branch.restore(checkpoint, capacities=False)
+    assert any(saved['battery_level'] > grid.battery.capacity for saved, grid in zip(checkpoint.state['grids'], branch.grids))
+    assert all(grid.battery.level <= grid.battery.capacity for grid in branch.grids)
+
+
+def entry(size):
+    return Checkpoint({'size': size}, {'data': bytes(size)})
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    size = len(entry(1000).to_bytes())
+    cache = ResultCache(str(tmp_path), max_memory_bytes=2 * size, max_disk_bytes=2 * size)
+    for key in 'abc':
+        cache.put(key, entry(1000))
+        time.sleep(0.01)  # Distinct mtimes
+    assert list(cache.memory) == ['b', 'c']
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['b.npz', 'c.npz']
+    assert cache.get('a') is None and cache.get('b').state == {'size': 1000}
+    cache.put('d', entry(1000))
+    assert list(cache.memory) == ['b', 'd']
+
+
+def test_pickled_caches_keep_only_their_directory(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    cache.put('a', entry(10))
+    copy = pickle.loads(pickle.dumps(cache))
+    assert copy.directory == str(tmp_path) and not copy.memory
+    assert copy.get('a').state == {'size': 10}
+
+
+def test_cached_sweeps_and_jobs_skip_the_simulation(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    scenario = grid_scenario(3, 4)
+    grid = {'safety_factor': [1.0, 2.0]}
+    first = sweep(scenario, grid, num_days=1, processes=1, cache=cache)
+    second = sweep(scenario, grid, num_days=1, processes=1, cache=cache)
+    assert first.equals(second)
+    assert (cache.misses, cache.hits) == (2, 2)
+
+    service = JobService(max_workers=1, cache=cache)
+    try:
+        first_job = service.submit('alice', scenario, num_days=1, seed=3)
+        while service.status('alice', first_job)['finished'] is None:
+            time.sleep(0.02)
+        job_id = service.submit('alice', scenario, num_days=1, seed=3)
+        while service.status('alice', job_id)['finished'] is None:
+            time.sleep(0.02)
+        status = service.status('alice', job_id)
+        assert (status['status'], status['cached']) == ('done', True)
+        result, expected = service.result('alice', job_id), service.result('alice', first_job)
+        assert (result['summary'], result['hourly']) == (expected['summary'], expected['hourly'])
+    finally:
+        service.shutdown()
@@ -0,0 +1,86 @@
+import io
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from checkpoint import Checkpoint
+from MasterNetwork import HouseLogSink, build_simulation, example_scenario
+from sweep import branch
+
+
+def build(step_minutes=60):
+    simulation = build_simulation(dict(example_scenario(), step_minutes=step_minutes), house_log=HouseLogSink(mode='off'))
+    simulation.configure_logs()
+    return simulation
+
+
+def grid_rows(simulation, start=0):
+    return [{column: values[start:] for column, values in grid.columnar_log.to_arrays().items()}
+            for grid in simulation.grids]
+
+
+@pytest.mark.parametrize('vectorized', [False, True])
+@pytest.mark.parametrize('step_minutes', [60, 15])
+def test_restored_runs_continue_like_an_uninterrupted_run(vectorized, step_minutes):
+    expected = build(step_minutes)
+    random.seed(5)
+    expected.simulate_days(3, vectorized=vectorized)
+
+    first = build(step_minutes)
+    random.seed(5)
+    first.simulate_days(1, vectorized=vectorized)
+    first.checkpoint().save('day1.npz')
+    random.seed(99)  # Restoring brings back the random state too
+
+    resumed = build(step_minutes)
+    checkpoint = Checkpoint.load('day1.npz')
+    assert checkpoint.hours == 24
+    resumed.restore(checkpoint)
+    resumed.simulate_days(2, vectorized=vectorized)
+
+    steps = 24 * 60 // step_minutes
+    for grid, other in zip(grid_rows(resumed), grid_rows(expected, start=steps)):
+        assert list(grid) == list(other)
+        for column, values in grid.items():
+            np.testing.assert_array_equal(values, other[column])
+    for grid, other in zip(resumed.grids, expected.grids):
+        assert grid.battery.level == other.battery.level
+        np.testing.assert_array_equal(grid.bank.cost, other.bank.cost)
+    assert resumed.conventional_grid.energy_sold == expected.conventional_grid.energy_sold
+
+
+def test_checkpoints_round_trip_without_pickles():
+    simulation = build()
+    random.seed(5)
+    simulation.simulate_days(1)
+    checkpoint = simulation.checkpoint()
+    loaded = Checkpoint.from_bytes(checkpoint.to_bytes())
+    assert loaded.state == checkpoint.state
+    assert set(loaded.arrays) == set(checkpoint.arrays)
+    with np.load(io.BytesIO(checkpoint.to_bytes()), allow_pickle=False) as npz:
+        assert 'state' in npz.files
+
+
+def test_checkpoints_only_fit_the_same_scenario():
+    checkpoint = build().checkpoint()
+    with pytest.raises(ValueError):
+        build(step_minutes=30).restore(checkpoint)
+    scenario = example_scenario()
+    scenario['grids'][0]['num_houses'] = 6
+    with pytest.raises(ValueError):
+        build_simulation(scenario, house_log=HouseLogSink(mode='off')).restore(checkpoint)
+
+
+def test_pool_and_serial_branches_agree():
+    simulation = build()
+    random.seed(5)
+    simulation.simulate_days(1)
+    checkpoint = simulation.checkpoint()
+    branches = [{}, {'safety_factor': 2.0}, {'num_days_backup': 1}]
+
+    serial = branch(example_scenario(), checkpoint, branches, num_days=1, seed=10, processes=1)
+    pool = branch(example_scenario(), checkpoint, branches, num_days=1, seed=10, processes=2)
+    pd.testing.assert_frame_equal(serial, pool)
+    assert serial['seed'].tolist() == [10, 11, 12]
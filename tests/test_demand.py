@@ -0,0 +1,83 @@
+import random
+
+import numpy as np
+import pytest
+
+from MasterNetwork import DemandSeries, HouseLogSink, build_simulation, example_scenario
+from test_engines import logs
+
+
+READINGS = np.arange(4 * 96 * 3, dtype=float).reshape(-1, 3) / 100  # 4 days of 15-minute readings, 3 meters
+
+
+def test_readings_are_summed_or_split_to_the_step():
+    series = DemandSeries(READINGS, step_minutes=15, block_hours=5)
+    np.testing.assert_array_equal(series.read(2, 1, [0, 2]), READINGS[8:12][:, [0, 2]].sum(axis=0))
+    np.testing.assert_array_equal(series.read(2.25, 0.25, [1]), READINGS[9, [1]])
+    np.testing.assert_allclose(series.read(2.25, 5 / 60, [1]), READINGS[9, [1]] / 3)
+    with pytest.raises(ValueError):
+        series.read(2, 10 / 60, [1])  # 10 minutes do not line up with 15
+
+
+def test_series_outside_the_readings_are_rejected_unless_repeated():
+    with pytest.raises(ValueError):
+        DemandSeries(READINGS, step_minutes=15).read(96, 1, [0])
+    repeated = DemandSeries(READINGS, step_minutes=15, repeat=True)
+    np.testing.assert_array_equal(repeated.read(96 + 3, 1, [0]), repeated.read(3, 1, [0]))
+
+
+@pytest.mark.parametrize('suffix', ['.npy', '.arrow'])
+def test_files_are_memory_mapped(suffix):
+    file_name = 'meters' + suffix
+    if suffix == '.npy':
+        np.save(file_name, READINGS)
+    else:
+        pa = pytest.importorskip('pyarrow')
+        table = pa.table({f'meter{m}': READINGS[:, m] for m in range(3)})
+        with pa.ipc.new_file(file_name, table.schema) as writer:
+            writer.write_table(table)
+    series = DemandSeries.open(file_name, step_minutes=15)
+    np.testing.assert_array_equal(series.read(30, 1, [1, 2]), READINGS[120:124, 1:].sum(axis=0))
+    hourly = READINGS.reshape(4, 24, 4, 3).sum(axis=2)
+    np.testing.assert_allclose(series.average_day(), hourly.mean(axis=0))
+
+
+def metered_scenario(step_minutes=60):
+    np.save('meters.npy', READINGS)
+    scenario = example_scenario()
+    scenario['grids'][2] = dict(scenario['grids'][2], base_demand=2,
+                                demand_series={'file': 'meters.npy', 'step_minutes': 15, 'meters': [0, 2]})
+    return dict(scenario, step_minutes=step_minutes)
+
+
+def run(scenario, **kwargs):
+    simulation = build_simulation(scenario, house_log=HouseLogSink(mode='off'))
+    simulation.configure_logs()
+    random.seed(6)
+    simulation.simulate_days(2, **kwargs)
+    return simulation
+
+
+def test_metered_houses_use_their_readings():
+    simulation = run(metered_scenario())
+    grid = simulation.grids[2]
+    assert len(grid.bank) == 2
+    demand = [row['total_demand_kWh'] for row in grid.log]
+    expected = 2 * READINGS[:, [0, 2]].reshape(-1, 4, 2).sum(axis=(1, 2))[:48]
+    assert demand == np.round(expected, 3).tolist()
+
+
+@pytest.mark.parametrize('scenario', [lambda: dict(example_scenario(), step_minutes=15),
+                                      lambda: metered_scenario(step_minutes=15)], ids=['profile', 'metered'])
+def test_engines_agree_on_a_sub_hourly_clock(scenario):
+    simulation = run(scenario())
+    times = simulation.grids[0].columnar_log.to_arrays()['simulation_hour']
+    assert len(times) == 4 * 48 and times[:3].tolist() == [0, 0.25, 0.5]
+    assert logs(run(scenario(), vectorized=True)) == logs(simulation)
+
+
+def test_profile_demand_scales_with_the_step():
+    hourly, quarter = run(example_scenario()), run(dict(example_scenario(), step_minutes=15))
+    for grid, other in zip(quarter.grids, hourly.grids):
+        demand = grid.columnar_log.to_arrays()['total_demand_kWh']
+        np.testing.assert_allclose(demand.reshape(-1, 4).sum(axis=1), other.columnar_log.to_arrays()['total_demand_kWh'])
@@ -0,0 +1,28 @@
+import random
+
+from conftest import build_network
+
+
+def run(**kwargs):
+    simulation = build_network()
+    random.seed(3)
+    for _ in range(2):
+        simulation.simulate_days(2, **kwargs)
+    return simulation
+
+
+def logs(simulation):
+    # Everything a run leaves behind, in a comparable form
+    grids = [(grid.log, grid.battery.level,
+              [(house.cost, house.supplied_energy, house.unmet_demand) for house in grid.houses])
+             for grid in simulation.grids]
+    conventional_grid = simulation.conventional_grid
+    return repr([simulation.log, grids, conventional_grid.energy_purchased, conventional_grid.energy_sold])
+
+
+def test_engines_give_the_same_run():
+    expected = run()
+    simulation = run(vectorized=True)
+    assert logs(simulation) == logs(expected)
+    # The grids did trade with each other
+    assert any('supply' in row['internal_grid_transactions_kWh'] for grid in simulation.grids for row in grid.log)
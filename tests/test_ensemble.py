@@ -0,0 +1,64 @@
+import random
+
+import numpy as np
+import pytest
+
+from MasterNetwork import HouseLogSink, build_simulation, example_scenario
+from ensemble import Ensemble, run_ensemble
+
+
+def test_ensemble_follows_the_object_model_on_its_draws():
+    num_days = 3
+    simulation = build_simulation(example_scenario(), house_log=HouseLogSink(mode='off'))
+    simulation.configure_logs()
+    ensemble = Ensemble(simulation, 1)
+
+    # The object model draws one PV factor per grid and daylight hour, in grid order
+    random.seed(4)
+    daylight = [hour for hour in range(24 * num_days) if 9 <= hour % 24 < 17]
+    factors = np.array([[[random.uniform(0.7, 0.95) for _ in simulation.grids] for _ in daylight]])
+    result = ensemble.run(num_days, pv_factors=factors)
+    random.seed(4)
+    simulation.simulate_days(num_days)
+
+    assert result['members']['revenue_USD'][0] == pytest.approx(simulation.revenue, rel=1e-12)
+    bought = np.zeros(24 * num_days)
+    for g, grid in enumerate(simulation.grids):
+        arrays = grid.columnar_log.to_arrays()
+        np.testing.assert_allclose(result['battery_%'][1, :, g], np.maximum(arrays['battery_%'], 0), rtol=1e-12, atol=1e-12)
+        trades = grid.columnar_log.transactions_to_arrays()
+        buys = trades['action'] == 'buy'
+        np.add.at(bought, trades['simulation_hour'][buys], trades['kWh'][buys])
+    np.testing.assert_allclose(result['unmet_demand_kWh'][1], bought, rtol=1e-12, atol=1e-12)
+
+
+def test_members_do_not_depend_on_the_ensemble_size():
+    simulation = build_simulation(example_scenario(), house_log=HouseLogSink(mode='off'))
+    small = run_ensemble(simulation, 3, 2, seed=7)
+    large = run_ensemble(simulation, 8, 2, seed=7)
+    np.testing.assert_array_equal(large['members']['revenue_USD'][:3], small['members']['revenue_USD'])
+    assert small['battery_%'].shape == (3, 48, len(simulation.grids))
+
+
+def capped(scenario):
+    scenario['conventional_grid'] = dict(scenario['conventional_grid'], max_supply=1.0)
+
+
+def with_topology(scenario):
+    scenario['topology'] = {'edges': [(1, 2, 0.5, 0.1), (2, 3)]}
+
+
+def with_market(scenario):
+    scenario['market'] = {'method': 'proportional'}
+
+
+def with_allocation(scenario):
+    scenario['grids'][1]['allocation'] = 'proportional'
+
+
+@pytest.mark.parametrize('change', [capped, with_topology, with_market, with_allocation])
+def test_settings_the_ensemble_does_not_model_are_rejected(change):
+    scenario = example_scenario()
+    change(scenario)
+    with pytest.raises(ValueError):
+        Ensemble(build_simulation(scenario, house_log=HouseLogSink(mode='off')), 2)
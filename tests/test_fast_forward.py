@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from MasterNetwork import HouseLogSink, build_simulation, example_scenario
+
+
+def sited_scenario(**site):
+    scenario = example_scenario()
+    for grid in scenario['grids']:
+        grid['site'] = dict(site)
+    return scenario
+
+
+def run(num_days, house_log='off', scenario=None, **kwargs):
+    simulation = build_simulation(scenario or sited_scenario(), house_log=HouseLogSink(mode=house_log))
+    simulation.configure_logs()
+    steps = []
+    step = simulation.step
+    simulation.step = lambda hours: steps.append(hours) or step(hours)
+    simulation.simulate_days(num_days, **kwargs)
+    return simulation, len(steps)
+
+
+def test_fast_forward_matches_a_full_run():
+    expected, full_steps = run(30)
+    simulation, steps = run(30, fast_forward=1e-9)
+    assert steps < full_steps / 5  # The later days are extrapolated
+
+    for grid, other in zip(simulation.grids, expected.grids):
+        assert grid.battery.level == pytest.approx(other.battery.level, abs=1e-9)
+        for name in ('cost', 'supplied_energy', 'unmet_demand', 'current_demand'):
+            np.testing.assert_allclose(getattr(grid.bank, name), getattr(other.bank, name), rtol=1e-12, atol=1e-9)
+        for rows, expected_rows in ((grid.columnar_log.to_arrays(), other.columnar_log.to_arrays()),
+                                    (grid.columnar_log.transactions_to_arrays(),
+                                     other.columnar_log.transactions_to_arrays())):
+            assert list(rows) == list(expected_rows)
+            for column, values in rows.items():
+                if values.dtype.kind == 'f':
+                    np.testing.assert_allclose(values, expected_rows[column], rtol=1e-12, atol=1e-9)
+                else:
+                    np.testing.assert_array_equal(values, expected_rows[column])
+        assert len(grid.log) == len(other.log)
+        for row, expected_row in zip(grid.log, other.log):
+            assert row.keys() == expected_row.keys()
+            assert row['simulation_hour'] == expected_row['simulation_hour']
+            assert row['revenue_USD'] == pytest.approx(expected_row['revenue_USD'], abs=1.001e-3)
+    assert simulation.clock == expected.clock
+    assert simulation.conventional_grid.energy_sold == pytest.approx(expected.conventional_grid.energy_sold, rel=1e-12)
+
+
+def test_short_runs_are_simulated_in_full():
+    expected, _ = run(2)
+    simulation, _ = run(2, fast_forward=1e-9)
+    assert simulation.log == expected.log
+
+
+@pytest.mark.parametrize('scenario, house_log', [(example_scenario(), 'off'),
+                                                 (sited_scenario(latitude=30), 'off'),
+                                                 (sited_scenario(cloudiness=0.3), 'off'),
+                                                 (sited_scenario(), 'sampled')],
+                         ids=['random', 'latitude', 'clouds', 'house-log'])
+def test_days_that_cannot_repeat_are_rejected(scenario, house_log):
+    with pytest.raises(ValueError):
+        run(10, house_log=house_log, scenario=scenario, fast_forward=1e-9)
@@ -0,0 +1,77 @@
+import csv
+import os
+import random
+import types
+
+from MasterNetwork import build_simulation, example_scenario
+from conftest import build_network
+from houses import House
+from logs import HouseLogSink
+
+
+def test_runs_write_their_house_rows(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    simulation = build_simulation(example_scenario(), house_log=HouseLogSink(mode='all'))
+    simulation.simulate_days(1)
+    simulation.simulate_days(1, vectorized=True)
+    with open(tmp_path / 'house_log_grid_1_house_0.csv') as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == HouseLogSink.headers
+    assert [row[0] for row in rows[1:]] == [str(hour) for hour in range(48)]
+
+
+def test_house_step_logs_through_the_sink(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    house = House(3, 0.5, [1.0] * 24)
+    house.assign_to_grid(types.SimpleNamespace(id=7, step_hours=1, selling_price=0.05, supply_energy_to_house=lambda demand: demand))
+    sink = HouseLogSink()
+    for hour in range(3):
+        house.step(hour, sink)
+    assert not list(tmp_path.iterdir())
+    assert [row[0] for row in sink.buffers[(7, 3)]] == [0, 1, 2]
+    sink.flush()
+    assert (tmp_path / 'house_log_grid_7_house_3.csv').exists()
+
+
+def run(house_log, num_days=1, **kwargs):
+    simulation = build_network()
+    simulation.house_log = house_log
+    random.seed(3)
+    simulation.simulate_days(num_days, **kwargs)
+    return simulation
+
+
+def house_logs(directory='.'):
+    return {name: open(os.path.join(directory, name)).read()
+            for name in sorted(os.listdir(directory)) if name.startswith('house_log_')}
+
+
+def test_engines_write_the_same_house_logs(tmp_path):
+    for name, kwargs in (('object', {}), ('array', {'vectorized': True})):
+        os.mkdir(tmp_path / name)
+        os.chdir(tmp_path / name)
+        run(HouseLogSink(), num_days=2, **kwargs).house_log.flush()
+    expected = house_logs(tmp_path / 'object')
+    assert len(expected) == 20
+    assert house_logs(tmp_path / 'array') == expected
+
+
+def test_sampled_mode_logs_every_nth_hour():
+    run(HouseLogSink(mode='sampled', sample_every=6)).house_log.flush()
+    for name in house_logs():
+        with open(name) as f:
+            rows = list(csv.reader(f))
+        assert rows[0] == HouseLogSink.headers
+        assert [row[0] for row in rows[1:]] == ['0', '6', '12', '18']
+
+
+def test_off_mode_writes_nothing():
+    run(HouseLogSink(mode='off')).house_log.flush()
+    assert house_logs() == {}
+
+
+def test_full_buffers_are_flushed():
+    house_log = HouseLogSink(flush_rows=50)
+    run(house_log)
+    assert house_log.buffered_rows < 50
+    assert sum(text.count('\n') - 1 for text in house_logs().values()) + house_log.buffered_rows == 24 * 20
@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from conftest import DEMAND_PROFILE, build_network
+from houses import House, HouseBank
+from MasterNetwork import HouseLogSink, build_simulation, example_scenario
+
+
+BASE_DEMAND = [0.3, 0.8, 0.5, 1.1, 0.2]
+PROFILES = [DEMAND_PROFILE, DEMAND_PROFILE[::-1]] * 2 + [DEMAND_PROFILE]
+
+
+class Pool:
+    # The part of MiniGrid a standalone House talks to
+    selling_price = 0.05
+    step_hours = 1
+
+    def __init__(self, total_generation):
+        self.total_generation = total_generation
+
+    def supply_energy_to_house(self, amount_needed):
+        energy_from_generation = min(amount_needed, self.total_generation)
+        self.total_generation -= energy_from_generation
+        return energy_from_generation
+
+
+def houses_and_bank(pool):
+    houses = [House(i, base_demand, profile) for i, (base_demand, profile) in enumerate(zip(BASE_DEMAND, PROFILES))]
+    for house in houses:
+        house.assign_to_grid(pool)
+    return houses, HouseBank(range(len(houses)), BASE_DEMAND, PROFILES)
+
+
+@pytest.mark.parametrize('generation', [0.0, 1.2, 100.0])
+def test_banks_consume_like_the_house_loop(generation):
+    pool = Pool(generation)
+    houses, bank = houses_and_bank(pool)
+    demand = [house.consume_energy(13) for house in houses]
+
+    bank_demand, left = bank.consume(13, generation, Pool.selling_price)
+    assert bank_demand.tolist() == demand
+    assert left == pool.total_generation
+    for name in ('current_demand', 'unmet_demand', 'cost'):
+        assert getattr(bank, name).tolist() == [getattr(house, name) for house in houses]
+
+
+@pytest.mark.parametrize('energy', [0.0, 0.7, 100.0])
+def test_banks_distribute_like_supply_energy(energy):
+    houses, bank = houses_and_bank(Pool(0.4))
+    for house in houses:
+        house.consume_energy(18)
+    bank.consume(18, 0.4, Pool.selling_price)
+
+    left = energy
+    for house in houses:
+        if house.unmet_demand > 0:
+            supplied = min(left, house.unmet_demand)
+            house.supply_energy(supplied, simulation_hour=18)
+            left -= supplied
+    bank.distribute(energy, Pool.selling_price)
+
+    for name in ('current_demand', 'unmet_demand', 'cost', 'supplied_energy', 'energy_source'):
+        assert [bank.get(name, i) for i in range(len(bank))] == [getattr(house, name) for house in houses]
+    assert [bank.house_log(i) for i in range(len(bank))] == [house.log for house in houses]
+
+
+def test_houses_become_views_on_their_bank():
+    grid = build_network(num_grids=1).grids[0]
+    house = grid.houses[2]
+    assert house.bank is grid.bank and house.index == 2
+    house.cost = 4.5
+    assert grid.bank.cost[2] == 4.5 and grid.houses[2].cost == 4.5
+    assert [h.id for h in grid.houses] == list(range(5))
+    assert grid.bank.profiles.shape == (1, 24)  # One shared profile
+
+
+def test_built_grids_hold_no_house_objects():
+    simulation = build_simulation(example_scenario(), house_log=HouseLogSink(mode='off'))
+    assert [len(grid.bank) for grid in simulation.grids] == [5, 9, 2]
+    assert all(isinstance(grid.bank.base_demand, np.ndarray) for grid in simulation.grids)
+    assert simulation.grids[1].houses[-1].id == 8
@@ -0,0 +1,149 @@
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+import jobs
+from benchmark import grid_scenario
+from cache import ResultCache
+from jobs import JobService
+
+
+class DonePool:
+    """
+    Stand-in for the process pool whose jobs are done by the time submit returns.
+    """
+
+    def __init__(self):
+        self.submitted = 0
+
+    def submit(self, fn, slot, *args):
+        self.submitted += 1
+        future = Future()
+        future.set_result({'status': 'done', 'cached': False, 'summary': {}, 'hourly': {}})
+        return future
+
+
+def test_jobs_that_finish_at_once_do_not_deadlock():
+    service = JobService(max_workers=1, max_per_tenant=10)
+    service.pool = DonePool()
+    service.cancel_flags = [False]
+    service.progress = [0]
+
+    def submit_all():
+        for _ in range(3):
+            service.submit('tenant', {}, num_days=1)
+
+    thread = threading.Thread(target=submit_all, daemon=True)
+    thread.start()
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+    assert service.pool.submitted == 3
+    assert [job['status'] for job in service.list('tenant')] == ['done'] * 3
+
+
+def test_workers_replay_cached_runs(scenario, tmp_path):
+    jobs._init_worker([False], [0])
+    cache = ResultCache(str(tmp_path))
+    first = jobs.run_job(0, scenario, 2, 0, True, cache)
+    second = jobs.run_job(0, scenario, 2, 0, True, cache)
+    assert not first.pop('cached')
+    assert second.pop('cached')
+    assert second == first
+
+
+class BrokenPool:
+    def submit(self, fn, slot, *args):
+        raise BrokenProcessPool("A worker died")
+
+    def shutdown(self, wait=True):
+        pass
+
+
+def broken_service(monkeypatch, pools):
+    service = JobService(max_workers=1, max_per_tenant=10)
+    service.pool = BrokenPool()
+    service.cancel_flags = [False]
+    service.progress = [0]
+
+    def start_pool():
+        service.pool = pools.pop(0)
+
+    monkeypatch.setattr(service, '_start_pool', start_pool)
+    return service
+
+
+def test_broken_pool_is_restarted(monkeypatch):
+    service = broken_service(monkeypatch, [DonePool()])
+    job_id = service.submit('tenant', {}, num_days=1)
+    assert service.status('tenant', job_id)['status'] == 'done'
+
+
+def test_submit_fails_when_the_new_pool_breaks_too(monkeypatch):
+    service = broken_service(monkeypatch, [BrokenPool(), DonePool()])
+    with pytest.raises(BrokenProcessPool):
+        service.submit('tenant', {}, num_days=1)
+    assert service.list('tenant') == []
+    assert service.submit('tenant', {}, num_days=1)
+
+
+@pytest.fixture
+def service():
+    service = JobService(max_workers=1, max_queued=2, max_per_tenant=3)
+    yield service
+    service.shutdown()
+
+
+def wait(service, tenant, job_id, timeout=60):
+    deadline = time.monotonic() + timeout
+    while service.status(tenant, job_id)['finished'] is None:
+        assert time.monotonic() < deadline, "The job did not finish"
+        time.sleep(0.02)
+    return service.status(tenant, job_id)
+
+
+def test_jobs_run_on_the_pool(service):
+    job_id = service.submit('alice', grid_scenario(3, 4), num_days=2, seed=1)
+    status = wait(service, 'alice', job_id)
+    assert (status['status'], status['days_done'], status['error']) == ('done', 2, None)
+    result = service.result('alice', job_id)
+    assert len(result['hourly']['simulation_hour']) == 48
+    assert 'revenue_USD' in result['summary']
+
+
+def test_jobs_are_private_to_their_tenant(service):
+    job_id = service.submit('alice', grid_scenario(3, 4), num_days=1)
+    with pytest.raises(KeyError):
+        service.status('bob', job_id)
+    with pytest.raises(KeyError):
+        service.cancel('bob', job_id)
+    assert service.list('bob') == []
+    assert [job['id'] for job in service.list('alice')] == [job_id]
+
+
+def test_queues_and_tenants_are_capped(service):
+    scenario = grid_scenario(3, 4)
+    running = service.submit('alice', scenario, num_days=50)
+    queued = [service.submit('alice', scenario, num_days=1), service.submit('bob', scenario, num_days=1)]
+    with pytest.raises(RuntimeError):
+        service.submit('carol', scenario, num_days=1)  # Queue full
+    assert [service.status(tenant, job_id)['queue_position'] for tenant, job_id in zip(('alice', 'bob'), queued)] == [0, 1]
+
+    assert service.cancel('alice', queued[0])
+    service.submit('alice', scenario, num_days=1)
+    with pytest.raises(RuntimeError):
+        service.submit('alice', scenario, num_days=1)  # 3 queued or running
+    assert service.status('alice', queued[0])['status'] == 'cancelled'
+
+    assert service.cancel('alice', running)
+    assert wait(service, 'alice', running)['status'] == 'cancelled'
+    assert not service.cancel('alice', running)
+
+
+@pytest.mark.parametrize('num_days', [0, -1, 1.5, '2'])
+def test_bad_days_are_rejected(service, num_days):
+    with pytest.raises(ValueError):
+        service.submit('alice', {}, num_days=num_days)
+    assert service.pool is None
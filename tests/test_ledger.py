@@ -0,0 +1,126 @@
+import random
+
+import numpy as np
+import pytest
+
+from MasterNetwork import build_simulation, example_scenario
+from conftest import build_network
+from engine import ArrayEngine
+from logs import HouseLogSink
+from parallel import default_partitions
+
+
+def ledger_rows(scenario, num_days, capacity=None, partitions=None, **kwargs):
+    simulation = build_simulation(scenario, house_log=HouseLogSink(mode='off'))
+    if capacity is not None:
+        simulation.configure_logs(capacity=capacity)
+    ledger = simulation.enable_ledger()
+    random.seed(4)
+    if partitions is None:
+        simulation.simulate_days(num_days, **kwargs)
+    else:
+        ArrayEngine(simulation, partitions).run(0, 24 * num_days)
+    return ledger.to_arrays()
+
+
+@pytest.mark.parametrize('kwargs', [{}, {'vectorized': True}, {'vectorized': True, 'processes': 2}],
+                         ids=['object', 'vectorized', 'parallel'])
+def test_bounded_logs_keep_every_trade(scenario, kwargs):
+    unbounded = ledger_rows(scenario, 10, **kwargs)
+    bounded = ledger_rows(scenario, 10, capacity=48, **kwargs)
+    assert len(unbounded['kWh']) > 48
+    assert len(bounded['kWh']) == len(unbounded['kWh'])
+    for name, column in unbounded.items():
+        assert np.array_equal(bounded[name], column, equal_nan=column.dtype.kind == 'f')
+
+
+def test_engines_give_the_same_ledger(scenario):
+    assert_same_rows(ledger_rows(scenario, 3, vectorized=True), ledger_rows(scenario, 3))
+    # Parallel runs trade across partitions last, like the partitioned serial engine
+    partitions = default_partitions([grid['num_houses'] for grid in scenario['grids']], 2)
+    assert_same_rows(ledger_rows(scenario, 3, processes=2), ledger_rows(scenario, 3, partitions=partitions))
+
+
+def test_clear_logs_keeps_the_ledger(scenario):
+    simulation = build_simulation(scenario, house_log=HouseLogSink(mode='off'))
+    ledger = simulation.enable_ledger()
+    simulation.simulate_days(2, vectorized=True)
+    rows = len(ledger)
+    simulation.clear_logs()
+    simulation.simulate_days(1, vectorized=True)
+    assert len(ledger) > rows
+    assert np.all(np.diff(ledger.to_arrays()['simulation_hour']) >= 0)
+
+
+def simulate(num_days, **kwargs):
+    simulation = build_network()
+    simulation.house_log = HouseLogSink(mode='off')
+    ledger = simulation.enable_ledger()
+    random.seed(4)
+    simulation.simulate_days(num_days, **kwargs)
+    return simulation, ledger
+
+
+def assert_same_rows(rows, expected):
+    assert list(rows) == list(expected)
+    for name, column in expected.items():
+        assert np.array_equal(rows[name], column, equal_nan=column.dtype.kind == 'f')
+
+
+def test_totals_match_the_grid_logs():
+    simulation, ledger = simulate(2)
+    for grid in simulation.grids:
+        transactions = grid.columnar_log.transactions_to_arrays()
+        for action, from_grid, to_grid in (('buy', -1, grid.id), ('sell', grid.id, -1)):
+            expected = transactions['kWh'][transactions['action'] == action].sum()
+            assert ledger.total(from_grid, to_grid) == pytest.approx(expected, rel=1e-12)
+        supplied = transactions['action'] == 'supply'
+        for other in simulation.grids:
+            expected = transactions['kWh'][supplied & (transactions['counterparty'] == other.id)].sum()
+            assert ledger.total(grid.id, other.id) == pytest.approx(expected, rel=1e-12)
+
+
+def test_queries_match_a_scan():
+    _, ledger = simulate(2)
+    rows = ledger.to_arrays()
+    hours = rows['simulation_hour']
+    for start, stop in ((None, None), (5, 30), (30, 31), (47, None), (100, 200)):
+        selected = np.ones(len(hours), dtype=bool)
+        if start is not None:
+            selected &= hours >= start
+        if stop is not None:
+            selected &= hours < stop
+        assert repr(ledger.between(start, stop).tolist()) == repr(ledger.rows.rows()[selected].tolist())
+
+    pair = (rows['from_grid'] == 2) & (rows['to_grid'] == 1) & (hours >= 10) & (hours < 40)
+    assert repr(ledger.pair(2, 1, 10, 40).tolist()) == repr(ledger.rows.rows()[pair].tolist())
+    assert len(ledger.pair(2, 1, 10, 40)) > 0
+    assert len(ledger.pair(7, 8)) == 0
+
+
+def test_restores_drop_the_later_rows():
+    simulation, ledger = simulate(1)
+    checkpoint = simulation.checkpoint()
+    rows = ledger.to_arrays()
+    simulation.simulate_days(1)
+    simulation.restore(checkpoint)
+    assert_same_rows(ledger.to_arrays(), rows)
+
+
+def test_fast_forward_keeps_every_trade():
+    scenario = example_scenario()
+    for grid in scenario['grids']:
+        grid['site'] = {}
+    ledgers = []
+    for fast_forward in (None, 1e-9):
+        simulation = build_simulation(scenario, house_log=HouseLogSink(mode='off'))
+        ledger = simulation.enable_ledger()
+        simulation.simulate_days(20, fast_forward=fast_forward)
+        ledgers.append(ledger.to_arrays())
+    expected, rows = ledgers
+    assert len(rows['kWh']) == len(expected['kWh']) > 0
+    for name, column in expected.items():
+        if column.dtype.kind == 'f':
+            np.testing.assert_allclose(rows[name], column, rtol=1e-12, atol=1e-9)
+        else:
+            np.testing.assert_array_equal(rows[name], column)
@@ -0,0 +1,85 @@
+import json
+import os
+import random
+import subprocess
+import sys
+from multiprocessing import shared_memory
+
+import numpy as np
+import pytest
+
+from live import LiveState
+from MasterNetwork import HouseLogSink, build_simulation, example_scenario
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+READER = """
+import json, sys
+from live import LiveState
+live = LiveState.attach(sys.argv[1])
+snapshot = live.snapshot()
+print(json.dumps({'sequence': snapshot['sequence'], 'revenue': snapshot['revenue'],
+                  'simulation_hour': snapshot['simulation_hour'], 'grid_ids': snapshot['grid_ids'].tolist(),
+                  'grids': {name: values.tolist() for name, values in snapshot['grids'].items()},
+                  'cost': snapshot['houses']['cost'].tolist()}))
+live.close()
+"""
+
+
+@pytest.fixture
+def simulation():
+    simulation = build_simulation(example_scenario(), house_log=HouseLogSink(mode='off'))
+    yield simulation
+    simulation.stop_sharing()
+
+
+def read_from_another_process(name):
+    out = subprocess.run([sys.executable, '-c', READER, name], cwd=ROOT, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout)
+
+
+@pytest.mark.parametrize('vectorized', [False, True])
+def test_other_processes_see_the_published_state(simulation, vectorized):
+    live = simulation.share_state()
+    random.seed(2)
+    simulation.simulate_days(1, vectorized=vectorized)
+
+    snapshot = read_from_another_process(live.name)
+    assert snapshot['sequence'] == live.sequence and snapshot['sequence'] % 2 == 0
+    assert snapshot['simulation_hour'] == 23
+    assert snapshot['revenue'] == simulation.revenue
+    assert snapshot['grid_ids'] == [1, 2, 3]
+    assert snapshot['grids']['battery_level_kWh'] == [grid.battery.get_level() for grid in simulation.grids]
+    assert snapshot['grids']['revenue_USD'] == [grid.revenue for grid in simulation.grids]
+    assert snapshot['cost'] == np.concatenate([grid.bank.cost for grid in simulation.grids]).tolist()
+
+
+def test_every_step_is_published(simulation):
+    live = simulation.share_state()
+    assert live.sequence == 2  # The initial state
+    simulation.simulate_days(1)
+    assert live.sequence == 2 + 2 * 24
+    assert live.snapshot()['simulation_hour'] == 23
+
+
+def test_snapshots_give_up_on_a_dead_writer(simulation):
+    live = simulation.share_state()
+    live.header[2] += 1  # Died mid-update
+    with pytest.raises(TimeoutError):
+        live.snapshot(timeout=0.05)
+
+
+def test_other_blocks_are_rejected():
+    memory = shared_memory.SharedMemory(create=True, size=4096)
+    try:
+        with pytest.raises(ValueError):
+            LiveState.attach(memory.name)
+    finally:
+        memory.close()
+        memory.unlink()
+
+
+def test_machines_without_x86_memory_ordering_are_warned(simulation, monkeypatch):
+    monkeypatch.setattr('platform.machine', lambda: 'aarch64')
+    with pytest.warns(RuntimeWarning, match='aarch64'):
+        simulation.share_state()
@@ -0,0 +1,104 @@
+import random
+
+import numpy as np
+import pytest
+
+from MasterNetwork import build_simulation, example_scenario
+from conftest import build_network
+from logs import HouseLogSink, load_log
+
+
+def run(columnar, vectorized=True):
+    simulation = build_simulation(example_scenario(), house_log=HouseLogSink(mode='off'))
+    if columnar:
+        simulation.configure_logs()
+    simulation.simulate_days(2, vectorized=vectorized)
+    return simulation
+
+
+def run_network(**kwargs):
+    simulation = build_network()
+    simulation.configure_logs()
+    random.seed(3)
+    simulation.simulate_days(2, **kwargs)
+    return simulation
+
+
+@pytest.mark.parametrize('vectorized', [False, True])
+def test_columnar_logs_are_opt_in(vectorized):
+    simulation = run(columnar=False, vectorized=vectorized)
+    assert len(simulation.log) == 48
+    assert simulation.columnar_log.rows.count == 0
+    assert all(grid.columnar_log.transactions.count == 0 for grid in simulation.grids)
+    with pytest.raises(ValueError):
+        simulation.save_logs('npy')
+
+    simulation = run(columnar=True, vectorized=vectorized)
+    assert simulation.columnar_log.rows.count == 48
+
+
+def test_npy_logs_load_memory_mapped(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    simulation = run(columnar=True)
+    grid = simulation.grids[0]
+    simulation.save_logs('npy')
+    grid.save_logs('npy')
+
+    hourly = load_log('simulation_log', as_frame=False)
+    assert all(isinstance(values, np.memmap) for values in hourly.values())
+    assert np.array_equal(hourly['revenue'], simulation.columnar_log.to_arrays()['revenue'])
+
+    transactions = load_log(f'mini_grid_log_{grid.id}', transactions=True, as_frame=False)
+    expected = grid.columnar_log.transactions_to_arrays()
+    assert sorted(transactions) == sorted(expected)
+    assert np.array_equal(transactions['kWh'], expected['kWh'])
+    assert np.array_equal(transactions['action'], expected['action'])
+
+    frame = load_log(f'mini_grid_log_{grid.id}')
+    assert len(frame) == 48 and frame['revenue_USD'].iloc[-1] == grid.revenue
+
+
+def test_columnar_logs_hold_the_unrounded_rows():
+    simulation = run_network()
+    for grid in simulation.grids:
+        arrays = grid.columnar_log.to_arrays()
+        for column in ('generation_kWh', 'total_demand_kWh', 'revenue_USD', 'battery_level_kWh'):
+            assert np.round(arrays[column], 3).tolist() == [row[column] for row in grid.log]
+        trades = sum(row['internal_grid_transactions_kWh'].count('(') + row['external_grid_transactions_kWh'].count('(')
+                     for row in grid.log)
+        assert len(grid.columnar_log.transactions_to_arrays()['kWh']) == trades
+    arrays = simulation.columnar_log.to_arrays()
+    assert np.round(arrays['revenue'], 3).tolist() == [row['revenue'] for row in simulation.log]
+
+
+def test_engines_give_the_same_columnar_logs():
+    expected, simulation = run_network(), run_network(vectorized=True)
+    for grid, other in zip(simulation.grids, expected.grids):
+        assert repr(grid.columnar_log.to_arrays()) == repr(other.columnar_log.to_arrays())
+        assert repr(grid.columnar_log.transactions_to_arrays()) == repr(other.columnar_log.transactions_to_arrays())
+
+
+@pytest.mark.parametrize('file_format', ['npy', 'parquet'])
+def test_saved_logs_load_back(file_format):
+    if file_format == 'parquet':
+        pytest.importorskip('pyarrow')
+    simulation = run_network()
+    grid = simulation.grids[0]
+    grid.save_logs(file_format=file_format)
+    simulation.save_logs(file_format=file_format)
+
+    suffix = '' if file_format == 'npy' else f'.{file_format}'
+    name = f'mini_grid_log_{grid.id}{suffix}'
+    for transactions, expected in ((False, grid.columnar_log.to_arrays()),
+                                   (True, grid.columnar_log.transactions_to_arrays())):
+        arrays = load_log(name, transactions=transactions, as_frame=False)
+        assert sorted(arrays) == sorted(expected)
+        for column, values in expected.items():
+            np.testing.assert_array_equal(arrays[column], values)
+    frame = load_log(f'simulation_log{suffix}')
+    np.testing.assert_array_equal(frame['revenue'].to_numpy(), simulation.columnar_log.to_arrays()['revenue'])
+
+
+def test_unknown_formats_are_rejected():
+    with pytest.raises(ValueError):
+        run_network().save_logs(file_format='xlsx')
@@ -0,0 +1,74 @@
+import ast
+import random
+
+import numpy as np
+import pytest
+
+from conftest import DEMAND_PROFILE, build_network
+from MasterNetwork import ConventionalGrid, House, MiniGrid, Simulation
+from market import MarketClearing
+from topology import Topology
+
+
+def delivered(market, flow):
+    n = len(market.grids)
+    return (np.bincount(market.source, flow, minlength=n),
+            np.bincount(market.target, flow * (1 - market.loss), minlength=n))
+
+
+def test_sources_split_their_supply_by_the_deficits():
+    market = MarketClearing(build_network(num_grids=3).grids)
+    sent, received = delivered(market, market.clear([3.0, 0, 0], [0, 1.0, 3.0]))
+    assert sent.tolist() == pytest.approx([3.0, 0, 0])
+    assert received.tolist() == pytest.approx([0, 0.75, 2.25])
+
+
+def test_clearing_honours_capacities_and_losses():
+    grids = build_network(num_grids=3).grids
+    market = MarketClearing(grids, topology=Topology(grids, [(1, 2, 0.5, 0.1), (1, 3, None, 0.2)]))
+    flow = market.clear([5.0, 0, 0], [0, 2.0, 2.0])
+    assert flow.max() <= 5.0
+    sent, received = delivered(market, flow)
+    assert received.tolist() == pytest.approx([0, 0.45, 2.0])
+    assert sent[0] == pytest.approx(0.5 + 2.0 / 0.8)
+
+
+@pytest.mark.parametrize('method', ['proportional', 'lp'])
+def test_results_do_not_depend_on_grid_order(method):
+    if method == 'lp':
+        pytest.importorskip('scipy')
+    grids = build_network().grids
+    supply, need = np.array([2.0, 0, 1.5, 0]), np.array([0, 1.0, 0, 4.0])
+    order = [2, 0, 3, 1]
+    _, received = delivered(MarketClearing(grids, method=method), MarketClearing(grids, method=method).clear(supply, need))
+    market = MarketClearing([grids[g] for g in order], method=method)
+    _, permuted = delivered(market, market.clear(supply[order], need[order]))
+    assert permuted.tolist() == pytest.approx(received[order].tolist())
+    assert received.sum() == pytest.approx(3.5)
+
+
+def sunny_and_dark_grids():
+    conventional_grid = ConventionalGrid(0.03, 0.06)
+    grids = [MiniGrid(id=g + 1, houses=[House(i, 0.5, DEMAND_PROFILE) for i in range(5)], avg_sunlight_hours=6,
+                      selling_price=0.05, num_days_backup=0.2, neighboring_grids=[],
+                      conventional_grid=conventional_grid, safety_factor=safety_factor)
+             for g, safety_factor in enumerate([4, 0.3, 0.5])]
+    for grid in grids:
+        grid.neighboring_grids = [other for other in grids if other is not grid]
+    return Simulation(conventional_grid, grids)
+
+
+def test_market_runs_trade_between_grids():
+    simulation = sunny_and_dark_grids()
+    simulation.market = MarketClearing(simulation.grids)
+    random.seed(3)
+    simulation.simulate_days(2)
+    trades = {action: 0.0 for action in ('supply', 'demand')}
+    for grid in simulation.grids:
+        for row in grid.log:
+            for _, kwh, action in ast.literal_eval(row['internal_grid_transactions_kWh']):
+                trades[action] += kwh
+    assert trades['supply'] > 0
+    assert trades['supply'] == pytest.approx(trades['demand'], abs=1e-2)  # Logged rounded to 3 decimals
+    with pytest.raises(ValueError):
+        simulation.simulate_days(1, vectorized=True)
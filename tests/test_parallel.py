@@ -0,0 +1,111 @@
+import random
+
+import pytest
+
+from benchmark import grid_scenario
+from MasterNetwork import HouseLogSink, build_simulation
+from engine import ArrayEngine
+from parallel import ParallelEngine, default_partitions
+from test_engines import logs
+
+MIXED = [[0, 5, 9], [1, 2, 3, 4], [6, 7, 8, 10, 11]]
+
+
+def scenario(kind):
+    scenario = grid_scenario(12, 4, neighbors=3, seed=1)
+    rng = random.Random(2)
+    for grid in scenario['grids']:
+        grid['safety_factor'] = rng.uniform(0.4, 2.5)
+        grid['num_days_backup'] = rng.uniform(0.3, 1.5)
+    if kind == 'topology':
+        scenario['topology'] = {'edges': [(a, b, 0.8, 0.05) for a in range(1, 13) for b in (a % 12 + 1, (a + 4) % 12 + 1)],
+                                'priority': 'surplus'}
+    if kind == 'sub-hourly':
+        scenario['step_minutes'] = 30
+    if kind == 'islands':
+        # Two rings of six grids that do not trade with each other
+        for i, grid in enumerate(scenario['grids']):
+            first = 6 * (i // 6)
+            grid['neighbors'] = [first + (i - first + k) % 6 + 1 for k in (1, 2)]
+    return scenario
+
+
+def run(kind, partitions=None, processes=None, serial=False):
+    simulation = build_simulation(scenario(kind), house_log=HouseLogSink(mode='off'))
+    simulation.configure_logs()
+    random.seed(7)
+    if partitions is None and processes is None:
+        simulation.simulate_days(2, vectorized=True)
+    elif partitions is None:
+        simulation.simulate_days(2, processes=processes)
+    else:
+        engine = ArrayEngine(simulation, partitions) if serial else ParallelEngine(simulation, partitions=partitions)
+        engine.run(0, 48)
+        simulation.clock = 48 * simulation.steps_per_hour
+        if not serial:
+            engine.close()
+    return simulation
+
+
+def columnar(simulation):
+    return [repr((grid.columnar_log.to_arrays(), grid.columnar_log.transactions_to_arrays(), grid.bank.log.rows()))
+            for grid in simulation.grids]
+
+
+def assert_same_runs(simulation, expected):
+    assert logs(simulation) == logs(expected)
+    assert columnar(simulation) == columnar(expected)
+    assert repr(simulation.columnar_log.to_arrays()) == repr(expected.columnar_log.to_arrays())
+
+
+@pytest.mark.parametrize('kind', ['ring', 'topology', 'sub-hourly'])
+def test_one_partition_matches_the_array_engine(kind):
+    assert_same_runs(run(kind, partitions=[list(range(12))]), run(kind))
+
+
+def test_partitions_that_do_not_trade_match_the_array_engine():
+    assert_same_runs(run('islands', partitions=[list(range(6)), list(range(6, 12))]), run('islands'))
+
+
+@pytest.mark.parametrize('kind', ['ring', 'topology', 'sub-hourly'])
+@pytest.mark.parametrize('partitions', [None, MIXED], ids=['default', 'mixed'])
+def test_parallel_runs_match_the_partitioned_serial_run(kind, partitions):
+    expected = run(kind, partitions=partitions or default_partitions([4] * 12, 3), serial=True)
+    simulation = run(kind, partitions=partitions, processes=None if partitions else 3)
+    assert_same_runs(simulation, expected)
+
+    # Grids of different partitions did trade with each other
+    owner = {g: p for p, part in enumerate(partitions or default_partitions([4] * 12, 3)) for g in part}
+    index = {grid.id: g for g, grid in enumerate(simulation.grids)}
+    trades = [(g, index[entry[0]]) for g, grid in enumerate(simulation.grids) for row in grid.log
+              for entry in eval(row['internal_grid_transactions_kWh'])]
+    assert any(owner[g] != owner[n] for g, n in trades)
+
+
+def test_parallel_runs_are_deterministic():
+    assert_same_runs(run('topology', partitions=MIXED), run('topology', partitions=MIXED))
+
+
+def test_workers_are_kept_between_runs():
+    simulation = build_simulation(scenario('ring'), house_log=HouseLogSink(mode='off'))
+    simulation.configure_logs()
+    random.seed(7)
+    simulation.simulate_days(1, processes=3)
+    engine = simulation.parallel
+    pids = [worker.pid for worker in engine.workers]
+    simulation.simulate_days(1, processes=3)
+    assert simulation.parallel is engine
+    assert [worker.pid for worker in engine.workers] == pids
+    assert_same_runs(simulation, run('ring', partitions=default_partitions([4] * 12, 3), serial=True))
+
+    simulation.simulate_days(1, processes=2)
+    assert simulation.parallel is not engine and not any(worker.is_alive() for worker in engine.workers)
+    simulation.parallel.close()
+    with pytest.raises(RuntimeError):
+        simulation.parallel.run(72, 24)
+
+
+def test_parallel_runs_need_house_logging_off():
+    simulation = build_simulation(scenario('ring'), house_log=HouseLogSink(mode='sampled'))
+    with pytest.raises(ValueError):
+        simulation.simulate_days(1, processes=2)
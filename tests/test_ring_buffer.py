@@ -0,0 +1,83 @@
+import glob
+import random
+from collections import deque
+
+import numpy as np
+import pytest
+
+from conftest import build_network
+from logs import RingBuffer
+
+
+DTYPE = [('hour', 'i8'), ('kWh', 'f8')]
+
+
+def filled(n, **kwargs):
+    buffer = RingBuffer(DTYPE, **kwargs)
+    for hour in range(n):
+        buffer.append((hour, hour / 2))
+    return buffer
+
+
+def test_unbounded_buffers_keep_every_row():
+    buffer = filled(3000)
+    assert len(buffer) == 3000
+    assert buffer.rows()['hour'].tolist() == list(range(3000))
+
+
+def test_bounded_buffers_keep_the_last_rows():
+    buffer = filled(25, capacity=10)
+    assert len(buffer) == 10
+    assert buffer.rows()['hour'].tolist() == list(range(15, 25))
+    assert buffer.tail(4)['hour'].tolist() == [21, 22, 23, 24]
+    assert buffer.tail(7)['hour'].tolist() == list(range(18, 25))
+
+
+def test_aggregates_cover_evicted_rows():
+    summary = filled(25, capacity=10).summary()
+    assert summary['hour'] == {'count': 25, 'sum': 300.0, 'min': 0.0, 'max': 24.0, 'mean': 12.0}
+    assert summary['kWh']['sum'] == 150.0
+
+
+def test_full_buffers_are_spilled():
+    buffer = filled(25, capacity=10, spill_to='spill')
+    assert buffer.spilled == ['spill_0.npz', 'spill_1.npz']
+    spilled = [np.load(name)['hour'].tolist() for name in buffer.spilled]
+    assert spilled == [list(range(10)), list(range(10, 20))]
+    assert buffer.rows()['hour'].tolist() == list(range(20, 25))
+    assert buffer.summary()['hour']['count'] == 25
+
+
+def test_cleared_rows_stay_in_the_aggregates():
+    buffer = filled(5)
+    buffer.clear()
+    assert len(buffer) == 0
+    assert buffer.summary()['hour']['max'] == 4.0
+
+
+def test_capacity_should_be_positive():
+    with pytest.raises(ValueError):
+        RingBuffer(DTYPE, capacity=0)
+
+
+def test_configured_logs_are_bounded():
+    expected = build_network()
+    expected.configure_logs()
+    random.seed(3)
+    expected.simulate_days(2)
+
+    simulation = build_network()
+    simulation.configure_logs(capacity=12, spill_to='run_')
+    random.seed(3)
+    simulation.simulate_days(2)
+
+    assert isinstance(simulation.log, deque) and list(simulation.log) == list(expected.log)[-12:]
+    for grid, other in zip(simulation.grids, expected.grids):
+        assert list(grid.log) == list(other.log)[-12:]
+        assert all(len(house.log) <= 12 for house in grid.houses)
+    assert len(glob.glob('run_mini_grid_log_?_?.npz')) == 3 * len(simulation.grids)
+
+    summary = simulation.summary()
+    revenue = expected.columnar_log.to_arrays()['revenue']
+    assert summary['simulation']['revenue']['count'] == 48
+    assert summary['simulation']['revenue']['sum'] == pytest.approx(revenue.sum())
@@ -0,0 +1,105 @@
+import json
+import os
+import random
+
+import numpy as np
+import pytest
+
+from MasterNetwork import HouseLogSink, build_simulation, example_scenario, load_scenario
+
+
+TOML = """
+[conventional_grid]
+buying_price = 0.03
+selling_price = 0.06
+
+[houses]
+file = "data/houses.npz"
+
+[edges]
+file = "data/edges.npy"
+
+[[grids]]
+id = 1
+avg_sunlight_hours = 8
+selling_price = 0.05
+num_days_backup = 5
+safety_factor = 1.5
+demand_profile = [1.2, 1.1, 1.0, 0.9, 0.8, 0.7, 0.6, 0.7, 0.8, 0.9, 1.0, 1.2, 1.4, 1.5, 1.6, 1.7, 1.8, 1.9, 1.8, 1.7, 1.6, 1.5, 1.3, 1.2]
+
+[[grids]]
+id = 2
+avg_sunlight_hours = 5
+selling_price = 0.05
+num_days_backup = 5
+safety_factor = 1.5
+demand_profile = [1.2, 1.1, 1.0, 0.9, 0.8, 0.7, 0.6, 0.7, 0.8, 0.9, 1.0, 1.2, 1.4, 1.5, 1.6, 1.7, 1.8, 1.9, 1.8, 1.7, 1.6, 1.5, 1.3, 1.2]
+"""
+
+
+def write_scenario(directory):
+    os.makedirs(directory / 'data')
+    np.savez(directory / 'data' / 'houses.npz', grid=[1, 2, 1, 2, 2], base_demand=[0.5, 0.4, 0.6, 0.3, 0.5])
+    np.save(directory / 'data' / 'edges.npy', np.array([[1, 2], [2, 1]]))
+    (directory / 'scenario.toml').write_text(TOML)
+
+
+def run(scenario):
+    simulation = build_simulation(scenario, house_log=HouseLogSink(mode='off'))
+    simulation.configure_logs()
+    random.seed(4)
+    simulation.simulate_days(2)
+    return simulation
+
+
+def test_toml_and_json_files_give_the_same_scenario(tmp_path, monkeypatch):
+    write_scenario(tmp_path / 'site')
+    monkeypatch.chdir(tmp_path)  # Array files resolve against the scenario file, not the working directory
+    scenario = load_scenario(str(tmp_path / 'site' / 'scenario.toml'))
+    assert scenario['houses']['file'] == str(tmp_path / 'site' / 'data' / 'houses.npz')
+    assert scenario['edges']['file'] == str(tmp_path / 'site' / 'data' / 'edges.npy')
+
+    relative = dict(scenario, houses={'file': 'data/houses.npz'}, edges={'file': 'data/edges.npy'})
+    (tmp_path / 'site' / 'scenario.json').write_text(json.dumps(relative))
+    assert load_scenario(str(tmp_path / 'site' / 'scenario.json')) == scenario
+
+    simulation = run(scenario)
+    assert [len(grid.bank) for grid in simulation.grids] == [2, 3]
+    assert [[neighbor.id for neighbor in grid.neighboring_grids] for grid in simulation.grids] == [[2], [1]]
+
+
+def test_house_tables_match_the_per_grid_form():
+    scenario = example_scenario()
+    houses = {'grid': [], 'base_demand': []}
+    table = dict(scenario, grids=[])
+    for spec in scenario['grids']:
+        houses['grid'] += [spec['id']] * spec['num_houses']
+        houses['base_demand'] += [spec['base_demand']] * spec['num_houses']
+        table['grids'].append({name: value for name, value in spec.items() if name not in ('num_houses', 'base_demand')})
+    table['houses'] = houses
+
+    expected, simulation = run(scenario), run(table)
+    for grid, other in zip(simulation.grids, expected.grids):
+        assert grid.total_daily_energy_requirement == pytest.approx(other.total_daily_energy_requirement, rel=1e-12)
+        assert grid.battery.capacity == pytest.approx(other.battery.capacity, rel=1e-12)
+        for column, values in grid.columnar_log.to_arrays().items():
+            np.testing.assert_allclose(values, other.columnar_log.to_arrays()[column], rtol=1e-9, atol=1e-9)
+
+
+def test_errors_name_every_offending_grid():
+    scenario = example_scenario()
+    scenario['grids'][0]['safety_factor'] = 0
+    scenario['grids'][2]['safety_factor'] = -1
+    with pytest.raises(ValueError, match=r'^MiniGrid 1, 3: safety_factor'):
+        build_simulation(scenario)
+
+
+@pytest.mark.parametrize('change', [{'houses': {'grid': [9], 'base_demand': [1.0]}},
+                                    {'edges': [[1, 7]]},
+                                    {'edges': [[1, 1]]}])
+def test_unknown_grids_in_tables_are_rejected(change):
+    scenario = example_scenario()
+    for spec in scenario['grids']:
+        spec.pop('neighbors')
+    with pytest.raises(ValueError):
+        build_simulation(dict(scenario, **change))
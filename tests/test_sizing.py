@@ -0,0 +1,64 @@
+import random
+
+import numpy as np
+import pytest
+
+from MasterNetwork import HouseLogSink, build_simulation, example_scenario
+from sizing import SizingOptimizer, optimize_sizing
+
+
+def optimizer(**kwargs):
+    return SizingOptimizer(example_scenario(), target=0.1, num_days=3, battery_days=(0.5, 1, 2), **kwargs)
+
+
+def test_surrogate_buys_less_with_more_capacity():
+    table = optimizer().surrogate(0, np.geomspace(0.25, 4, 12)[:, None], np.array([0.5, 1, 2])[None, :])
+    assert table.shape == (12, 3)
+    assert (np.diff(table, axis=0) <= 1e-12).all()
+    assert (np.diff(table, axis=1) <= 1e-12).all()
+    assert table[0, 0] > 0.1 > table[-1, -1]
+
+
+def test_full_runs_are_memoized():
+    search = optimizer()
+    assert search.evaluate(search.sizes) == search.evaluate(list(search.sizes))
+    assert (search.full_runs, search.cache_hits) == (1, 1)
+
+
+def test_sized_grids_meet_the_target():
+    result = optimize_sizing(example_scenario(), target=0.1, num_days=3, battery_days=(0.5, 1, 2))
+    assert all(grid['meets_target'] for grid in result['grids'].values())
+    for grid, spec in zip(result['grids'].values(), result['scenario']['grids']):
+        assert (grid['safety_factor'], grid['num_days_backup']) == (spec['safety_factor'], spec['num_days_backup'])
+        assert 0.25 <= grid['safety_factor'] <= 4
+
+
+@pytest.mark.parametrize('kwargs', [{'target': 1}, {'battery_days': (0, 1)}, {'safety_factors': (2, 1)}])
+def test_invalid_settings_are_rejected(kwargs):
+    with pytest.raises(ValueError):
+        SizingOptimizer(example_scenario(), **kwargs)
+
+
+def test_surrogate_sees_the_pv_output_of_the_full_runs():
+    search = optimizer()
+    search.evaluate(search.sizes)
+    scenario = search.sized_scenario()
+    simulation = build_simulation(scenario, house_log=HouseLogSink(mode='off'))
+    simulation.configure_logs()
+    random.seed(search.seed)
+    simulation.simulate_days(search.num_days, vectorized=True)
+    for g, grid in enumerate(simulation.grids):
+        np.testing.assert_allclose(grid.columnar_log.to_arrays()['generation_kWh'], grid.solar_pv.capacity * search.pv_per_kw[:, g])
+
+
+def test_sizing_is_no_worse_than_a_brute_force_scan():
+    scenario = example_scenario()
+    scenario['grids'] = [dict(scenario['grids'][0], neighbors=[])]
+    search = SizingOptimizer(scenario, target=0.1, num_days=3, battery_days=(0.5, 1, 2))
+    result = search.optimize()['grids'][1]
+    assert result['meets_target']
+
+    scan = SizingOptimizer(scenario, target=0.1, num_days=3, battery_days=(0.5, 1, 2))
+    costs = [scan.cost(0, safety_factor, days) for days in scan.battery_days for safety_factor in np.geomspace(0.25, 4, 40)
+             if scan.evaluate([(safety_factor, days)])[0] <= scan.target]
+    assert result['cost_USD'] <= min(costs) / (1 - search.tolerance)
@@ -0,0 +1,58 @@
+import random
+
+import numpy as np
+import pytest
+
+from MasterNetwork import HouseLogSink, SolarSite, build_simulation, example_scenario, pv_trace, sunlight_intensity
+from test_engines import logs
+
+
+def test_sites_without_a_latitude_follow_the_sunlight_curve():
+    trace = pv_trace()
+    assert len(trace) == 8760
+    np.testing.assert_array_equal(trace.reshape(365, 24), np.tile(sunlight_intensity, (365, 1)))
+    site = SolarSite(start_day=10)
+    assert [site.output(hours) for hours in (0, 6.5, 30)] == [sunlight_intensity[0], sunlight_intensity[6],
+                                                               sunlight_intensity[6]]
+
+
+def test_traces_follow_the_seasons_and_the_clouds():
+    north = pv_trace(latitude=50).reshape(365, 24)
+    assert north[172].sum() > 2 * north[355].sum()  # June against December
+    assert north[172, 0] == 0 and north[172, 12] > 0.85
+    cloudy = pv_trace(latitude=50, cloudiness=0.6, seed=1)
+    assert (cloudy <= pv_trace(latitude=50)).all() and cloudy.sum() < 0.9 * north.sum()
+    with pytest.raises(ValueError):
+        pv_trace(latitude=50, cloudiness=1.5)
+    with pytest.raises(ValueError):
+        pv_trace(latitude=95)
+
+
+def test_traces_are_shared_and_read_only():
+    scenario = example_scenario()
+    for grid in scenario['grids']:
+        grid['site'] = {'latitude': 10, 'cloudiness': 0.3, 'seed': 5}
+    simulation = build_simulation(scenario, house_log=HouseLogSink(mode='off'))
+    traces = {id(grid.solar_pv.site.trace) for grid in simulation.grids}
+    assert traces == {id(pv_trace(10, 0.3, 0.7, 5))}
+    with pytest.raises(ValueError):
+        simulation.grids[0].solar_pv.site.trace[0] = 1
+
+
+def sited_scenario():
+    scenario = example_scenario()
+    scenario['grids'][0]['site'] = {'latitude': -20, 'cloudiness': 0.4, 'seed': 3, 'start_day': 100}
+    scenario['grids'][2]['site'] = {}
+    return scenario
+
+
+@pytest.mark.parametrize('step_minutes', [60, 30])
+def test_engines_agree_on_a_sited_scenario(step_minutes):
+    runs = []
+    for vectorized in (False, True):
+        simulation = build_simulation(dict(sited_scenario(), step_minutes=step_minutes),
+                                      house_log=HouseLogSink(mode='off'))
+        random.seed(8)
+        simulation.simulate_days(3, vectorized=vectorized)
+        runs.append(logs(simulation))
+    assert runs[0] == runs[1]
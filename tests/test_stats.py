@@ -0,0 +1,77 @@
+import random
+import threading
+
+import pytest
+
+import jobs
+from MasterNetwork import build_simulation, example_scenario
+from conftest import build_network
+from logs import HouseLogSink
+from stats import SimulationStats
+from test_engines import logs
+
+
+def test_concurrent_runs_count_every_step():
+    stats = SimulationStats()
+    simulations = [build_simulation(example_scenario(), house_log=HouseLogSink(mode='off')) for _ in range(4)]
+    for simulation in simulations:
+        simulation.enable_stats(stats)
+    threads = [threading.Thread(target=simulation.simulate_days, args=(3,)) for simulation in simulations]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert stats.steps == 4 * 72
+    assert stats.snapshot()['phases']['logging']['calls'] > 0
+
+
+def test_job_runs_are_merged(scenario):
+    jobs._init_worker([False], [0])
+    result = jobs.run_job(0, scenario, 1, 0, True, stats=True)
+    stats = SimulationStats()
+    stats.merge(result['stats'])
+    stats.merge(result['stats'])
+    assert stats.steps == 2 * 24
+    assert 'sole_steps_total 48' in stats.to_prometheus()
+
+
+def run(stats=False, **kwargs):
+    simulation = build_network()
+    if stats:
+        simulation.enable_stats()
+    random.seed(3)
+    simulation.simulate_days(2, **kwargs)
+    return simulation
+
+
+@pytest.mark.parametrize('vectorized', [False, True])
+def test_stats_leave_the_run_unchanged(vectorized):
+    simulation = run(stats=True, vectorized=vectorized)
+    assert logs(simulation) == logs(run(vectorized=vectorized))
+    snapshot = simulation.stats.snapshot()
+    assert snapshot['steps'] == 48
+    for phase in ('step', 'generation', 'logging'):
+        assert snapshot['phases'][phase]['calls'] > 0 and snapshot['phases'][phase]['seconds'] > 0
+    assert 'allocated_blocks' not in snapshot['phases']['step']
+
+
+def test_only_the_profiled_simulation_is_wrapped():
+    simulation, other = build_network(), build_network()
+    stats = simulation.enable_stats(SimulationStats(allocations=True))
+    assert hasattr(simulation.grids[0].step, '__wrapped__')
+    assert not hasattr(other.grids[0].step, '__wrapped__')
+    other.simulate_days(1)
+    assert stats.steps == 0
+
+    simulation.disable_stats()
+    assert not hasattr(simulation.grids[0].step, '__wrapped__') and simulation.stats is None
+
+
+def test_counters_are_exported_for_prometheus():
+    stats = run(stats=True).stats
+    text = stats.to_prometheus()
+    assert 'sole_steps_total 48\n' in text
+    assert '# TYPE sole_phase_seconds_total counter' in text
+    assert sum(line.startswith('sole_phase_calls_total{phase=') for line in text.splitlines()) == len(stats.phases)
+    stats.reset()
+    assert stats.snapshot()['steps'] == 0
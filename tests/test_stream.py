@@ -0,0 +1,38 @@
+import random
+
+import pytest
+
+from MasterNetwork import HouseLogSink, build_simulation, example_scenario
+
+
+def build():
+    return build_simulation(example_scenario(), house_log=HouseLogSink(mode='off'))
+
+
+@pytest.mark.parametrize('vectorized', [False, True])
+def test_deltas_follow_the_logs_of_a_plain_run(vectorized):
+    expected = build()
+    random.seed(1)
+    expected.simulate_days(2)
+
+    simulation = build()
+    random.seed(1)
+    deltas = list(simulation.stream(48, block_hours=10, vectorized=vectorized))
+    assert [delta['simulation_hour'] for delta in deltas] == list(range(48))
+    for delta, row in zip(deltas, expected.log):
+        assert round(delta['revenue'], 3) == row['revenue']
+        assert round(delta['total_generation'], 3) == row['total_generation']
+    for g, grid in enumerate(expected.grids):
+        assert [round(delta['grids'][g]['battery_level_kWh'], 3) for delta in deltas] == \
+               [row['battery_level_kWh'] for row in grid.log]
+        transfers = sum(len(delta['grids'][g]['transfers']) for delta in deltas)
+        assert transfers == len(grid.columnar_log.transactions_to_arrays()['kWh'])
+
+
+def test_streams_without_logs_keep_one_block():
+    simulation = build()
+    random.seed(1)
+    hours = [delta['simulation_hour'] for delta in simulation.stream(72, block_hours=24, keep_logs=False)
+             if len(simulation.log) == 24]  # Cleared before the next block runs
+    assert hours == list(range(72))
+    assert simulation.log == [] and all(grid.log == [] for grid in simulation.grids)
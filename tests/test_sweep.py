@@ -0,0 +1,51 @@
+import random
+
+import pandas as pd
+import pytest
+
+from MasterNetwork import build_simulation, example_scenario
+from logs import HouseLogSink
+from sweep import apply_parameters, run_scenario, summarize, sweep
+
+
+def test_summary_has_no_constant_columns(scenario):
+    for grid in scenario['grids']:
+        grid['safety_factor'] = 0.3  # Too little PV, so the grids buy energy
+    summary = run_scenario(scenario, 0, 3)
+    assert 'unmet_demand_kWh' not in summary
+    assert summary['grid_purchases_kWh'] > 0
+
+
+def test_summary_matches_the_engines(scenario):
+    summaries = []
+    for vectorized in (False, True):
+        simulation = build_simulation(scenario, house_log=HouseLogSink(mode='off'))
+        random.seed(1)
+        simulation.simulate_days(3, vectorized=vectorized)
+        summaries.append(summarize(simulation))
+    assert summaries[0] == pytest.approx(summaries[1])
+
+
+PARAMETER_GRID = {'safety_factor': [1.0, 2.0], 'conventional_selling_price': [0.06, 0.1]}
+
+
+def test_pool_and_serial_sweeps_agree():
+    serial = sweep(example_scenario(), PARAMETER_GRID, num_days=2, seed=5, processes=1)
+    pooled = sweep(example_scenario(), PARAMETER_GRID, num_days=2, seed=5, processes=2)
+    pd.testing.assert_frame_equal(pooled, serial)
+
+    assert serial[['safety_factor', 'conventional_selling_price', 'seed']].values.tolist() == [
+        [1.0, 0.06, 5], [1.0, 0.1, 6], [2.0, 0.06, 7], [2.0, 0.1, 8]]
+
+
+def test_parameters_are_applied_to_a_copy():
+    scenario = example_scenario()
+    changed = apply_parameters(scenario, {'num_days_backup': 2, 'conventional_buying_price': 0.01})
+    assert {grid['num_days_backup'] for grid in changed['grids']} == {2}
+    assert changed['conventional_grid']['buying_price'] == 0.01
+    assert scenario == example_scenario()
+
+
+def test_unknown_parameters_are_rejected():
+    with pytest.raises(ValueError, match='battery_size'):
+        apply_parameters(example_scenario(), {'battery_size': 3})
@@ -0,0 +1,81 @@
+import random
+
+import numpy as np
+import pytest
+
+from MasterNetwork import build_simulation
+from conftest import build_network
+from logs import HouseLogSink
+from test_engines import logs
+from topology import Topology
+
+
+def line_use_per_hour(scenario, **kwargs):
+    simulation = build_simulation(scenario, house_log=HouseLogSink(mode='off'))
+    ledger = simulation.enable_ledger()
+    random.seed(4)
+    simulation.simulate_days(3, **kwargs)
+    rows = ledger.to_arrays()
+    supply = rows['action'] == 'supply'
+    # Energy between two grids goes over the lines both ways: offered on the
+    # sender's line or requested on the receiver's
+    pair = np.sort(np.stack([rows['from_grid'][supply], rows['to_grid'][supply]], axis=1), axis=1)
+    keys = np.column_stack([np.floor(rows['simulation_hour'][supply]), pair])
+    _, inverse = np.unique(keys, axis=0, return_inverse=True)
+    return np.bincount(inverse.ravel(), rows['kWh'][supply])
+
+
+@pytest.mark.parametrize('market, kwargs', [(False, {}), (False, {'vectorized': True}), (True, {})],
+                         ids=['object', 'vectorized', 'market'])
+def test_line_capacity_is_per_hour_on_a_sub_hour_clock(scenario, market, kwargs):
+    ids = [grid['id'] for grid in scenario['grids']]
+    for g, grid in enumerate(scenario['grids']):
+        grid['avg_sunlight_hours'] = 12 if g % 2 else 1  # Sunny grids next to dark ones
+    scenario = dict(scenario, step_minutes=15,
+                    topology={'edges': [(a, b, 0.5, 0.05) for a, b in zip(ids, ids[1:] + ids[:1])]})
+    if market:
+        scenario['market'] = {'method': 'proportional'}
+    used = line_use_per_hour(scenario, **kwargs)
+    # Energy flows from the sunny grids only, so a full line carries 0.5 kWh an hour
+    assert used.max() == pytest.approx(0.5)
+
+
+def run(simulation, **kwargs):
+    random.seed(3)
+    simulation.simulate_days(2, **kwargs)
+    return logs(simulation)
+
+
+@pytest.mark.parametrize('vectorized', [False, True])
+def test_neighbor_topology_gives_the_same_run(vectorized):
+    simulation = build_network()
+    Topology.from_neighbors(simulation.grids).attach()
+    assert run(simulation, vectorized=vectorized) == run(build_network(), vectorized=vectorized)
+
+
+@pytest.mark.parametrize('vectorized', [False, True])
+def test_closed_lines_isolate_the_grids(vectorized):
+    expected = build_network()
+    for grid in expected.grids:
+        grid.neighboring_grids = []
+
+    simulation = build_network()
+    edges = [(grid.id, other.id, 0) for grid in simulation.grids for other in simulation.grids if grid.id < other.id]
+    Topology(simulation.grids, edges).attach()
+    assert run(simulation, vectorized=vectorized) == run(expected, vectorized=vectorized)
+
+
+def test_partners_come_from_the_csr_rows():
+    simulation = build_network()
+    topology = Topology(simulation.grids, [(1, 2, None, 0.1), (1, 3, None, 0.02), (2, 4)], priority='loss')
+    assert topology.neighbors(0).tolist() == [2, 1]  # Lowest loss first
+    assert topology.neighbors(1).tolist() == [3, 0]
+    assert topology.neighbors(3).tolist() == [1]
+    topology.attach()
+    assert [grid.id for grid in simulation.grids[0].neighboring_grids] == [3, 2]
+
+
+@pytest.mark.parametrize('edge', [(1, 9), (1, 2, -1), (1, 2, None, 1)])
+def test_invalid_lines_are_rejected(edge):
+    with pytest.raises(ValueError):
+        Topology(build_network().grids, [edge])
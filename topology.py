@@ -0,0 +1,130 @@
+import numpy as np
+
+
+class Topology:
+    """
+    Sparse network of lines between mini-grids, stored in CSR form.
+
+    Every directed line g -> n has a capacity (kWh per hour, shared by all
+    trades on it within the hour) and a loss fraction of the energy sent.
+    Exchange partners are looked up through the CSR index of the grid and
+    ordered by `priority`:
+        'order'   - edge list order, like neighboring_grids
+        'surplus' - neighbours with the most room (when offering) or the most
+                    energy to give (when asking) first
+        'loss'    - lowest-loss lines first
+
+    :param grids: The MiniGrids of the network, in simulation order.
+    :param edges: (from_id, to_id) or (from_id, to_id, capacity, loss) tuples.
+                  A capacity of None means unlimited.
+    :param symmetric: Add the reverse line for every edge.
+    """
+
+    def __init__(self, grids, edges, priority='order', symmetric=True):
+        if priority not in ('order', 'surplus', 'loss'):
+            raise ValueError("priority should be 'order', 'surplus' or 'loss'.")
+
+        self.grids = list(grids)
+        self.index = {grid.id: g for g, grid in enumerate(self.grids)}
+        self.priority = priority
+
+        lines = [[] for _ in self.grids]
+        for edge in edges:
+            from_id, to_id = edge[0], edge[1]
+            capacity = edge[2] if len(edge) > 2 and edge[2] is not None else np.inf
+            loss = edge[3] if len(edge) > 3 else 0.0
+            if capacity < 0:
+                raise ValueError("line capacity should not be negative.")
+            if not 0 <= loss < 1:
+                raise ValueError("line loss should be between 0 and 1.")
+            if from_id not in self.index or to_id not in self.index:
+                raise ValueError(f"Line {from_id} -> {to_id} connects a grid that is not in the network.")
+
+            lines[self.index[from_id]].append((self.index[to_id], capacity, loss))
+            if symmetric:
+                lines[self.index[to_id]].append((self.index[from_id], capacity, loss))
+
+        if priority == 'loss':
+            lines = [sorted(out, key=lambda line: line[2]) for out in lines]
+
+        self.indptr = np.cumsum([0] + [len(out) for out in lines])
+        self.indices = np.array([n for out in lines for n, _, _ in out], dtype=np.int64)
+        self.capacity = np.array([capacity for out in lines for _, capacity, _ in out], dtype=float)
+        self.loss = np.array([loss for out in lines for _, _, loss in out], dtype=float)
+
+        # Plain lists for the per-trade hot path
+        self.lines = [list(range(self.indptr[g], self.indptr[g + 1])) for g in range(len(self.grids))]
+        self.targets = self.indices.tolist()
+        self.line_capacity = self.capacity.tolist()
+        self.line_loss = self.loss.tolist()
+        self.used = [0.0] * len(self.targets)  # Energy sent on each line this hour
+        self.hour = None
+
+    @classmethod
+    def from_neighbors(cls, grids, priority='order'):
+        """
+        Topology with an unlimited, lossless line for every entry of neighboring_grids.
+        """
+        edges = [(grid.id, ng.id) for grid in grids for ng in grid.neighboring_grids]
+        return cls(grids, edges, priority=priority, symmetric=False)
+
+    def attach(self):
+        """
+        Make the grids trade through this topology. neighboring_grids is
+        rewritten to match the lines.
+        """
+        for g, grid in enumerate(self.grids):
+            grid.topology = self
+            grid.neighboring_grids = [self.grids[self.targets[line]] for line in self.lines[g]]
+        return self
+
+    def neighbors(self, g):
+        return self.indices[self.indptr[g]:self.indptr[g + 1]]
+
+    def start_hour(self, hours):
+        # Line capacities are per hour, shared by the steps of a sub-hour clock
+        hour = int(hours // 1)
+        if hour != self.hour:
+            self.hour = hour
+            self.used = [0.0] * len(self.targets)
+
+    def ordered_lines(self, g, key, lines=None):
+        """
+        Lines out of grid index g in the order they are tried. key(n) is the
+        priority of grid index n under the 'surplus' priority, highest first.
+        lines limits them to a subset of the grid's lines.
+        """
+        lines = self.lines[g] if lines is None else lines
+        if self.priority == 'surplus':
+            lines = sorted(lines, key=lambda line: -key(self.targets[line]))
+        return lines
+
+    def partners(self, grid, direction):
+        if direction == 'supply':
+            key = lambda n: self.grids[n].battery.capacity - self.grids[n].battery.level
+        else:
+            key = lambda n: self.grids[n].available_energy()
+        return [(self.grids[self.targets[line]], line) for line in self.ordered_lines(self.index[grid.id], key)]
+
+    def remaining(self, line):
+        return max(self.line_capacity[line] - self.used[line], 0)
+
+    def offer(self, line, amount, receiver, from_grid_id):
+        """
+        Send surplus over a line. Returns the surplus left with the sender.
+        """
+        offered = min(amount, self.remaining(line))
+        loss = self.line_loss[line]
+        not_accepted = receiver.accept_energy(offered * (1 - loss), from_grid_id=from_grid_id)
+        excess = (amount - offered) + not_accepted / (1 - loss)
+        self.used[line] += amount - excess
+        return excess
+
+    def request(self, line, amount_needed, provider, to_grid_id):
+        """
+        Ask for energy over a line. Returns the energy delivered after losses.
+        """
+        loss = self.line_loss[line]
+        energy_sent = provider.provide_energy(min(amount_needed / (1 - loss), self.remaining(line)), to_grid_id=to_grid_id)
+        self.used[line] += energy_sent
+        return energy_sent * (1 - loss)